@@ -0,0 +1,304 @@
+"""
+Batch-size and DataLoader autotuning for the node a job lands on
+
+CHTC nodes differ widely in CPU count, RAM and GPU memory, so fixed values
+(batch_size=8, num_workers=4) either waste an H200 or overload a small node.
+autotune():
+1. Probes the largest batch that fits in GPU memory for a full
+   forward + backward, with and without activation checkpointing, and
+   keeps the variant with the higher throughput (samples/s)
+2. Picks the smallest worker count / prefetch factor / pin_memory setting
+   whose loading rate keeps up with that training step
+3. Scales the learning rate to the new batch size
+
+The chosen configuration is cached per hardware fingerprint (CPU count, RAM,
+GPU model and memory, torch version) and workload (input shape, model
+config), so later jobs on the same kind of node start immediately.
+"""
+import hashlib
+import json
+import math
+import os
+import time
+from copy import deepcopy
+from datetime import datetime
+from pathlib import Path
+
+import torch
+from torch.utils.data import DataLoader
+
+AUTOTUNE_CACHE = "autotune_cache.json"
+
+
+def _total_ram_bytes():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, AttributeError, OSError):
+        return None
+
+
+def hardware_fingerprint(device):
+    """Description of the node that the tuned configuration depends on"""
+    ram = _total_ram_bytes()
+    info = {
+        "cpu_count": len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count(),
+        "ram_gb": round(ram / 1024 ** 3) if ram else None,
+        "torch": torch.__version__,
+        "gpu": None,
+        "gpu_mem_gb": None,
+    }
+    if str(device).startswith("cuda") and torch.cuda.is_available():
+        props = torch.cuda.get_device_properties(0)
+        info["gpu"] = props.name
+        info["gpu_mem_gb"] = round(props.total_memory / 1024 ** 3)
+    return info
+
+
+def _cache_key(hardware, workload):
+    blob = json.dumps({"hardware": hardware, "workload": workload}, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode()).hexdigest()[:16]
+
+
+def _load_cache(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(path, cache):
+    path = Path(path)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp, path)
+
+
+def scale_learning_rate(lr, base_batch_size, batch_size, rule="sqrt"):
+    """
+    Learning rate for ``batch_size``, given one tuned for ``base_batch_size``
+
+    Args:
+        rule: "sqrt" (square-root scaling, the usual choice for Adam/AdamW),
+            "linear" (Goyal et al., for SGD) or "none"
+    """
+    ratio = batch_size / base_batch_size
+    if rule == "linear":
+        return lr * ratio
+    if rule == "sqrt":
+        return lr * math.sqrt(ratio)
+    if rule == "none":
+        return lr
+    raise ValueError(f"Unknown LR scaling rule: {rule}")
+
+
+def probe_batch_size(model, step_fn, sample_shape, device, max_batch_size=256,
+                     start=8, safety=0.9):
+    """
+    Largest batch for which ``step_fn`` (forward + backward) fits in GPU memory
+
+    Doubles the batch from ``start`` until it runs out of memory, then
+    binary-searches between the last size that fit and the first that
+    did not. The result is scaled by ``safety`` to leave room for
+    fragmentation and optimizer state. Model weights and BatchNorm
+    statistics are restored afterwards.
+
+    Args:
+        model: nn.Module on ``device``
+        step_fn: callable(model, batch) running forward and backward
+        sample_shape: shape of one sample, e.g. (T, 1, 128, 128)
+
+    Returns:
+        batch_size, samples_per_s (throughput at that batch size)
+    """
+    state = deepcopy(model.state_dict())
+    model.train()
+
+    def run(bs):
+        x = torch.rand(bs, *sample_shape, device=device)
+        step_fn(model, x)
+        model.zero_grad(set_to_none=True)
+        if device == "cuda":
+            torch.cuda.synchronize()
+
+    def fits(bs):
+        oom = False
+        try:
+            run(bs)
+        except torch.cuda.OutOfMemoryError:
+            oom = True
+        # Free the failed attempt outside the except block, where the
+        # traceback no longer holds references to its tensors
+        model.zero_grad(set_to_none=True)
+        if device == "cuda":
+            torch.cuda.empty_cache()
+        return not oom
+
+    try:
+        if device != "cuda":
+            # Running out of host memory cannot be caught; keep the configured size
+            best = start
+        else:
+            lo, hi = 0, max_batch_size + 1
+            bs = start
+            while bs <= max_batch_size:
+                if not fits(bs):
+                    hi = bs
+                    break
+                lo = bs
+                bs *= 2
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if fits(mid):
+                    lo = mid
+                else:
+                    hi = mid
+            if lo == 0:
+                raise RuntimeError("Even a batch of 1 does not fit in GPU memory")
+            # Only back off if the probe actually hit the memory limit
+            best = lo if hi > max_batch_size else max(1, int(lo * safety))
+
+        # Throughput at the chosen size (first call warms up cudnn)
+        run(best)
+        t = time.perf_counter()
+        run(best)
+        samples_per_s = best / (time.perf_counter() - t)
+    finally:
+        model.load_state_dict(state)
+    return best, samples_per_s
+
+
+def measure_loader(dataset, batch_size, device, num_workers, prefetch_factor, pin_memory,
+                   n_batches=20, collate_fn=None):
+    """Batches per second delivered (and copied to ``device``) by one DataLoader setting"""
+    kwargs = {"prefetch_factor": prefetch_factor} if num_workers > 0 else {}
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers,
+                        pin_memory=pin_memory, drop_last=True, collate_fn=collate_fn, **kwargs)
+    n_batches = min(n_batches, len(loader))
+    it = iter(loader)
+    start = time.perf_counter()
+    next(it)[0].to(device, non_blocking=pin_memory)
+    n = 1
+    if n_batches > 1:
+        # The first batch pays for worker start-up; time the following ones
+        start = time.perf_counter()
+        n = 0
+        for batch in it:
+            batch[0].to(device, non_blocking=pin_memory)
+            n += 1
+            if n >= n_batches - 1:
+                break
+    if device == "cuda":
+        torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+    del it
+    return n / elapsed
+
+
+def tune_loader(dataset, batch_size, device, target_batches_per_s=None,
+                worker_options=None, prefetch_options=(2, 4), n_batches=20, headroom=1.2,
+                collate_fn=None):
+    """
+    Cheapest DataLoader setting whose throughput keeps the training step fed
+
+    Settings are tried from fewest to most workers. The first one reaching
+    ``headroom`` x the step rate is kept. If none does, the fastest is used.
+
+    Returns:
+        dict with num_workers, prefetch_factor, pin_memory, loader_batches_per_s
+    """
+    cpus = hardware_fingerprint(device)["cpu_count"] or 1
+    if worker_options is None:
+        worker_options = sorted({w for w in (0, 2, 4, 8, 12, 16, cpus) if w <= cpus})
+    pin_options = (True, False) if device == "cuda" else (False,)
+
+    best = None
+    for workers in worker_options:
+        for prefetch in (prefetch_options if workers > 0 else (2,)):
+            for pin in pin_options:
+                rate = measure_loader(dataset, batch_size, device, workers, prefetch, pin, n_batches,
+                                      collate_fn)
+                print(f"  workers={workers:2d} prefetch={prefetch} pin_memory={pin}: {rate:.2f} batches/s")
+                config = {"num_workers": workers, "prefetch_factor": prefetch,
+                          "pin_memory": pin, "loader_batches_per_s": rate}
+                if best is None or rate > best["loader_batches_per_s"]:
+                    best = config
+                if target_batches_per_s and rate >= headroom * target_batches_per_s:
+                    return config
+    return best
+
+
+def autotune(model, dataset, step_fn, device, base_batch_size, base_lr, lr_rule="sqrt",
+             max_batch_size=256, workload=None, cache_path=AUTOTUNE_CACHE, retune=False,
+             sample_shape=None, collate_fn=None):
+    """
+    Choose batch size, activation checkpointing and DataLoader settings for this node
+
+    Args:
+        model: nn.Module on ``device``. If it has set_activation_checkpointing(),
+            both variants are probed and the chosen one is left enabled.
+        dataset: training dataset (item 0 is used for the sample shape)
+        step_fn: callable(model, batch) running forward and backward
+        base_batch_size, base_lr: the configuration the LR was tuned for
+        lr_rule: see scale_learning_rate
+        max_batch_size: upper bound for the probe
+        workload: dict of settings the result depends on (model config, ...)
+        cache_path: JSON file of tuned configurations, keyed by fingerprint
+        retune: ignore a cached result
+        sample_shape: shape of the largest sample (default: shape of item 0;
+            pass the longest window for variable-length datasets)
+        collate_fn: collate function of the training DataLoader
+
+    Returns:
+        dict with batch_size, learning_rate, activation_checkpointing,
+        num_workers, prefetch_factor, pin_memory and the measured throughputs
+    """
+    sample_shape = tuple(sample_shape or dataset[0][0].shape)
+    max_batch_size = min(max_batch_size, len(dataset))
+    hardware = hardware_fingerprint(device)
+    key = _cache_key(hardware, {**(workload or {}), "sample_shape": sample_shape,
+                                "max_batch_size": max_batch_size,
+                                "model": type(model).__name__})
+    cache = _load_cache(cache_path)
+    can_checkpoint = hasattr(model, "set_activation_checkpointing")
+
+    if key in cache and not retune:
+        config = dict(cache[key])
+        print(f"Autotune: using cached configuration {key} from {cache_path}")
+    else:
+        print(f"Autotune: probing {hardware}")
+        candidates = []
+        for use_ckpt in ((False, True) if can_checkpoint and device == "cuda" else (False,)):
+            if can_checkpoint:
+                model.set_activation_checkpointing(use_ckpt)
+            bs, sps = probe_batch_size(model, step_fn, sample_shape, device,
+                                       max_batch_size=max_batch_size,
+                                       start=min(base_batch_size, max_batch_size))
+            print(f"  activation_checkpointing={use_ckpt}: batch_size={bs}, {sps:.1f} samples/s")
+            candidates.append((sps, bs, use_ckpt))
+        samples_per_s, batch_size, use_ckpt = max(candidates)
+
+        print("Autotune: DataLoader settings")
+        loader = tune_loader(dataset, batch_size, device,
+                             target_batches_per_s=samples_per_s / batch_size,
+                             collate_fn=collate_fn)
+        config = {
+            "batch_size": batch_size,
+            "activation_checkpointing": use_ckpt,
+            **loader,
+            "samples_per_s": samples_per_s,
+            "hardware": hardware,
+            "tuned_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        cache[key] = config
+        _save_cache(cache_path, cache)
+
+    if can_checkpoint:
+        model.set_activation_checkpointing(config["activation_checkpointing"])
+    config["learning_rate"] = scale_learning_rate(base_lr, base_batch_size, config["batch_size"], lr_rule)
+    print(f"Autotune: batch_size={config['batch_size']} (lr {base_lr:g} -> {config['learning_rate']:g}, "
+          f"{lr_rule} rule), activation_checkpointing={config['activation_checkpointing']}, "
+          f"num_workers={config['num_workers']}, prefetch_factor={config['prefetch_factor']}, "
+          f"pin_memory={config['pin_memory']}")
+    return config
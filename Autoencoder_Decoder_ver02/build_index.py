@@ -2,44 +2,147 @@
 Build index.csv for IVF dataset
 Works on CHTC with data symlink pointing to /project/bhaskar_group/ivf
 """
-import re
-import glob
 import csv
+import hashlib
 from pathlib import Path
 from tqdm import tqdm
 
+from frame_metadata import embryo_frames, format_times, ExifTimeCache
+
 # Use relative path - run_train.sh creates symlink: data -> /project/bhaskar_group/ivf
 DATASET_ROOT = Path("data")
 OUT_CSV = "index.csv"
 T = 16                 # Sequence length (frames)
 SUBSAMPLE = 3          # Take every 3rd frame
 WINDOW_STRIDE = T // 2   # 50% overlap
+VARIABLE_LENGTH = False  # Also keep embryos shorter than T (one shorter window each)
+MIN_T = 4                # Shortest window kept in variable-length mode
+VAL_FRACTION = 0.1       # Fraction of embryos in the validation split (0 = no split column)
+SPLIT_SEED = 0
+TIME_ELAPSED_DIR = None  # Directory of <cell_id>_timeElapsed.csv files (None = search next to the data)
+USE_EXIF = False         # Fall back to EXIF/TIFF DateTime tags (read once, cached in EXIF_CACHE)
+EXIF_CACHE = "frame_exif_cache.json"
+FOCAL_PLANE = 0          # Plane kept when an embryo directory holds several (F<z> in the file name)
+TIME_STEP_H = None       # Resample onto a uniform time grid (hours) instead of every SUBSAMPLE-th file
+TIME_METHOD = "nearest"  # "nearest" frame or "interp" (blend of the frames around each grid time)
+MAX_GAP_H = None         # Grid points farther than this from any frame split the recording (default TIME_STEP_H)
+QUALITY_FILTER = False   # Drop unreadable, blank, out-of-focus and duplicate frames (frame_quality.py)
+QUALITY_CACHE = "frame_quality_cache.json"
+QUALITY_WORKERS = None   # Processes computing frame signatures (None = all cores)
+LABELS_CSV = None        # CSV of cell_id,label joined into a label column (labels.py)
+
+def list_frames(cell_dir: Path, exif_cache=None):
+    """
+    Frames of a cell directory in acquisition order, with their times
+
+    Order and times come from file names, timeElapsed CSVs or cached EXIF
+    tags (frame_metadata.py), not from modification times, so the order
+    survives copying and no file is stat()ed.
+    """
+    return embryo_frames(cell_dir, TIME_ELAPSED_DIR, exif_cache, FOCAL_PLANE)
+
+def window_starts(n_frames):
+    """
+    Start indices of the windows over ``n_frames`` subsampled frames
+
+    Fixed mode: T-frame windows every WINDOW_STRIDE frames (embryos shorter
+    than T are dropped). Variable-length mode: embryos with MIN_T..T frames
+    become a single window of their own length, longer ones get T-frame
+    windows plus one that ends at the last frame.
+    """
+    if VARIABLE_LENGTH:
+        if n_frames < MIN_T:
+            return []
+        if n_frames <= T:
+            return [0]
+        starts = list(range(0, n_frames - T + 1, WINDOW_STRIDE))
+        if starts[-1] + T < n_frames:
+            starts.append(n_frames - T)
+        return starts
+    return list(range(0, n_frames - T + 1, WINDOW_STRIDE))
+
+def quality_filter(embryos):
+    """
+    Drop bad frames of every embryo before subsampling/windowing
+
+    Signatures of all frames are computed in one process pool and cached in
+    QUALITY_CACHE, so later builds only decode new frames.
+    """
+    from frame_quality import FrameSignatureCache, filter_frames
+    
+    cache = FrameSignatureCache(QUALITY_CACHE, workers=QUALITY_WORKERS)
+    signatures = cache.get_many([f["path"] for _, frames in embryos for f in frames])
+    cache.save()
+    totals = {}
+    kept = []
+    for name, frames in embryos:
+        good, dropped = filter_frames(frames, signatures)
+        for reason, n in dropped.items():
+            totals[reason] = totals.get(reason, 0) + n
+        n_dropped = sum(dropped.values())
+        if n_dropped:
+            print(f"    {name}: dropped {n_dropped}/{len(frames)} ({n_dropped / len(frames):.0%}; "
+                  f"{', '.join(f'{n} {reason}' for reason, n in dropped.items() if n)})")
+        if good:
+            kept.append((name, good))
+    n_frames = sum(len(frames) for _, frames in embryos)
+    print(f"  Quality filter: dropped {sum(totals.values())}/{n_frames} frames "
+          f"({', '.join(f'{n} {reason}' for reason, n in totals.items())})")
+    return kept
+
+def subsampled_segments(frames):
+    """Every SUBSAMPLE-th frame, as one segment starting at index 0"""
+    return [(0, frames[::SUBSAMPLE])]
+
+def time_grid_segments(embryos):
+    """
+    Resample all embryos onto the TIME_STEP_H grid at once (time_grid.py)
+
+    Args:
+        embryos: list of frame lists (frame_metadata.embryo_frames), all timed
+
+    Returns:
+        per embryo, a list of (grid index of the first point, grid frames)
+        for each run of grid points without an acquisition gap; "interp"
+        grid frames carry next_path and weight of the blended second frame
+    """
+    import numpy as np
+    from time_grid import resample_embryos, valid_runs
+    
+    grid = resample_embryos([np.array([f["time_h"] for f in frames]) for frames in embryos],
+                            TIME_STEP_H, TIME_METHOD, MAX_GAP_H)
+    out = []
+    for e, frames in enumerate(embryos):
+        lo, hi = grid["offsets"][e], grid["offsets"][e + 1]
+        points = [{
+            "path": frames[i]["path"],
+            "time_h": float(t),
+            "next_path": frames[j]["path"] if w > 0 else "",
+            "weight": float(w),
+        } for t, i, j, w in zip(grid["time"][lo:hi], grid["frame"][lo:hi],
+                                grid["next_frame"][lo:hi], grid["weight"][lo:hi])]
+        out.append([(a, points[a:b]) for a, b in valid_runs(grid["valid"][lo:hi])])
+    return out
+
+def embryo_split(cell_ids, val_fraction=None, seed=None):
+    """
+    Assign whole embryos to "train" or "val"
+
+    Overlapping windows of one embryo are near-duplicates, so the split is by
+    cell_id, never by window. Embryos are ranked by a seeded hash of their
+    name and the first ``val_fraction`` of them (at least one) go to "val";
+    adding embryos later moves few existing ones between splits.
 
-run_pat = re.compile(r'RUN[_\- ]?(\d+)', re.I)
-num_pat = re.compile(r'(\d+)')
-
-def parse_sort_key(p: Path):
-    """Parse sorting key from path name"""
-    name = p.name
-    # Extract RUN number
-    run_m = run_pat.search(name)
-    run_idx = int(run_m.group(1)) if run_m else 10**9  # No RUN number goes last
-    # Extract all numbers from filename
-    nums = [int(x) for x in num_pat.findall(name)]
-    nums = tuple(nums) if nums else ()
-    # File modification time (nanoseconds)
-    mtime = p.stat().st_mtime_ns
-    return (run_idx, nums, mtime)
-
-def list_frames(cell_dir: Path):
-    """List all image frames in a cell directory"""
-    exts = ("*.jpg", "*.jpeg", "*.png", "*.JPG", "*.JPEG", "*.PNG")
-    frames = []
-    for ext in exts:
-        frames += [Path(p) for p in glob.glob(str(cell_dir / ext))]
-    frames = [p for p in frames if p.exists() and p.stat().st_size > 0]
-    frames.sort(key=parse_sort_key)
-    return frames
+    Returns:
+        dict cell_id -> "train" or "val"
+    """
+    val_fraction = VAL_FRACTION if val_fraction is None else val_fraction
+    seed = SPLIT_SEED if seed is None else seed
+    cell_ids = sorted(set(cell_ids))
+    ranked = sorted(cell_ids, key=lambda c: hashlib.sha1(f"{seed}:{c}".encode()).hexdigest())
+    n_val = max(1, round(val_fraction * len(ranked))) if val_fraction > 0 and len(ranked) > 1 else 0
+    val = set(ranked[:n_val])
+    return {c: "val" if c in val else "train" for c in cell_ids}
 
 def main():
     root = Path(DATASET_ROOT)
@@ -56,32 +159,83 @@ def main():
     
     print(f"Found {len(cell_dirs)} cell directories in {root}")
     
-    rows = []
+    exif_cache = ExifTimeCache(EXIF_CACHE) if USE_EXIF else None
+    embryos = []
     for cell in tqdm(sorted(cell_dirs, key=lambda x: x.name), desc="Processing cells"):
-        frames = list_frames(cell)
-        if not frames: 
-            continue
-        # Temporal subsampling
-        frames = frames[::SUBSAMPLE]
-        if len(frames) < T: 
-            continue
-        # Sliding window
-        for start in range(0, len(frames) - T + 1, WINDOW_STRIDE):
-            seq = frames[start:start+T]
-            rows.append({
-                "cell_id": cell.name,
-                "start_idx": start,
-                "paths": "|".join(str(p) for p in seq)
-            })
+        frames = list_frames(cell, exif_cache)
+        if frames:
+            embryos.append((cell.name, frames))
+    n_timed = sum(frames[0]["time_h"] is not None for _, frames in embryos)
+    if QUALITY_FILTER:
+        embryos = quality_filter(embryos)
+    
+    # Temporal subsampling: every SUBSAMPLE-th file, or a uniform time grid
+    interp = TIME_STEP_H is not None and TIME_METHOD == "interp"
+    if TIME_STEP_H is None:
+        segments = [subsampled_segments(frames) for _, frames in embryos]
+    else:
+        untimed = [name for name, frames in embryos if frames[0]["time_h"] is None]
+        if untimed:
+            print(f"  Skipping {len(untimed)} embryos without acquisition times (e.g. {untimed[0]})")
+        embryos = [(name, frames) for name, frames in embryos if frames[0]["time_h"] is not None]
+        segments = time_grid_segments([frames for _, frames in embryos]) if embryos else []
+    
+    rows = []
+    for (name, _), embryo_segments in zip(embryos, segments):
+        for offset, frames in embryo_segments:
+            # Sliding window
+            for start in window_starts(len(frames)):
+                seq = frames[start:start+T]
+                row = {
+                    "cell_id": name,
+                    "start_idx": offset + start,
+                    "paths": "|".join(f["path"] for f in seq),
+                    "times": format_times([f["time_h"] for f in seq])
+                }
+                if interp:
+                    row["next_paths"] = "|".join(f["next_path"] for f in seq)
+                    row["weights"] = "|".join(f"{f['weight']:.4f}" for f in seq)
+                if VARIABLE_LENGTH:
+                    row["length"] = len(seq)
+                rows.append(row)
+    
+    # Embryo-level train/val split
+    if VAL_FRACTION > 0:
+        splits = embryo_split(r["cell_id"] for r in rows)
+        for r in rows:
+            r["split"] = splits[r["cell_id"]]
+    
+    # Embryo labels for the classifier head (empty = unlabeled)
+    if LABELS_CSV is not None:
+        from labels import load_labels
+        labels = load_labels(LABELS_CSV)
+        for r in rows:
+            r["label"] = labels.get(r["cell_id"], "")
     
     # Write CSV
+    fieldnames = ["cell_id", "start_idx", "paths", "times"] + (["next_paths", "weights"] if interp else [])
+    fieldnames += ["length"] if VARIABLE_LENGTH else []
+    fieldnames += ["split"] if VAL_FRACTION > 0 else []
+    fieldnames += ["label"] if LABELS_CSV is not None else []
     with open(OUT_CSV, "w", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=["cell_id", "start_idx", "paths"])
+        w = csv.DictWriter(f, fieldnames=fieldnames)
         w.writeheader()
         for r in rows:
             w.writerow(r)
     
+    if exif_cache is not None:
+        exif_cache.save()
+    
     print(f"✓ Wrote {OUT_CSV} with {len(rows)} sequences")
+    print(f"  Acquisition times found for {n_timed}/{len(cell_dirs)} embryos")
+    if TIME_STEP_H is not None:
+        print(f"  Time grid: every {TIME_STEP_H} h ({TIME_METHOD}), windows span {(T - 1) * TIME_STEP_H:g} h")
+    if VAL_FRACTION > 0:
+        n_val = sum(v == "val" for v in splits.values())
+        print(f"  Split: {len(splits) - n_val} train / {n_val} val embryos")
+    if LABELS_CSV is not None:
+        n_labeled = len({r["cell_id"] for r in rows if r["label"]})
+        print(f"  Labels: {n_labeled}/{len({r['cell_id'] for r in rows})} embryos labeled")
 
 if __name__ == "__main__":
     main()
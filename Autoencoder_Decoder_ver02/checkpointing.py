@@ -0,0 +1,247 @@
+"""
+Asynchronous, resumable checkpointing
+
+- CheckpointManager: copies the training state to CPU on the training thread
+  (fast), then writes it from a background thread. Files are written to a
+  temporary name, fsync'ed and atomically renamed, so a preempted or held job
+  never leaves a truncated checkpoint behind. Older files of a rotation group
+  are deleted (keep-last-N).
+- ResumableSampler: shuffling sampler with a per-epoch seed that can skip the
+  samples already consumed, so training resumes mid-epoch with the same
+  batch order
+- capture_rng_state / restore_rng_state: Python, NumPy and torch (CPU + CUDA)
+  generators
+- export_inference / load_model_state: slim fp16 model-only artifact for the
+  export and analysis scripts (no optimizer state, about 1/6 of the size of a
+  training checkpoint)
+"""
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+INFERENCE_FORMAT = "inference"
+
+
+def snapshot_to_cpu(obj):
+    """Recursively copy every tensor in a (nested) state dict to CPU memory"""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: snapshot_to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot_to_cpu(v) for v in obj)
+    return obj
+
+
+def atomic_save(obj, path):
+    """torch.save to a temporary file in the same directory, fsync, then rename"""
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            torch.save(obj, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def capture_rng_state():
+    """
+    State of every random generator that affects training
+
+    Stored as tensors and plain Python values only, so checkpoints stay
+    loadable with torch.load(weights_only=True).
+    """
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    state = {
+        "python": random.getstate(),
+        "numpy": [name, torch.from_numpy(keys.astype(np.int64)), pos, has_gauss, cached_gaussian],
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def restore_rng_state(state):
+    """
+    Restore the generators of capture_rng_state()
+
+    The state tensors may come from a checkpoint loaded with a CUDA
+    map_location; the generators only accept CPU ByteTensors.
+    """
+    random.setstate(state["python"])
+    name, keys, pos, has_gauss, cached_gaussian = state["numpy"]
+    np.random.set_state((name, keys.cpu().numpy().astype(np.uint32), pos, has_gauss, cached_gaussian))
+    torch.set_rng_state(state["torch"].cpu())
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all([s.cpu() for s in state["cuda"]])
+
+
+class ResumableSampler(Sampler):
+    """
+    Random permutation per epoch, reproducible from (seed, epoch)
+
+    Use set_epoch() at the start of every epoch. After resuming mid-epoch,
+    set_start() skips the samples that were already trained on.
+
+    Args:
+        data_source: dataset (only its length is used)
+        shuffle: shuffle the order (False = sequential)
+        seed: base seed of the per-epoch permutations
+    """
+
+    def __init__(self, data_source, shuffle=True, seed=0):
+        self.n = len(data_source)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        self.start = 0
+
+    def set_start(self, start):
+        """Skip the first ``start`` samples of the current epoch"""
+        self.start = start
+
+    def __iter__(self):
+        if self.shuffle:
+            g = torch.Generator()
+            g.manual_seed(self.seed + self.epoch)
+            order = torch.randperm(self.n, generator=g).tolist()
+        else:
+            order = list(range(self.n))
+        return iter(order[self.start:])
+
+    def __len__(self):
+        return max(self.n - self.start, 0)
+
+
+class CheckpointManager:
+    """
+    Writes checkpoints from a background thread
+
+    Only one write is in flight at a time. A new save() first waits for the
+    previous write, which bounds the extra host memory to one snapshot.
+    Errors from the background write are re-raised on the next save() or
+    wait().
+
+    Args:
+        save_dir: directory for checkpoints
+        async_save: write from a background thread (False = write inline)
+    """
+
+    def __init__(self, save_dir, async_save=True):
+        self.save_dir = Path(save_dir)
+        self.save_dir.mkdir(parents=True, exist_ok=True)
+        self.async_save = async_save
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ckpt") if async_save else None
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def save(self, state, filename, rotate=None, keep_last=None):
+        """
+        Snapshot ``state`` to CPU and write it to save_dir/filename
+
+        Args:
+            state: (nested) dict of tensors and plain Python values
+            filename: file name inside save_dir
+            rotate: glob pattern of the rotation group this file belongs to,
+                e.g. "checkpoint_epoch_*.pt"
+            keep_last: number of newest files of the group to keep (None = all)
+
+        Returns:
+            path of the checkpoint (it may still be being written)
+        """
+        self.wait()
+        snapshot = snapshot_to_cpu(state)
+        path = self.save_dir / filename
+        if self._pool is None:
+            self._write(snapshot, path, rotate, keep_last)
+        else:
+            self._pending = self._pool.submit(self._write, snapshot, path, rotate, keep_last)
+        return path
+
+    def _write(self, snapshot, path, rotate, keep_last):
+        atomic_save(snapshot, path)
+        if rotate and keep_last:
+            with self._lock:
+                group = sorted(self.save_dir.glob(rotate), key=lambda p: p.stat().st_mtime_ns)
+                for old in group[:-keep_last]:
+                    old.unlink(missing_ok=True)
+
+    def wait(self):
+        """Block until the last write has finished (re-raises its error)"""
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            pending.result()
+
+    def close(self):
+        self.wait()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def latest(self, pattern="checkpoint_*.pt"):
+        """Most recently written checkpoint matching ``pattern`` (None if there is none)"""
+        found = sorted(self.save_dir.glob(pattern), key=lambda p: p.stat().st_mtime_ns)
+        return found[-1] if found else None
+
+
+def inference_state(model, model_config=None, dtype=torch.float16, **metadata):
+    """
+    Model-only artifact for inference (weights cast to ``dtype``)
+
+    Floating-point tensors are cast, integer buffers (BatchNorm counters) are
+    kept as they are. load_state_dict casts back to the model's dtype on load.
+
+    Args:
+        model: trained nn.Module
+        model_config: constructor kwargs needed to rebuild the model
+        **metadata: stored alongside (e.g. epoch, losses)
+    """
+    state = {
+        k: (v.detach().to("cpu", dtype) if v.is_floating_point() else v.detach().cpu())
+        for k, v in model.state_dict().items()
+    }
+    return {
+        "format": INFERENCE_FORMAT,
+        "dtype": str(dtype).replace("torch.", ""),
+        "model_class": type(model).__name__,
+        "model_config": model_config or {},
+        "model_state_dict": state,
+        **metadata,
+    }
+
+
+def export_inference(model, path, model_config=None, dtype=torch.float16, **metadata):
+    """Write inference_state() to ``path`` (see there)"""
+    atomic_save(inference_state(model, model_config, dtype, **metadata), path)
+
+
+def load_model_state(path, map_location="cpu"):
+    """
+    Model state dict from any checkpoint flavour
+
+    Accepts a bare state_dict (v1 ae_epoch*.pt), a training checkpoint
+    (``model_state_dict`` + optimizer, ...) or an inference artifact.
+
+    Returns:
+        state_dict, info (the remaining top-level entries, {} for a bare state_dict)
+    """
+    ckpt = torch.load(path, map_location=map_location)
+    if isinstance(ckpt, dict) and "model_state_dict" in ckpt:
+        info = {k: v for k, v in ckpt.items() if k != "model_state_dict"}
+        return ckpt["model_state_dict"], info
+    return ckpt, {}
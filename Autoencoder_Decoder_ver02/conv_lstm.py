@@ -103,15 +103,17 @@ class ConvLSTM(nn.Module):
             )
         self.cell_list = nn.ModuleList(cell_list)
     
-    def forward(self, input_tensor, hidden_state=None):
+    def forward(self, input_tensor, hidden_state=None, return_all_states=False):
         """
         Args:
             input_tensor: (B, T, C, H, W) if batch_first else (T, B, C, H, W)
-            hidden_state: initial hidden state (optional)
+            hidden_state: initial [(h, c), ...] for every layer (optional, zeros if None)
+            return_all_states: return (h_n, c_n) of every layer, even when
+                return_all_layers is False (needed to resume from this state)
         
         Returns:
-            last_state_list: (h_n, c_n) of last layer
             layer_output_list: outputs of all timesteps
+            last_state_list: (h_n, c_n) of last layer (or of every layer)
         """
         if not self.batch_first:
             # (T, B, C, H, W) -> (B, T, C, H, W)
@@ -148,7 +150,8 @@ class ConvLSTM(nn.Module):
         
         if not self.return_all_layers:
             layer_output_list = layer_output_list[-1:]
-            last_state_list = last_state_list[-1:]
+            if not return_all_states:
+                last_state_list = last_state_list[-1:]
         
         return layer_output_list, last_state_list
     
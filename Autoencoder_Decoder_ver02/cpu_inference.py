@@ -0,0 +1,129 @@
+"""
+CPU inference profile for analysis on laptops and CPU-only nodes
+
+Builds on InferenceEngine (inference_engine.py):
+- Explicit intra-op / inter-op thread counts, pinned to the cores this
+  process may use (os.sched_getaffinity), instead of torch's defaults
+- channels_last conv weights for the oneDNN kernels
+- Static int8 quantization of the per-frame CNN (ver02 encoder.spatial_cnn,
+  v1 enc.net), calibrated on windows sampled from IVFSequenceDataset
+- encode_sharded: splits a large export over several processes, each pinned
+  to its own share of the cores
+
+Usage:
+    configure_cpu_threads()
+    engine = cpu_engine(model, calibration_windows(ds))
+    zs = engine.encode_dataset(ds, indices)
+    zs = encode_sharded(model, ds, indices, n_shards=4)
+"""
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+
+from inference_engine import InferenceEngine
+
+
+def available_cores():
+    """CPU ids this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def configure_cpu_threads(intra_op=None, inter_op=1):
+    """
+    Set torch's thread pools for inference
+
+    A single window is one long chain of ops, so inter-op parallelism does
+    not help; all cores go to intra-op (GEMM / conv) threads.
+
+    Args:
+        intra_op: threads per op (None = all cores available to this process)
+        inter_op: threads running independent ops concurrently
+
+    Returns:
+        dict with the thread counts in effect
+    """
+    intra_op = intra_op or len(available_cores())
+    torch.set_num_threads(intra_op)
+    try:
+        torch.set_num_interop_threads(inter_op)
+    except RuntimeError:
+        pass  # can only be set before the first parallel op of the process
+    return {"intra_op": torch.get_num_threads(), "inter_op": torch.get_num_interop_threads()}
+
+
+def calibration_windows(dataset, n_windows=16, batch_size=4, seed=0):
+    """
+    Random windows of ``dataset`` for static quantization, batched
+
+    Returns:
+        list of (B, T, 1, H, W) tensors
+    """
+    rng = np.random.default_rng(seed)
+    n = min(n_windows, len(dataset))
+    picks = rng.choice(len(dataset), size=n, replace=False)
+    return [torch.stack([dataset[int(i)][0] for i in picks[s:s + batch_size]])
+            for s in range(0, n, batch_size)]
+
+
+def cpu_engine(model, calibration=None, backend="eager", quantize_dynamic=True, **engine_kwargs):
+    """
+    InferenceEngine with the CPU profile
+
+    Args:
+        model: ConvLSTMAutoencoder or ConvLSTMAE
+        calibration: window batches for static int8 of the per-frame CNN
+            (None = keep fp32)
+        backend: quantized kernels gain nothing from torch.compile, so eager
+            is the default
+        quantize_dynamic: also quantize nn.Linear / nn.LSTM (v1 only)
+    """
+    return InferenceEngine(model, device="cpu", backend=backend, calibration=calibration,
+                           channels_last=True, quantize=quantize_dynamic, **engine_kwargs)
+
+
+def _encode_shard(model, dataset, indices, cores, calibration, batch_size, engine_kwargs):
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    configure_cpu_threads(len(cores))
+    engine = cpu_engine(model, calibration, **engine_kwargs)
+    return engine.encode_dataset(dataset, indices, batch_size=batch_size)
+
+
+def encode_sharded(model, dataset, indices=None, n_shards=None, calibration=None, batch_size=16,
+                   **engine_kwargs):
+    """
+    z_seq of dataset windows, split over ``n_shards`` worker processes
+
+    Each worker is pinned to a disjoint set of cores and runs its own
+    cpu_engine with that many intra-op threads. Calibration batches are
+    shared, so every shard quantizes identically.
+
+    Args:
+        n_shards: worker processes (None = one per 4 cores)
+
+    Returns:
+        list of (T, ...) numpy arrays, in the order of ``indices``
+    """
+    indices = list(range(len(dataset))) if indices is None else list(indices)
+    cores = available_cores()
+    n_shards = n_shards or max(1, len(cores) // 4)
+    n_shards = max(1, min(n_shards, len(cores), len(indices)))
+    if n_shards == 1:
+        return _encode_shard(model, dataset, indices, cores, calibration, batch_size, engine_kwargs)
+
+    core_groups = np.array_split(cores, n_shards)
+    index_groups = np.array_split(np.asarray(indices), n_shards)
+    # spawn: forked workers would inherit the parent's OpenMP thread pool
+    with ProcessPoolExecutor(n_shards, mp_context=mp.get_context("spawn")) as pool:
+        futures = [pool.submit(_encode_shard, model, dataset, idx.tolist(), [int(c) for c in group],
+                               calibration, batch_size, engine_kwargs)
+                   for idx, group in zip(index_groups, core_groups)]
+        results = []
+        for future in futures:
+            results.extend(future.result())
+    return results
@@ -7,23 +7,81 @@ import torch
 from torch.utils.data import Dataset
 
 
+class PackedStrings:
+    """
+    Read-only list of strings held in two NumPy arrays (utf-8 bytes + offsets)
+
+    Reading a row of a DataFrame (or a list of Python strings) updates the
+    reference counts of the objects it touches, so every forked DataLoader
+    worker gradually copies the parent's pages holding the index. These two
+    buffers are only ever read, and the workers keep sharing them.
+    """
+
+    def __init__(self, strings):
+        encoded = [s.encode() for s in strings]
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=self.offsets[1:])
+        self.data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode()
+
+
 class IVFSequenceDataset(Dataset):
     """
     Dataset for loading IVF embryo timelapse sequences.
     
     Args:
         index_csv: Path to CSV file with columns: cell_id, start_idx, paths
+            (optional next_paths/weights: frames blended in, from a time-grid
+            index built with TIME_METHOD = "interp")
         resize: Target image size (default: 128)
         norm: Normalization method - "minmax01" or "zscore" (default: "minmax01")
+        frame_cache: optional MultiResFrameCache (multires.py) holding
+            already resized frames, so images are decoded only once
+        split: keep only the windows of this split ("train" / "val", from
+            the index's split column); None = all windows
+
+    ``df`` is the index for the main process (lengths, labels, splits).
+    __getitem__ reads only PackedStrings copies of its paths / cell_id /
+    next_paths / weights columns, so DataLoader workers never touch pandas
+    objects; call _pack_index() after modifying ``df``.
     """
     
-    def __init__(self, index_csv, resize=128, norm="minmax01"):
+    def __init__(self, index_csv, resize=128, norm="minmax01", frame_cache=None, split=None):
         self.df = pd.read_csv(index_csv)
+        if split is not None:
+            if "split" not in self.df.columns:
+                raise ValueError(f"{index_csv} has no split column (rebuild it with build_index.py)")
+            self.df = self.df[self.df["split"] == split].reset_index(drop=True)
         self.resize = resize
         self.norm = norm
+        self.frame_cache = frame_cache
+        self._pack_index()
+
+    def _pack_index(self):
+        """PackedStrings copies of the columns __getitem__ reads"""
+        df = self.df
+        self._paths = PackedStrings(df["paths"])
+        self._cell_ids = PackedStrings(df["cell_id"].astype(str))
+        self._next_paths = self._weights = None
+        if "weights" in df.columns:
+            # Windows without interpolation have no weights (NaN) -> ""
+            has_weights = df["weights"].map(lambda w: isinstance(w, str))
+            self._next_paths = PackedStrings(df["next_paths"].where(has_weights, ""))
+            self._weights = PackedStrings(df["weights"].where(has_weights, ""))
+
+    def set_resolution(self, resize):
+        """Change the output image size (progressive resizing)"""
+        self.resize = resize
 
     def _read_gray(self, path):
         """Read and preprocess a single grayscale image using Pillow"""
+        if self.frame_cache is not None:
+            return self.frame_cache.get(path, self.resize).astype(np.float32)
         try:
             img = Image.open(path).convert("L")  # Convert to grayscale
             img = img.resize((self.resize, self.resize), Image.BILINEAR)
@@ -47,13 +105,20 @@ class IVFSequenceDataset(Dataset):
 
     def __getitem__(self, idx):
         """Get a single sequence"""
-        paths = self.df.iloc[idx]["paths"].split("|")
+        paths = self._paths[idx].split("|")
         frames = [self._read_gray(p) for p in paths]
+        weights = self._weights[idx] if self._weights is not None else ""
+        if weights:
+            # Time-grid interpolation: blend in the frame after each grid time
+            for k, (p, w) in enumerate(zip(self._next_paths[idx].split("|"), weights.split("|"))):
+                w = float(w)
+                if w > 0:
+                    frames[k] = (1 - w) * frames[k] + w * self._read_gray(p)
         vol = np.stack(frames, axis=0)  # [T, H, W]
         vol = self._normalize_video(vol)
         vol = vol[:, None, :, :]  # [T, 1, H, W] - add channel dimension
-        return torch.from_numpy(vol), self.df.iloc[idx]["cell_id"]
+        return torch.from_numpy(vol), self._cell_ids[idx]
 
     def __len__(self):
-        return len(self.df)
+        return len(self._paths)
 
@@ -0,0 +1,283 @@
+"""
+Memory-mapped store of encoder features for downstream heads
+
+Downstream experiments (the classifier head, outcome prediction, speed
+regression) all start from the encoder features of every window. The store
+runs the frozen encoder once per checkpoint and index and keeps:
+
+    <store>/z_last.npy    (N, C, H, W) last-step latent maps, float16
+    <store>/z_seq.npy     (N, T_max, C) spatially pooled z_seq, float16,
+                          zero after each window's length
+    <store>/lengths.npy   (N,) frames per window
+    <store>/windows.csv   cell_id, start_idx and the times / split / label columns
+    <store>/meta.json     shapes, source checkpoint / index and the store key
+
+With ``reconstruction=True`` the full autoencoder runs instead of the
+encoder alone, and the same pass also stores per-frame reconstruction
+errors (anomaly scores, see score_reconstruction.py):
+
+    <store>/recon_l1.npy       (N, T_max) mean absolute error per frame
+    <store>/recon_ms_ssim.npy  (N, T_max) MS-SSIM per frame (NaN after the length)
+
+With ``maps`` the full z_seq maps are kept as well, in a compressed latent
+array (latent_codec.py: float16 or per-channel int8, optional spatial
+pooling and chunked zlib / zstd compression):
+
+    <store>/z_maps/            (N, T_max, C, g, g), dequantized to float32 on read
+
+Arrays are opened memory-mapped, so a probe reads only the rows it uses and
+several processes share one copy in the page cache. meta.json is written
+last: a store whose key matches the checkpoint, index and image size is
+complete and is reused without running the encoder.
+
+Usage:
+    python feature_store.py --checkpoint checkpoints/best_model.pt --index_csv index.csv --out feature_store
+"""
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import DataLoader
+
+from dataset_ivf import IVFSequenceDataset
+from model import ConvLSTMAutoencoder
+from checkpointing import load_model_state
+from inference_engine import InferenceEngine
+from length_bucketing import window_lengths, equal_length_batches
+from labels import label_name
+from losses import frame_errors
+from latent_codec import LatentArrayWriter, LatentArray
+
+STORE_VERSION = 2
+FEATURE_KINDS = ("last", "mean", "last+mean")
+WINDOW_COLUMNS = ("cell_id", "start_idx", "times", "split", "label")
+
+
+def load_autoencoder(checkpoint, device="cpu"):
+    """
+    ConvLSTMAutoencoder (without classifier head) from a training checkpoint or inference artifact
+
+    Returns:
+        model (eval mode), model_config
+    """
+    state, info = load_model_state(checkpoint, map_location="cpu")
+    model_config = info.get("model_config") or info.get("config", {}).get("model") or {}
+    model_config = {**model_config, "use_classifier": False}
+    state = {k: v.float() for k, v in state.items() if not k.startswith("classifier.")}
+    model = ConvLSTMAutoencoder(**model_config)
+    model.load_state_dict(state)
+    return model.to(device).eval(), model_config
+
+
+def store_key(checkpoint, index_csv, image_size):
+    """Key of a store: checkpoint and index contents, image size"""
+    h = hashlib.sha1(f"v{STORE_VERSION}|{image_size}".encode())
+    for path in (checkpoint, index_csv):
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()
+
+
+class FeatureStore:
+    """
+    Read access to a feature store directory
+
+    Attributes:
+        z_last: (N, C, H, W) float16 memmap
+        z_seq: (N, T_max, C) float16 memmap (spatially pooled)
+        lengths: (N,) int array
+        recon_l1, recon_ms_ssim: (N, T_max) float32 memmaps of per-frame
+            reconstruction errors (None unless built with reconstruction=True)
+        z_maps: LatentArray of the full (or grid-pooled) z_seq maps (None
+            unless built with maps)
+        df: windows.csv (cell_id, start_idx, times / split / label if the index had them)
+        meta: contents of meta.json
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / "meta.json") as f:
+            self.meta = json.load(f)
+        self.z_last = np.load(self.path / "z_last.npy", mmap_mode="r")
+        self.z_seq = np.load(self.path / "z_seq.npy", mmap_mode="r")
+        self.lengths = np.load(self.path / "lengths.npy")
+        has_recon = self.meta.get("reconstruction", False)
+        self.recon_l1 = np.load(self.path / "recon_l1.npy", mmap_mode="r") if has_recon else None
+        self.recon_ms_ssim = np.load(self.path / "recon_ms_ssim.npy", mmap_mode="r") if has_recon else None
+        self.z_maps = LatentArray(self.path / "z_maps") if self.meta.get("maps") else None
+        self.df = pd.read_csv(self.path / "windows.csv", keep_default_na=False,
+                              dtype={"times": str, "split": str, "label": str})
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def features(self, kind="last", rows=None):
+        """
+        Pooled per-window feature vectors as float32
+
+        Args:
+            kind: "last" (pooled z_last, C), "mean" (pooled z_seq averaged
+                over the window's frames, C) or "last+mean" (both, 2C)
+            rows: window indices (default: all)
+
+        Returns:
+            (n, C) or (n, 2C) float32 array
+        """
+        if kind not in FEATURE_KINDS:
+            raise ValueError(f"Unknown feature kind {kind!r}, use one of {FEATURE_KINDS}")
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows, dtype=np.int64)
+        z = np.asarray(self.z_seq[rows], dtype=np.float32)  # one gather from the memmap
+        lengths = self.lengths[rows]
+        last = z[np.arange(len(rows)), lengths - 1]
+        if kind == "last":
+            return last
+        mean = z.sum(axis=1) / lengths[:, None]  # padding steps are zero
+        return mean if kind == "mean" else np.concatenate([last, mean], axis=1)
+
+
+def build_feature_store(checkpoint, index_csv, out_dir="feature_store", image_size=128, batch_size=32,
+                        device="cpu", reconstruction=False, num_workers=0, amp=True, maps=None):
+    """
+    Encode every window of an index once and write the feature store
+
+    Windows are encoded in batches of equal length, so variable-length
+    indexes need no padding; ``num_workers`` DataLoader processes decode
+    the frames. An existing store with the same key is reused (if it has
+    the reconstruction errors and maps when they are asked for).
+
+    Args:
+        reconstruction: run the full autoencoder and also store per-frame
+            L1 and MS-SSIM (bf16 autocast on CUDA when ``amp``)
+        maps: also store the z_seq maps, as a dict of latent_codec options
+            {"dtype": "float16" | "int8", "grid": None | g, "compression":
+            None | "zlib" | "zstd"}
+
+    Returns:
+        FeatureStore
+    """
+    out_dir = Path(out_dir)
+    key = store_key(checkpoint, index_csv, image_size)
+    if maps is not None:
+        maps = {"dtype": "float16", "grid": None, "compression": None, **maps}
+    try:
+        store = FeatureStore(out_dir)
+        if (store.meta.get("key") == key and (store.recon_l1 is not None or not reconstruction)
+                and (maps is None or store.meta.get("maps") == maps)):
+            print(f"Using feature store: {out_dir}")
+            return store
+    except (FileNotFoundError, json.JSONDecodeError, ValueError):
+        pass
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    (out_dir / "meta.json").unlink(missing_ok=True)  # incomplete until rewritten
+    dataset = IVFSequenceDataset(index_csv, resize=image_size, norm="minmax01")
+    model, _ = load_autoencoder(checkpoint, device)
+    engine = None if reconstruction else InferenceEngine(model, device=device)
+    use_amp = amp and str(device).startswith("cuda")
+    lengths = np.asarray(window_lengths(dataset), dtype=np.int64)
+    N, T_max = len(dataset), int(lengths.max())
+    batches = equal_length_batches(lengths, batch_size)
+    loader = DataLoader(dataset, batch_sampler=batches, num_workers=num_workers,
+                        pin_memory=str(device).startswith("cuda"))
+
+    t0 = time.perf_counter()
+    z_last = z_seq = recon_l1 = recon_ms_ssim = z_maps = None
+    for rows, (vol, _) in zip(batches, loader):
+        T = vol.shape[1]
+        if reconstruction:
+            vol = vol.to(device, non_blocking=True)
+            with torch.inference_mode(), torch.autocast("cuda", dtype=torch.bfloat16, enabled=use_amp):
+                output = model(vol)
+            with torch.inference_mode():
+                l1, ms = frame_errors(output["reconstruction"].float(), vol)
+            seq, last = output["z_seq"].float().cpu(), output["z_last"].float().cpu()
+        else:
+            seq, last = engine.encode(vol)
+        if z_last is None:
+            C, H, W = last.shape[1:]
+            z_last = np.lib.format.open_memmap(out_dir / "z_last.npy", mode="w+",
+                                               dtype=np.float16, shape=(N, C, H, W))
+            z_seq = np.lib.format.open_memmap(out_dir / "z_seq.npy", mode="w+",
+                                              dtype=np.float16, shape=(N, T_max, C))
+            z_seq[:] = 0
+            if reconstruction:
+                recon_l1 = np.lib.format.open_memmap(out_dir / "recon_l1.npy", mode="w+",
+                                                     dtype=np.float32, shape=(N, T_max))
+                recon_ms_ssim = np.lib.format.open_memmap(out_dir / "recon_ms_ssim.npy", mode="w+",
+                                                          dtype=np.float32, shape=(N, T_max))
+                recon_l1[:] = np.nan
+                recon_ms_ssim[:] = np.nan
+            if maps is not None:
+                z_maps = LatentArrayWriter(out_dir / "z_maps", N, (T_max,) + tuple(seq.shape[2:]), **maps)
+        z_last[rows] = last.numpy().astype(np.float16)
+        z_seq[rows, :T] = seq.mean(dim=(-2, -1)).numpy().astype(np.float16)
+        if reconstruction:
+            recon_l1[rows, :T] = l1.cpu().numpy()
+            recon_ms_ssim[rows, :T] = ms.cpu().numpy()
+        if maps is not None:
+            z_maps.put(rows, seq.numpy())
+    for arr in (z_last, z_seq, recon_l1, recon_ms_ssim):
+        if arr is not None:
+            arr.flush()
+    if z_maps is not None:
+        z_maps.close()
+    elapsed = time.perf_counter() - t0
+    np.save(out_dir / "lengths.npy", lengths)
+    windows = dataset.df[[c for c in WINDOW_COLUMNS if c in dataset.df.columns]].copy()
+    if "label" in windows.columns:
+        windows["label"] = windows["label"].map(label_name)  # 0/1 labels are read as floats
+    windows.to_csv(out_dir / "windows.csv", index=False)
+
+    meta = {
+        "version": STORE_VERSION,
+        "key": key,
+        "checkpoint": str(checkpoint),
+        "index_csv": str(index_csv),
+        "image_size": image_size,
+        "num_windows": N,
+        "z_last_shape": list(z_last.shape),
+        "z_seq_shape": list(z_seq.shape),
+        "reconstruction": reconstruction,
+        "maps": maps,
+        "encode_seconds": round(elapsed, 2),
+    }
+    tmp = out_dir / f".meta.json.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, out_dir / "meta.json")
+    print(f"Encoded {N} windows in {elapsed:.1f}s -> {out_dir}")
+    return FeatureStore(out_dir)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Encode every window of an index into a feature store")
+    parser.add_argument("--checkpoint", type=str, required=True,
+                        help="Trained autoencoder (training checkpoint or inference artifact)")
+    parser.add_argument("--index_csv", type=str, default="index.csv")
+    parser.add_argument("--out", type=str, default="feature_store", help="Store directory")
+    parser.add_argument("--image_size", type=int, default=128)
+    parser.add_argument("--batch_size", type=int, default=32, help="Windows per encoder batch")
+    parser.add_argument("--num_workers", type=int, default=0, help="DataLoader processes decoding frames")
+    parser.add_argument("--reconstruction", action="store_true",
+                        help="Run the full autoencoder and also store per-frame L1 / MS-SSIM")
+    parser.add_argument("--z_maps", action="store_true", help="Also store the z_seq maps (latent_codec.py)")
+    parser.add_argument("--maps_dtype", type=str, default="float16", choices=["float16", "int8"])
+    parser.add_argument("--maps_grid", type=int, default=0, help="Pool the maps to grid x grid (0 = full maps)")
+    parser.add_argument("--maps_compression", type=str, default="none", choices=["none", "zlib", "zstd"])
+    args = parser.parse_args()
+    maps = None
+    if args.z_maps:
+        maps = {"dtype": args.maps_dtype, "grid": args.maps_grid or None,
+                "compression": None if args.maps_compression == "none" else args.maps_compression}
+
+    build_feature_store(args.checkpoint, args.index_csv, args.out, args.image_size, args.batch_size,
+                        "cuda" if torch.cuda.is_available() else "cpu", args.reconstruction,
+                        args.num_workers, maps=maps)
@@ -0,0 +1,247 @@
+"""
+Frame metadata: acquisition order, time and focal plane
+
+Everything is parsed from one directory listing per embryo, without a stat()
+per frame:
+  - the file name: RUN<n> frame counter, F<z> focal plane, a timestamp such
+    as 20130219_143005 or an elapsed time such as 12.5h;
+  - a per-embryo <cell_id>_timeElapsed.csv (frame index -> hours since
+    insemination), as shipped with the public embryo time-lapse dataset;
+  - optionally the EXIF/TIFF DateTime tags, read once per file and cached in
+    a JSON file.
+
+Frames are ordered by acquisition time when every frame has one, otherwise by
+RUN counter and the numbers in the name. The order therefore no longer
+depends on modification times, which change when files are copied.
+"""
+import csv
+import json
+import os
+import re
+import warnings
+from datetime import datetime
+from pathlib import Path
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".tif", ".tiff"}
+
+# One pass over the file name picks up every token
+_TOKEN = re.compile(
+    r"RUN[_\- ]?(?P<run>\d+)"
+    r"|(?<![A-Za-z0-9])(?-i:F)(?P<focal>[+-]?\d+)(?![0-9])"  # uppercase only: f001 is not a plane
+    r"|(?P<date>\d{4}[-.]?\d{2}[-.]?\d{2})[T_\- ]?(?P<clock>\d{2}[-.:]?\d{2}[-.:]?\d{2})"
+    r"|(?<![A-Za-z0-9.])(?P<hours>\d+(?:\.\d+)?)h(?![a-z])",
+    re.I,
+)
+_NUM = re.compile(r"\d+")
+_EXIF_DATETIME_ORIGINAL = 36867
+_EXIF_DATETIME = 306
+_EXIF_IFD = 0x8769
+
+
+def parse_frame_name(name):
+    """
+    Metadata encoded in a frame's file name
+
+    Returns:
+        dict with run (int), focal (int), time (datetime) and hours (float),
+        each None when the name does not contain it, and nums (all numbers in
+        the name, the last-resort sort key)
+    """
+    info = {"run": None, "focal": None, "time": None, "hours": None}
+    for m in _TOKEN.finditer(name):
+        if m.group("run") is not None and info["run"] is None:
+            info["run"] = int(m.group("run"))
+        elif m.group("focal") is not None and info["focal"] is None:
+            info["focal"] = int(m.group("focal"))
+        elif m.group("date") is not None and info["time"] is None:
+            digits = re.sub(r"\D", "", m.group("date") + m.group("clock"))
+            try:
+                info["time"] = datetime.strptime(digits, "%Y%m%d%H%M%S")
+            except ValueError:
+                pass  # a long id that only looks like a timestamp
+        elif m.group("hours") is not None and info["hours"] is None:
+            info["hours"] = float(m.group("hours"))
+    info["nums"] = tuple(int(x) for x in _NUM.findall(name))
+    return info
+
+
+def load_time_elapsed(csv_path):
+    """
+    Read a <cell_id>_timeElapsed.csv
+
+    The first column is the frame index (the RUN counter of the file names),
+    the second the time in hours; a header row is skipped.
+
+    Returns:
+        dict frame index -> hours (empty if the file does not exist)
+    """
+    times = {}
+    try:
+        with open(csv_path, newline="") as f:
+            for row in csv.reader(f):
+                try:
+                    times[int(float(row[0]))] = float(row[1])
+                except (ValueError, IndexError):
+                    continue  # header or blank line
+    except FileNotFoundError:
+        pass
+    return times
+
+
+def find_time_elapsed(cell_dir, time_elapsed_dir=None):
+    """
+    Locate <cell_id>_timeElapsed.csv: in ``time_elapsed_dir``, the embryo
+    directory, the dataset root or a sibling <root>_time_elapsed directory
+    """
+    cell_dir = Path(cell_dir)
+    name = f"{cell_dir.name}_timeElapsed.csv"
+    root = cell_dir.parent
+    candidates = [cell_dir / name, root / name, root.parent / f"{root.name}_time_elapsed" / name]
+    if time_elapsed_dir is not None:
+        candidates.insert(0, Path(time_elapsed_dir) / name)
+    for p in candidates:
+        if p.exists():
+            return p
+    return None
+
+
+class ExifTimeCache:
+    """
+    Acquisition time from EXIF/TIFF tags, read once per file
+
+    Results (ISO timestamp or None) are kept in a JSON file keyed by path, so
+    later index builds do not open the images again. Frames of a time-lapse
+    never change after acquisition, so the path is a sufficient key.
+
+    Args:
+        cache_path: JSON file of the cache
+    """
+
+    def __init__(self, cache_path="frame_exif_cache.json"):
+        self.cache_path = Path(cache_path)
+        try:
+            with open(self.cache_path) as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+        self.dirty = False
+
+    @staticmethod
+    def read(path):
+        """DateTimeOriginal (or DateTime) of an image, None if it has none"""
+        from PIL import Image
+        try:
+            with Image.open(path) as img:
+                exif = img.getexif()
+                value = exif.get_ifd(_EXIF_IFD).get(_EXIF_DATETIME_ORIGINAL) or exif.get(_EXIF_DATETIME)
+        except OSError:
+            return None
+        if not value:
+            return None
+        try:
+            return datetime.strptime(str(value).strip("\x00 "), "%Y:%m:%d %H:%M:%S")
+        except ValueError:
+            return None
+
+    def get(self, path):
+        key = str(path)
+        if key not in self.entries:
+            t = self.read(path)
+            self.entries[key] = t.isoformat() if t else None
+            self.dirty = True
+        value = self.entries[key]
+        return datetime.fromisoformat(value) if value else None
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp = self.cache_path.with_name(f".{self.cache_path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.cache_path)
+        self.dirty = False
+
+
+def list_frames(cell_dir):
+    """
+    Non-empty image files of an embryo directory (one listing; the size
+    check uses the DirEntry stat, which scandir usually has cached)
+    """
+    with os.scandir(cell_dir) as it:
+        return [Path(e.path) for e in it
+                if os.path.splitext(e.name)[1].lower() in IMAGE_EXTS and not e.name.startswith(".")
+                and e.stat().st_size > 0]  # zero-byte files: truncated or half-copied frames
+
+
+def embryo_frames(cell_dir, time_elapsed_dir=None, exif_cache=None, focal_plane=0):
+    """
+    Ordered frames of one embryo with their acquisition times
+
+    Time sources, in order of preference: <cell_id>_timeElapsed.csv (hours
+    since insemination), timestamps or hours in the file names, EXIF tags
+    (only with an ``exif_cache``). Absolute timestamps are converted to hours
+    since the embryo's first frame. When the directory holds several focal
+    planes, only ``focal_plane`` (or, if it is missing, the lowest plane,
+    with a warning) is kept, along with frames that carry no plane token.
+
+    Returns:
+        list of dicts with path (str), run, focal and time_h (hours, or None
+        for every frame when no source covers all of them), in acquisition
+        order
+    """
+    frames = []
+    for p in list_frames(cell_dir):
+        info = parse_frame_name(p.name)
+        info["path"] = str(p)
+        frames.append(info)
+
+    planes = {f["focal"] for f in frames if f["focal"] is not None}
+    if len(planes) > 1:
+        keep = focal_plane
+        if keep not in planes:
+            keep = min(planes)
+            warnings.warn(f"{cell_dir}: focal plane {focal_plane} not found (planes {sorted(planes)}), "
+                          f"using plane {keep}")
+        frames = [f for f in frames if f["focal"] in (keep, None)]
+
+    # Acquisition times: take the first source that covers every frame
+    times = None
+    csv_path = find_time_elapsed(cell_dir, time_elapsed_dir)
+    elapsed = load_time_elapsed(csv_path) if csv_path else {}
+    if elapsed and all(f["run"] in elapsed for f in frames):
+        times = [elapsed[f["run"]] for f in frames]
+    elif frames and all(f["time"] is not None for f in frames):
+        times = [f["time"] for f in frames]
+    elif frames and all(f["hours"] is not None for f in frames):
+        times = [f["hours"] for f in frames]
+    elif frames and exif_cache is not None:
+        stamps = [exif_cache.get(f["path"]) for f in frames]
+        if all(t is not None for t in stamps):
+            times = stamps
+    if times and isinstance(times[0], datetime):
+        t0 = min(times)
+        times = [(t - t0).total_seconds() / 3600.0 for t in times]
+
+    for i, f in enumerate(frames):
+        f["time_h"] = times[i] if times else None
+    if times:
+        frames.sort(key=lambda f: (f["time_h"], f["run"] if f["run"] is not None else -1, f["nums"]))
+    else:
+        # No stat/mtime fallback: frames without a RUN counter go last, by the numbers in the name
+        frames.sort(key=lambda f: (f["run"] is None, f["run"] or 0, f["nums"], f["path"]))
+    return [{"path": f["path"], "run": f["run"], "focal": f["focal"], "time_h": f["time_h"]}
+            for f in frames]
+
+
+def format_times(times):
+    """Times of a window as stored in the index ("" when unknown)"""
+    if any(t is None for t in times):
+        return ""
+    return "|".join(f"{t:.4f}" for t in times)
+
+
+def parse_times(value):
+    """Inverse of format_times: list of hours, or None for an empty/missing value"""
+    if not isinstance(value, str) or not value:
+        return None
+    return [float(t) for t in value.split("|")]
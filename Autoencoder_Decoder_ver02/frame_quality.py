@@ -0,0 +1,166 @@
+"""
+Frame quality pass at index time: duplicates, blank and out-of-focus frames
+
+Each frame is decoded once at low resolution (JPEG draft mode decodes at
+1/2-1/8 scale directly) and reduced to a small signature:
+  - dhash: 256-bit difference hash of a 17x16 thumbnail (hex string)
+  - mean: mean intensity (0-255)
+  - std: intensity standard deviation
+  - lap_var: variance of the Laplacian of the 64x64 thumbnail (focus measure)
+Signatures are computed in a process pool and cached in a JSON file keyed by
+path, modification time and size, so rebuilding the index only decodes new
+or replaced frames.
+
+A frame is dropped when it is
+  - unreadable,
+  - blank: nearly uniform (std below BLANK_MAX_STD) or almost black/white,
+  - out of focus: lap_var below BLUR_RATIO x the embryo's median lap_var,
+  - a duplicate: an exact or near-exact repeat of the frame just before it
+    in acquisition order (dhash within DUP_HAMMING bits, mean intensity
+    within DUP_MEAN_DIFF). Frames are never compared with an earlier kept
+    frame, so slow, nearly static stretches of a time-lapse are not thinned
+    out (which would change the time spacing behind SUBSAMPLE / the grid).
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+SIGNATURE_VERSION = 2  # 2: entries keyed by path|mtime_ns|size
+THUMB_SIZE = 64
+HASH_SIZE = 16
+BLANK_MIN_MEAN = 8.0     # darker frames are blank (lamp off, no well)
+BLANK_MAX_MEAN = 247.0   # brighter frames are saturated
+BLANK_MAX_STD = 2.0      # flatter frames are blank
+BLUR_RATIO = 0.2         # lap_var below this fraction of the embryo median = out of focus
+DUP_HAMMING = 0          # of 256 bits: identical thumbnails only
+DUP_MEAN_DIFF = 0.1      # near-exact: re-encoded copies of the same frame
+
+
+def frame_signature(path):
+    """Signature of one frame (None if it cannot be decoded)"""
+    from PIL import Image
+    try:
+        with Image.open(path) as img:
+            img.draft("L", (THUMB_SIZE, THUMB_SIZE))  # DCT-domain downscale for JPEG
+            img = img.convert("L")
+            thumb = np.asarray(img.resize((THUMB_SIZE, THUMB_SIZE), Image.BILINEAR), dtype=np.float32)
+            small = np.asarray(img.resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR), dtype=np.int16)
+    except (OSError, ValueError):
+        return None
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    lap = (thumb[1:-1, :-2] + thumb[1:-1, 2:] + thumb[:-2, 1:-1] + thumb[2:, 1:-1]
+           - 4 * thumb[1:-1, 1:-1])
+    return {
+        "dhash": np.packbits(bits).tobytes().hex(),
+        "mean": round(float(thumb.mean()), 3),
+        "std": round(float(thumb.std()), 3),
+        "lap_var": round(float(lap.var()), 3),
+    }
+
+
+class FrameSignatureCache:
+    """
+    Per-file frame signatures, cached in a JSON file
+
+    Entries are keyed by path, modification time and size (as in
+    multires.MultiResFrameCache), so a frame re-exported under the same name
+    gets a fresh signature instead of its old verdict.
+
+    Args:
+        cache_path: JSON file of the cache
+        workers: processes used to compute missing signatures (0 = inline)
+    """
+
+    def __init__(self, cache_path="frame_quality_cache.json", workers=None):
+        self.cache_path = Path(cache_path)
+        self.workers = os.cpu_count() if workers is None else workers
+        try:
+            with open(self.cache_path) as f:
+                blob = json.load(f)
+            self.entries = blob["signatures"] if blob.get("version") == SIGNATURE_VERSION else {}
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            self.entries = {}
+        self.dirty = False
+
+    @staticmethod
+    def _key(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return path  # missing file: frame_signature returns None
+        return f"{path}|{st.st_mtime_ns}|{st.st_size}"
+
+    def get_many(self, paths):
+        """
+        Signatures of ``paths`` (dict path -> signature or None)
+
+        Missing ones are computed in one process pool over all paths.
+        """
+        keys = {p: self._key(p) for p in dict.fromkeys(paths)}
+        missing = [p for p, key in keys.items() if key not in self.entries]
+        if missing:
+            if self.workers and len(missing) > 1:
+                chunk = max(1, len(missing) // (self.workers * 8))
+                with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                    sigs = list(pool.map(frame_signature, missing, chunksize=chunk))
+            else:
+                sigs = [frame_signature(p) for p in missing]
+            self.entries.update(zip((keys[p] for p in missing), sigs))
+            self.dirty = True
+        return {p: self.entries[keys[p]] for p in paths}
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp = self.cache_path.with_name(f".{self.cache_path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"version": SIGNATURE_VERSION, "signatures": self.entries}, f)
+        os.replace(tmp, self.cache_path)
+        self.dirty = False
+
+
+def hamming(a, b):
+    """Number of differing bits of two hex hashes"""
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def filter_frames(frames, signatures):
+    """
+    Drop unreadable, blank, out-of-focus and duplicate frames of one embryo
+
+    Args:
+        frames: frame dicts in acquisition order (frame_metadata.embryo_frames)
+        signatures: dict path -> signature (FrameSignatureCache.get_many)
+
+    Returns:
+        (kept frames, dict reason -> number of dropped frames)
+    """
+    dropped = {"unreadable": 0, "blank": 0, "blurred": 0, "duplicate": 0}
+    candidates = []
+    for i, f in enumerate(frames):
+        sig = signatures.get(f["path"])
+        if sig is None:
+            dropped["unreadable"] += 1
+        elif (sig["std"] < BLANK_MAX_STD or sig["mean"] < BLANK_MIN_MEAN
+              or sig["mean"] > BLANK_MAX_MEAN):
+            dropped["blank"] += 1
+        else:
+            candidates.append((i, f, sig))
+    if not candidates:
+        return [], dropped
+
+    median_lap = float(np.median([sig["lap_var"] for _, _, sig in candidates]))
+    kept = []
+    for i, f, sig in candidates:
+        prev = signatures.get(frames[i - 1]["path"]) if i > 0 else None  # raw predecessor, kept or not
+        if sig["lap_var"] < BLUR_RATIO * median_lap:
+            dropped["blurred"] += 1
+        elif (prev is not None and hamming(sig["dhash"], prev["dhash"]) <= DUP_HAMMING
+                and abs(sig["mean"] - prev["mean"]) <= DUP_MEAN_DIFF):
+            dropped["duplicate"] += 1
+        else:
+            kept.append(f)
+    return kept, dropped
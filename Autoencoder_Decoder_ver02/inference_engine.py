@@ -0,0 +1,339 @@
+"""
+Optimized batch inference for latent extraction
+
+Wraps the encoder of ConvLSTMAutoencoder (ver02) or ConvLSTMAE (v1) for
+exporting latents from many windows:
+- BatchNorm layers of Encoder.spatial_cnn are folded into the preceding
+  convolutions (one conv per layer instead of conv + normalization)
+- The encoder is compiled with torch.compile, falling back to
+  torch.jit.trace and then to eager mode if compilation is not available
+  (e.g. no C++ toolchain on a CPU node)
+- Batches are split into a fixed set of bucket sizes, so compiled/traced
+  graphs are built for a handful of shapes only and then reused
+- Everything runs under torch.inference_mode, with the device fixed once at
+  construction
+- Optional dynamic int8 quantization (nn.Linear / nn.LSTM) for CPU-only nodes
+- Optional static int8 quantization of the per-frame CNN (ver02
+  encoder.spatial_cnn, v1 enc.net), calibrated on real windows, and
+  channels_last weights (see cpu_inference.py for the CPU profile)
+
+Usage:
+    engine = InferenceEngine(model, device="cpu")
+    z_seq, z_last = engine.encode(windows)           # (N, T, 1, H, W)
+    zs = engine.encode_dataset(ds, indices)          # list of numpy z_seq
+"""
+import copy
+import warnings
+
+import torch
+import torch.nn as nn
+
+DEFAULT_BUCKETS = (1, 2, 4, 8, 16, 32)
+BACKENDS = ("auto", "compile", "trace", "eager")
+
+
+def fold_conv_bn(conv, bn):
+    """
+    Conv2d with the (eval-mode) BatchNorm that follows it folded in
+
+    y = gamma * (conv(x) - mean) / sqrt(var + eps) + beta
+      = conv'(x)  with  W' = W * s,  b' = (b - mean) * s + beta,  s = gamma / sqrt(var + eps)
+    """
+    fused = copy.deepcopy(conv)
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+    with torch.no_grad():
+        fused.weight.copy_(conv.weight * scale.reshape(-1, 1, 1, 1))
+        fused.bias = nn.Parameter((bias - bn.running_mean) * scale + bn.bias)
+    return fused
+
+
+def fold_batchnorm(seq):
+    """Copy of an nn.Sequential with every Conv2d -> BatchNorm2d pair folded into one Conv2d"""
+    layers = list(seq)
+    out = []
+    i = 0
+    while i < len(layers):
+        layer = layers[i]
+        if (isinstance(layer, nn.Conv2d) and i + 1 < len(layers)
+                and isinstance(layers[i + 1], nn.BatchNorm2d)):
+            out.append(fold_conv_bn(layer, layers[i + 1]))
+            i += 2
+        else:
+            out.append(copy.deepcopy(layer))
+            i += 1
+    return nn.Sequential(*out)
+
+
+def fuse_conv_layers(seq):
+    """
+    Fuse Conv2d [-> BatchNorm2d] [-> ReLU] runs of an eval-mode nn.Sequential in place
+
+    Needed before static quantization, so each run becomes one int8 conv.
+    """
+    names = [name for name, _ in seq.named_children()]
+    layers = list(seq)
+    groups = []
+    i = 0
+    while i < len(layers):
+        if isinstance(layers[i], nn.Conv2d):
+            group = [names[i]]
+            if i + 1 < len(layers) and isinstance(layers[i + 1], nn.BatchNorm2d):
+                group.append(names[i + 1])
+            if i + len(group) < len(layers) and isinstance(layers[i + len(group)], nn.ReLU):
+                group.append(names[i + len(group)])
+            if len(group) > 1:
+                groups.append(group)
+            i += len(group)
+        else:
+            i += 1
+    if groups:
+        torch.ao.quantization.fuse_modules(seq, groups, inplace=True)
+    return seq
+
+
+class _QuantizedStack(nn.Module):
+    """Float in, float out wrapper around a statically quantized module"""
+
+    def __init__(self, module):
+        super().__init__()
+        self.quant = torch.ao.quantization.QuantStub()
+        self.module = module
+        self.dequant = torch.ao.quantization.DeQuantStub()
+
+    def forward(self, x):
+        return self.dequant(self.module(self.quant(x)))
+
+
+def spatial_stack(model):
+    """(parent, attribute) of the per-frame CNN: ver02 encoder.spatial_cnn or v1 enc.net"""
+    if hasattr(model, "encoder"):
+        return model.encoder, "spatial_cnn"
+    if hasattr(model, "enc"):
+        return model.enc, "net"
+    raise ValueError(f"No per-frame CNN found in {type(model).__name__}")
+
+
+def quantize_spatial_cnn(model, calibration, qengine="x86"):
+    """
+    Static int8 quantization of the per-frame CNN of an eval-mode model (in place)
+
+    Activation ranges are observed while encoding ``calibration`` with the
+    full model, so they match what the CNN sees at inference time. The
+    recurrent part stays in fp32.
+
+    Args:
+        model: ConvLSTMAutoencoder or ConvLSTMAE in eval mode
+        calibration: iterable of (B, T, 1, H, W) window batches
+        qengine: quantized kernel backend ("x86", "fbgemm", "onednn" or "qnnpack")
+
+    Returns:
+        model
+    """
+    if qengine not in torch.backends.quantized.supported_engines:
+        raise ValueError(f"Quantized engine {qengine!r} is not available "
+                         f"(supported: {torch.backends.quantized.supported_engines})")
+    torch.backends.quantized.engine = qengine
+    parent, name = spatial_stack(model)
+    wrapped = _QuantizedStack(fuse_conv_layers(getattr(parent, name)))
+    wrapped.qconfig = torch.ao.quantization.get_default_qconfig(qengine)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # eager-mode quantization deprecation notices
+        torch.ao.quantization.prepare(wrapped, inplace=True)
+        setattr(parent, name, wrapped)
+        n = 0
+        with torch.no_grad():
+            for batch in calibration:
+                model.encode(batch.float())
+                n += 1
+        if n == 0:
+            raise ValueError("Static quantization needs at least one calibration batch")
+        torch.ao.quantization.convert(wrapped, inplace=True)
+    return model
+
+
+class _EncodeModule(nn.Module):
+    """model.encode as a module forward, so it can be compiled or traced"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model.encode(x)
+
+
+def plan_buckets(n, buckets):
+    """
+    Split ``n`` windows into bucket-sized batches
+
+    Returns:
+        list of (n_real, bucket) pairs; n_real < bucket means the batch is
+        zero-padded up to the bucket size
+    """
+    buckets = sorted(buckets)
+    plan = []
+    while n > 0:
+        fitting = [b for b in buckets if b <= n]
+        if fitting:
+            b = fitting[-1]
+            plan.append((b, b))
+            n -= b
+        else:
+            plan.append((n, next(b for b in buckets if b >= n)))
+            n = 0
+    return plan
+
+
+class InferenceEngine:
+    """
+    Batched, compiled encoder inference
+
+    Args:
+        model: ConvLSTMAutoencoder or ConvLSTMAE (weights are copied, the
+            original model is not modified)
+        device: "cpu" or "cuda"
+        backend: "auto" (compile, else trace, else eager), "compile",
+            "trace" or "eager"
+        fold_bn: fold the BatchNorm layers of encoder.spatial_cnn
+        quantize: dynamic int8 quantization of nn.Linear / nn.LSTM layers
+            (CPU only; ver02's encoder has none, so only v1 benefits)
+        buckets: allowed batch sizes
+        calibration: iterable of window batches; if given, the per-frame CNN
+            is statically quantized to int8 (CPU only, see quantize_spatial_cnn)
+        channels_last: store conv weights in channels_last (NHWC) layout,
+            which the oneDNN CPU kernels prefer
+    """
+
+    def __init__(self, model, device="cpu", backend="auto", fold_bn=True, quantize=False,
+                 buckets=DEFAULT_BUCKETS, calibration=None, channels_last=False):
+        if backend not in BACKENDS:
+            raise ValueError(f"backend must be one of {BACKENDS}")
+        self.device = torch.device(device)
+        self.buckets = tuple(sorted(buckets))
+        model = copy.deepcopy(model).float().eval().to(self.device)
+        if fold_bn and hasattr(model, "encoder"):
+            model.encoder.spatial_cnn = fold_batchnorm(model.encoder.spatial_cnn)
+        if hasattr(model, "decoder"):
+            del model.decoder  # only the encoder is used
+        if (quantize or calibration is not None) and self.device.type != "cpu":
+            raise ValueError("int8 quantization is only supported on CPU")
+        if calibration is not None:
+            quantize_spatial_cnn(model, calibration)
+        if quantize:
+            model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear, nn.LSTM}, dtype=torch.qint8)
+        if channels_last:
+            model = model.to(memory_format=torch.channels_last)
+        self.module = _EncodeModule(model).to(self.device).eval()
+        for p in self.module.parameters():
+            p.requires_grad_(False)
+
+        self.backend = backend
+        self._compiled = None
+        self._traced = {}
+
+    def _fallback(self, err):
+        nxt = {"auto": "trace", "compile": "trace", "trace": "eager"}[self.backend]
+        print(f"InferenceEngine: {self.backend} backend failed ({type(err).__name__}: {err}); using {nxt}")
+        self.backend = nxt
+
+    def _run(self, x):
+        """Run one bucket-sized batch with the current backend, falling back on failure"""
+        while True:
+            try:
+                if self.backend in ("auto", "compile"):
+                    if self._compiled is None:
+                        self._compiled = torch.compile(self.module, dynamic=False)
+                    return self._compiled(x)
+                if self.backend == "trace":
+                    key = tuple(x.shape)
+                    if key not in self._traced:
+                        with warnings.catch_warnings():
+                            warnings.simplefilter("ignore", FutureWarning)  # jit.trace deprecation
+                            self._traced[key] = torch.jit.trace(self.module, x, check_trace=False)
+                    return self._traced[key](x)
+                return self.module(x)
+            except Exception as err:  # compiler/tracer errors vary between torch versions
+                if self.backend == "eager":
+                    raise
+                self._fallback(err)
+
+    def encode(self, x):
+        """
+        Encode a batch of windows of any size
+
+        Args:
+            x: (N, T, 1, H, W) tensor (any device / float dtype)
+
+        Returns:
+            same structure as model.encode (z_seq, z_last for ver02; z_seq for v1),
+            as CPU tensors
+        """
+        outputs = []
+        start = 0
+        with torch.inference_mode():
+            for n_real, bucket in plan_buckets(len(x), self.buckets):
+                batch = x[start:start + n_real].to(self.device, torch.float32, non_blocking=True)
+                if bucket > n_real:
+                    pad = batch.new_zeros((bucket - n_real,) + batch.shape[1:])
+                    batch = torch.cat([batch, pad])
+                out = self._run(batch)
+                out = out if isinstance(out, tuple) else (out,)
+                outputs.append(tuple(o[:n_real].cpu() for o in out))
+                start += n_real
+        merged = tuple(torch.cat(parts) for parts in zip(*outputs))
+        return merged if len(merged) > 1 else merged[0]
+
+    def encode_dataset(self, dataset, indices=None, batch_size=16):
+        """
+        z_seq of dataset windows, encoded batch_size windows at a time
+
+        Returns:
+            list of (T, ...) numpy arrays, in the order of ``indices``
+        """
+        indices = range(len(dataset)) if indices is None else list(indices)
+        results = []
+        for s in range(0, len(indices), batch_size):
+            vol = torch.stack([dataset[i][0] for i in indices[s:s + batch_size]])
+            out = self.encode(vol)
+            z_seq = out[0] if isinstance(out, tuple) else out
+            results.extend(z.numpy() for z in z_seq)
+        return results
+
+
+def benchmark_engine(model, x, device="cpu", repeat=3, **engine_kwargs):
+    """
+    Windows per second: eager batch-1 loop vs. the engine
+
+    Returns:
+        dict with eager_windows_per_s, engine_windows_per_s, speedup, max_abs_diff
+    """
+    import time
+
+    model = model.to(device).eval()
+    engine = InferenceEngine(model, device=device, **engine_kwargs)
+    engine.encode(x)  # compile / trace outside the timed region
+
+    def eager():
+        with torch.no_grad():
+            return [model.encode(x[i:i + 1].to(device)) for i in range(len(x))]
+
+    def timed(fn):
+        best = float("inf")
+        for _ in range(repeat):
+            t = time.perf_counter()
+            out = fn()
+            best = min(best, time.perf_counter() - t)
+        return out, len(x) / best
+
+    ref, eager_rate = timed(eager)
+    out, engine_rate = timed(lambda: engine.encode(x))
+    ref_z = torch.cat([r[0] if isinstance(r, tuple) else r for r in ref]).cpu()
+    out_z = out[0] if isinstance(out, tuple) else out
+    return {
+        "backend": engine.backend,
+        "eager_windows_per_s": eager_rate,
+        "engine_windows_per_s": engine_rate,
+        "speedup": engine_rate / eager_rate,
+        "max_abs_diff": float((ref_z - out_z).abs().max()),
+    }
@@ -0,0 +1,157 @@
+"""
+Embryo labels for the LatentClassifier head
+
+A labels CSV maps embryos to classes, e.g.
+
+    cell_id,label
+    D2013.02.19_S0675_I141_1,non-empty
+    D2013.03.09_S0695_I141_1,empty
+
+Labels can be names (empty / non-empty, an outcome, ...) or integers.
+build_index.py (LABELS_CSV, ivf.py index --labels) joins them into the index
+as a label column. Windows of unlabeled embryos have an empty label and are
+ignored by the classification loss (class index UNLABELED).
+"""
+import csv
+
+import torch
+from torch.utils.data import Sampler
+
+UNLABELED = -1
+
+
+def load_labels(path):
+    """
+    Read a labels CSV (cell_id column plus a label column, or the first two columns)
+
+    Returns:
+        dict cell_id -> label (str)
+    """
+    labels = {}
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        cols = [c.strip().lower() for c in header]
+        id_col = cols.index("cell_id") if "cell_id" in cols else 0
+        label_col = next((cols.index(c) for c in ("label", "class", "outcome") if c in cols), 1)
+        if "cell_id" not in cols:
+            # no header: the first row is data
+            f.seek(0)
+            reader = csv.reader(f)
+        for row in reader:
+            if len(row) > max(id_col, label_col) and row[label_col].strip():
+                labels[row[id_col].strip()] = row[label_col].strip()
+    return labels
+
+
+def label_name(value):
+    """Label as a class name ("" when missing); pandas reads 0/1 label columns as floats"""
+    if value is None or value != value:  # None / NaN
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def label_classes(values):
+    """
+    Sorted class names of the non-empty labels in ``values``
+
+    Integer labels are sorted numerically, so "0", "1", "2" map to 0, 1, 2.
+    """
+    names = {label_name(v) for v in values} - {""}
+    if all(n.lstrip("-").isdigit() for n in names):
+        return sorted(names, key=int)
+    return sorted(names)
+
+
+def window_labels(df, labels_csv=None, classes=None):
+    """
+    Class index of every window of an index DataFrame
+
+    Labels come from the index's label column, or from ``labels_csv`` joined
+    on cell_id.
+
+    Args:
+        df: index DataFrame (dataset.df)
+        labels_csv: labels CSV (overrides the label column)
+        classes: class names to use (default: all labels found)
+
+    Returns:
+        (LongTensor of class indices with UNLABELED for unlabeled windows,
+         list of class names; empty when there are no labels)
+    """
+    if labels_csv is not None:
+        by_cell = load_labels(labels_csv)
+        values = [by_cell.get(c, "") for c in df["cell_id"]]
+    elif "label" in df.columns:
+        values = df["label"].tolist()
+    else:
+        return torch.full((len(df),), UNLABELED, dtype=torch.long), []
+    classes = list(classes) if classes is not None else label_classes(values)
+    lookup = {name: i for i, name in enumerate(classes)}
+    y = [lookup.get(label_name(v), UNLABELED) for v in values]
+    return torch.tensor(y, dtype=torch.long), classes
+
+
+def class_counts(y, num_classes):
+    """Number of labeled windows per class"""
+    return torch.bincount(y[y != UNLABELED], minlength=num_classes)
+
+
+def classification_metrics(pred, y, num_classes):
+    """Accuracy and balanced accuracy (mean per-class recall) of predicted class indices"""
+    pred, y = torch.as_tensor(pred), torch.as_tensor(y)
+    correct = pred == y
+    recalls = [correct[y == c].float().mean().item() for c in range(num_classes) if (y == c).any()]
+    return {
+        "accuracy": correct.float().mean().item(),
+        "balanced_accuracy": sum(recalls) / max(len(recalls), 1),
+    }
+
+
+class ClassBalancedSampler(Sampler):
+    """
+    Draws labeled windows so that every class is equally likely
+
+    Each window is weighted by 1 / (size of its class); an epoch draws
+    ``num_samples`` windows with replacement (default: number of labeled
+    windows). Unlabeled windows are never drawn. The draw is seeded per
+    epoch and has the set_epoch / set_start / seed interface of
+    checkpointing.ResumableSampler, so mid-epoch resume works unchanged.
+
+    Args:
+        y: class index per window (UNLABELED = never drawn)
+        num_samples: windows per epoch
+        seed: base seed of the per-epoch draws
+    """
+
+    def __init__(self, y, num_samples=None, seed=0):
+        y = torch.as_tensor(y)
+        labeled = y != UNLABELED
+        if not labeled.any():
+            raise ValueError("ClassBalancedSampler needs at least one labeled window")
+        counts = torch.bincount(y[labeled])
+        self.weights = torch.zeros(len(y), dtype=torch.double)
+        self.weights[labeled] = 1.0 / counts[y[labeled]].double()
+        self.n = int(labeled.sum()) if num_samples is None else num_samples
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        self.start = 0
+
+    def set_start(self, start):
+        """Skip the first ``start`` draws of the current epoch"""
+        self.start = start
+
+    def __iter__(self):
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        order = torch.multinomial(self.weights, self.n, replacement=True, generator=g)
+        return iter(order[self.start:].tolist())
+
+    def __len__(self):
+        return max(self.n - self.start, 0)
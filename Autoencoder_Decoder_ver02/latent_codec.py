@@ -0,0 +1,377 @@
+"""
+Compressed storage of full latent maps (ver02 z_seq)
+
+ver02 z_seq is (T, 256, 16, 16) float32 per window: 4 MB at T=16, or
+over 50 GB for the 13k windows of the full dataset. A latent array stores
+(N, T_max, C, g, g) maps with three independent choices:
+
+    dtype        float16, or int8 with one scale per (window, channel)
+    grid         average pooling of the 16x16 maps to grid x grid
+                 (None = full maps, 1 = one vector per frame)
+    compression  None, "zlib" (standard library) or "zstd" (needs zstandard),
+                 per chunk of chunk_rows windows, after a byte shuffle
+
+Layout of a latent array directory:
+
+    codec.json               dtype, grid, compression, chunk_rows, shape
+    data.npy                 uncompressed: the stored rows, memory-mapped
+    chunks.bin, offsets.npy  compressed: one block per chunk of rows
+    scales.npy               (N, C) float32 scales (int8 only)
+
+Rows can be written in any order (equal-length batches); compression runs
+once all rows are in. Reads are vectorized: each chunk holding requested rows
+is decompressed once and all rows are dequantized in one operation.
+
+Usage (size and accuracy of every variant on a sample of windows):
+    python latent_codec.py --checkpoint checkpoints/best_model.pt --index_csv index.csv --windows 64
+"""
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+
+DTYPES = ("float16", "int8")
+COMPRESSIONS = (None, "zlib", "zstd")
+INT8_MAX = 127
+
+
+def pool_maps(z, grid=None):
+    """Average-pool (..., H, W) maps to (..., grid, grid); grid None keeps them"""
+    if grid is None:
+        return z
+    H, W = z.shape[-2:]
+    if H % grid or W % grid:
+        raise ValueError(f"grid {grid} does not divide the {H}x{W} latent maps")
+    z = z.reshape(z.shape[:-2] + (grid, H // grid, grid, W // grid))
+    return z.mean(axis=(-3, -1))
+
+
+def _channel_scales(scales, ndim):
+    """(n, C) scales broadcastable against (n, T, C, ...) maps"""
+    return scales.reshape(scales.shape[:1] + (1,) + scales.shape[1:] + (1,) * (ndim - 3))
+
+
+def quantize(z, dtype="float16"):
+    """
+    Cast (n, T, C, ...) float32 latents to the stored dtype
+
+    int8 is symmetric with one scale per window and channel: max |z| over
+    the window's frames and positions maps to 127.
+
+    Returns:
+        stored array, (n, C) float32 scales (None for float16)
+    """
+    if dtype == "float16":
+        return z.astype(np.float16), None
+    if dtype != "int8":
+        raise ValueError(f"Unknown latent dtype {dtype!r}, use one of {DTYPES}")
+    axes = (1,) + tuple(range(3, z.ndim))
+    scales = np.abs(z).max(axis=axes) / INT8_MAX
+    scales = np.where(scales > 0, scales, 1).astype(np.float32)
+    q = np.rint(z / _channel_scales(scales, z.ndim)).clip(-INT8_MAX, INT8_MAX).astype(np.int8)
+    return q, scales
+
+
+def dequantize(q, scales=None):
+    """Stored latents back to float32 (inverse of quantize)"""
+    z = q.astype(np.float32)
+    if scales is not None:
+        z *= _channel_scales(scales, z.ndim)
+    return z
+
+
+def _codec(name):
+    """(compress, decompress) functions of a compression name"""
+    if name == "zlib":
+        import zlib
+        return (lambda data: zlib.compress(data, 6)), zlib.decompress
+    if name == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("compression='zstd' needs the zstandard package "
+                              "(pip install zstandard), or use 'zlib'") from None
+        return zstandard.ZstdCompressor(level=3).compress, zstandard.ZstdDecompressor().decompress
+    raise ValueError(f"Unknown compression {name!r}, use one of {COMPRESSIONS}")
+
+
+def _shuffle(a):
+    """Bytes of ``a`` with the k-th byte of every value grouped together (float16 compresses better)"""
+    return np.ascontiguousarray(a.reshape(-1).view(np.uint8).reshape(-1, a.itemsize).T).tobytes()
+
+
+def _unshuffle(data, dtype, shape):
+    """Inverse of _shuffle"""
+    itemsize = np.dtype(dtype).itemsize
+    flat = np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1).T
+    return np.ascontiguousarray(flat).view(dtype).reshape(shape)
+
+
+class LatentArrayWriter:
+    """
+    Write (N, T_max, C, H, W) float32 latents to a latent array, rows in any order
+
+    Rows are pooled and quantized as they arrive into a memory-mapped
+    data.npy (zero after each window's length); close() compresses it
+    chunk by chunk and writes codec.json last.
+
+    Args:
+        path: array directory
+        num_rows: N
+        row_shape: (T_max, C, H, W) of the latents passed to put
+        dtype, grid, compression: see the module docstring
+        chunk_rows: windows per compressed chunk (the unit of a read)
+    """
+
+    def __init__(self, path, num_rows, row_shape, dtype="float16", grid=None, compression=None, chunk_rows=64):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown latent dtype {dtype!r}, use one of {DTYPES}")
+        if compression is not None:
+            _codec(compression)  # fail before encoding anything
+        T_max, C, H, W = row_shape
+        if grid is not None and (H % grid or W % grid):
+            raise ValueError(f"grid {grid} does not divide the {H}x{W} latent maps")
+        self.path = Path(path)
+        self.dtype, self.grid, self.compression, self.chunk_rows = dtype, grid, compression, chunk_rows
+        self.shape = (num_rows, T_max, C) + ((H, W) if grid is None else (grid, grid))
+        self.path.mkdir(parents=True, exist_ok=True)
+        for name in ("codec.json", "chunks.bin", "offsets.npy", "scales.npy"):
+            (self.path / name).unlink(missing_ok=True)  # incomplete until codec.json is rewritten
+        self.data = np.lib.format.open_memmap(self.path / "data.npy", mode="w+", dtype=dtype, shape=self.shape)
+        self.data[:] = 0
+        self.scales = None
+        if dtype == "int8":
+            self.scales = np.lib.format.open_memmap(self.path / "scales.npy", mode="w+",
+                                                    dtype=np.float32, shape=(num_rows, C))
+            self.scales[:] = 1
+
+    def put(self, rows, z):
+        """Store windows ``rows``: z is (n, T, C, H, W) with T <= T_max"""
+        q, scales = quantize(pool_maps(np.asarray(z, dtype=np.float32), self.grid), self.dtype)
+        self.data[rows, :q.shape[1]] = q
+        if scales is not None:
+            self.scales[rows] = scales
+
+    def close(self):
+        """Compress (if asked), write codec.json and open the array for reading"""
+        self.data.flush()
+        if self.scales is not None:
+            self.scales.flush()
+        if self.compression is not None:
+            compress, _ = _codec(self.compression)
+            offsets = [0]
+            with open(self.path / "chunks.bin", "wb") as f:
+                for s in range(0, self.shape[0], self.chunk_rows):
+                    block = compress(_shuffle(np.asarray(self.data[s:s + self.chunk_rows])))
+                    f.write(block)
+                    offsets.append(offsets[-1] + len(block))
+            np.save(self.path / "offsets.npy", np.asarray(offsets, dtype=np.int64))
+            self.data = None
+            (self.path / "data.npy").unlink()
+        meta = {"dtype": self.dtype, "grid": self.grid, "compression": self.compression,
+                "chunk_rows": self.chunk_rows, "shape": list(self.shape)}
+        tmp = self.path / f".codec.json.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp, self.path / "codec.json")
+        return LatentArray(self.path)
+
+
+class LatentArray:
+    """
+    Read access to a latent array; indexing returns dequantized float32
+
+    ``array[rows]`` with an int, slice or index array gives (n, T_max, C, g, g)
+    (or (T_max, C, g, g) for an int).
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / "codec.json") as f:
+            self.meta = json.load(f)
+        self.shape = tuple(self.meta["shape"])
+        self.dtype = self.meta["dtype"]
+        self.compression = self.meta["compression"]
+        self.chunk_rows = self.meta["chunk_rows"]
+        self.scales = np.load(self.path / "scales.npy") if self.dtype == "int8" else None
+        if self.compression is None:
+            self._data = np.load(self.path / "data.npy", mmap_mode="r")
+        else:
+            self._decompress = _codec(self.compression)[1]
+            self._offsets = np.load(self.path / "offsets.npy")
+            self._blocks = np.memmap(self.path / "chunks.bin", dtype=np.uint8, mode="r")
+        self._last = (None, None)  # most recently decompressed chunk, for sequential reads
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        """Size on disk"""
+        return sum(p.stat().st_size for p in self.path.iterdir() if p.is_file())
+
+    def _chunk(self, c):
+        if self._last[0] != c:
+            start, end = self._offsets[c], self._offsets[c + 1]
+            n = min(self.chunk_rows, len(self) - c * self.chunk_rows)
+            data = self._decompress(self._blocks[start:end].tobytes())
+            self._last = (c, _unshuffle(data, self.dtype, (n,) + self.shape[1:]))
+        return self._last[1]
+
+    def __getitem__(self, rows):
+        if isinstance(rows, (int, np.integer)):
+            return self[[rows]][0]
+        if isinstance(rows, slice):
+            rows = np.arange(*rows.indices(len(self)))
+        rows = np.asarray(rows, dtype=np.int64)
+        if self.compression is None:
+            q = np.asarray(self._data[rows])
+        else:
+            q = np.empty((len(rows),) + self.shape[1:], dtype=self.dtype)
+            chunk_ids = rows // self.chunk_rows
+            for c in np.unique(chunk_ids):
+                sel = chunk_ids == c
+                q[sel] = self._chunk(c)[rows[sel] - c * self.chunk_rows]
+        return dequantize(q, None if self.scales is None else self.scales[rows])
+
+
+def mean_speeds(z, lengths):
+    """
+    Per-window mean step speed of the spatially pooled trajectory
+    (mean_speed of analyze_all_embryos.py on latent_index.frame_vectors)
+    """
+    v = z.mean(axis=(-2, -1))  # (n, T, C)
+    steps = np.linalg.norm(np.diff(v, axis=1), axis=-1)
+    valid = np.arange(steps.shape[1])[None] < (np.asarray(lengths) - 1)[:, None]
+    return (steps * valid).sum(axis=1) / np.maximum(np.asarray(lengths) - 1, 1)
+
+
+def speed_outliers(speeds):
+    """The ±2σ speed outliers of analyze_all_embryos.py"""
+    return np.abs(speeds - speeds.mean()) > 2 * speeds.std()
+
+
+def accuracy_report(reference, lengths, variants, workdir="latent_codec_tmp", chunk_rows=64):
+    """
+    Size, speed and accuracy of storage variants against float32 latents
+
+    Args:
+        reference: (n, T_max, C, H, W) float32 z_seq, zero after each length
+        lengths: (n,) frames per window
+        variants: iterable of (dtype, grid, compression)
+
+    Returns:
+        list of dicts: bytes_per_window, ratio (vs float32), write_s / read_s,
+        rel_error (vs the float32 maps pooled to the same grid), and for the
+        downstream features: speed_rel_error (median), speed_corr and
+        outlier_agreement (fraction of windows with the same ±2σ flag)
+    """
+    n = len(reference)
+    ref_speed = mean_speeds(reference, lengths)
+    ref_outliers = speed_outliers(ref_speed)
+    results = []
+    for dtype, grid, compression in variants:
+        path = Path(workdir) / f"{dtype}_{grid or 'full'}_{compression or 'none'}"
+        t0 = time.perf_counter()
+        writer = LatentArrayWriter(path, n, reference.shape[1:], dtype, grid, compression, chunk_rows)
+        writer.put(np.arange(n), reference)
+        array = writer.close()
+        write_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        z = array[np.arange(n)]
+        read_s = time.perf_counter() - t0
+        target = pool_maps(reference, grid)
+        speed = mean_speeds(z, lengths)
+        results.append({
+            "dtype": dtype,
+            "grid": grid,
+            "compression": compression,
+            "bytes_per_window": array.nbytes / n,
+            "ratio": reference.nbytes / array.nbytes,
+            "write_s": round(write_s, 4),
+            "read_s": round(read_s, 4),
+            "rel_error": float(np.linalg.norm(z - target) / max(np.linalg.norm(target), 1e-12)),
+            "speed_rel_error": float(np.median(np.abs(speed - ref_speed) / np.maximum(ref_speed, 1e-12))),
+            "speed_corr": float(np.corrcoef(speed, ref_speed)[0, 1]) if n > 1 else 1.0,
+            "outlier_agreement": float((speed_outliers(speed) == ref_outliers).mean()),
+        })
+        shutil.rmtree(path)
+    shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def main(checkpoint, index_csv="index.csv", image_size=128, windows=64, grids=(None, 4, 2, 1),
+         compressions=None, chunk_rows=64, out="latent_codec_report.json"):
+    import torch
+    from feature_store import load_autoencoder
+    from dataset_ivf import IVFSequenceDataset
+    from inference_engine import InferenceEngine
+    from length_bucketing import window_lengths, equal_length_batches
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    if compressions is None:
+        compressions = [None, "zlib"]
+        try:
+            import zstandard  # noqa: F401
+            compressions.append("zstd")
+        except ImportError:
+            pass
+    dataset = IVFSequenceDataset(index_csv, resize=image_size, norm="minmax01")
+    rows = dataset.df.drop_duplicates("cell_id").index.to_numpy()[:windows]
+    lengths = np.asarray(window_lengths(dataset), dtype=np.int64)[rows]
+    model, _ = load_autoencoder(checkpoint, device)
+    engine = InferenceEngine(model, device=device)
+    reference = None
+    for batch in equal_length_batches(lengths, 16):
+        vol = torch.stack([dataset[int(rows[i])][0] for i in batch])
+        seq, _ = engine.encode(vol)
+        if reference is None:
+            reference = np.zeros((len(rows), int(lengths.max())) + tuple(seq.shape[2:]), dtype=np.float32)
+        reference[batch, :seq.shape[1]] = seq.float().numpy()
+
+    variants = [(d, g, c) for d in DTYPES for g in grids for c in compressions]
+    results = accuracy_report(reference, lengths, variants, chunk_rows=chunk_rows)
+    print(f"\n{len(rows)} windows, float32 z_seq {reference.nbytes / len(rows) / 1024:.0f} KB per window")
+    print(f"{'dtype':<8} {'grid':>5} {'compression':<12} {'KB/window':>10} {'ratio':>7} {'read':>8} "
+          f"{'rel err':>8} {'speed err':>10} {'outliers':>9}")
+    for r in results:
+        print(f"{r['dtype']:<8} {str(r['grid'] or 'full'):>5} {str(r['compression'] or 'none'):<12} "
+              f"{r['bytes_per_window'] / 1024:10.1f} {r['ratio']:6.1f}x {r['read_s'] * 1000:6.1f}ms "
+              f"{r['rel_error']:8.4f} {r['speed_rel_error']:10.2e} {r['outlier_agreement']:9.3f}")
+    if out:
+        with open(out, "w") as f:
+            json.dump({"checkpoint": str(checkpoint), "windows": len(rows), "results": results}, f, indent=2)
+        print(f"Saved: {out}")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Size and accuracy of compressed latent storage variants")
+    parser.add_argument("--checkpoint", type=str, required=True,
+                        help="Trained autoencoder (training checkpoint or inference artifact)")
+    parser.add_argument("--index_csv", type=str, default="index.csv")
+    parser.add_argument("--image_size", type=int, default=128)
+    parser.add_argument("--windows", type=int, default=64, help="Embryos sampled (first window of each)")
+    parser.add_argument("--grids", type=int, nargs="+", default=[0, 4, 2, 1],
+                        help="Pooling grids to compare (0 = full maps)")
+    parser.add_argument("--compressions", nargs="+", default=None, choices=["none", "zlib", "zstd"],
+                        help="Default: none, zlib and zstd if zstandard is installed")
+    parser.add_argument("--chunk_rows", type=int, default=64, help="Windows per compressed chunk")
+    parser.add_argument("--out", type=str, default="latent_codec_report.json")
+    args = parser.parse_args()
+
+    main(
+        checkpoint=args.checkpoint,
+        index_csv=args.index_csv,
+        image_size=args.image_size,
+        windows=args.windows,
+        grids=[g or None for g in args.grids],
+        compressions=None if args.compressions is None else [None if c == "none" else c for c in args.compressions],
+        chunk_rows=args.chunk_rows,
+        out=args.out
+    )
@@ -0,0 +1,136 @@
+"""
+Variable-length windows: length-bucketed batches and padding collate
+
+With a variable-length index (build_index.py VARIABLE_LENGTH = True),
+windows have different numbers of frames. LengthBucketBatchSampler groups
+windows of similar length into the same batch, so almost no padding is
+needed, and pad_collate pads the rest at the end of the sequence and returns
+the real lengths. reconstruction_loss / temporal_smoothness_loss take the
+matching mask (losses.lengths_to_mask), so padding frames cost compute only
+for the few mixed-length batches and never contribute to the loss.
+"""
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+
+def window_lengths(dataset):
+    """Number of frames of every window of an IVFSequenceDataset"""
+    df = dataset.df
+    if "length" in df.columns:
+        return df["length"].astype(int).tolist()
+    return (df["paths"].str.count(r"\|") + 1).astype(int).tolist()
+
+
+def equal_length_batches(lengths, batch_size):
+    """
+    Batches of window indices of equal length, in index order within each length
+
+    For inference passes (feature store, checkpoint comparison): no padding
+    at all, and each batch can be used as a DataLoader batch_sampler entry.
+    """
+    lengths = np.asarray(lengths)
+    return [group[s:s + batch_size].tolist()
+            for T in np.unique(lengths)
+            for group in [np.flatnonzero(lengths == T)]
+            for s in range(0, len(group), batch_size)]
+
+
+def pad_collate(batch):
+    """
+    Collate (vol, cell_id) samples of different lengths
+
+    Returns:
+        vol: (B, T_max, 1, H, W), zero-padded at the end
+        cell_ids: list of cell ids
+        lengths: (B,) number of real frames per sample
+    """
+    vols, cell_ids = zip(*batch)
+    lengths = torch.tensor([v.shape[0] for v in vols])
+    T_max = int(lengths.max())
+    out = vols[0].new_zeros((len(vols), T_max) + tuple(vols[0].shape[1:]))
+    for i, v in enumerate(vols):
+        out[i, :v.shape[0]] = v
+    return out, list(cell_ids), lengths
+
+
+class LengthBucketBatchSampler(Sampler):
+    """
+    Batches of windows with similar lengths, reshuffled every epoch
+
+    The epoch's random permutation is cut into pools of ``pool_batches``
+    batches; each pool is sorted by length and cut into batches, and the
+    batches are shuffled. Batches are therefore random but nearly
+    length-homogeneous. With ``max_frames`` the batch size varies instead,
+    so that batch_size * longest window <= max_frames: every batch costs
+    about the same and short windows are trained in larger batches.
+
+    Has the same set_epoch / set_start / seed interface as
+    checkpointing.ResumableSampler, so mid-epoch resume works unchanged.
+
+    Args:
+        lengths: number of frames of every window
+        batch_size: windows per batch (upper bound when max_frames is set)
+        shuffle: shuffle windows and batches (False = index order, sorted per pool)
+        seed: base seed of the per-epoch order
+        max_frames: frame budget per batch (None = fixed batch_size)
+        pool_batches: batches per sorting pool
+    """
+
+    def __init__(self, lengths, batch_size, shuffle=True, seed=0, max_frames=None, pool_batches=50):
+        self.lengths = list(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.max_frames = max_frames
+        self.pool_batches = pool_batches
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        self.start = 0
+
+    def set_start(self, start):
+        """Skip the batches holding the first ``start`` samples of the current epoch"""
+        self.start = start
+
+    def _batches(self):
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        n = len(self.lengths)
+        order = torch.randperm(n, generator=g).tolist() if self.shuffle else list(range(n))
+        pool_size = self.batch_size * self.pool_batches
+        batches = []
+        for p in range(0, n, pool_size):
+            pool = sorted(order[p:p + pool_size], key=lambda i: self.lengths[i])
+            batch = []
+            for i in pool:
+                # The pool is sorted, so window i is the longest of the batch so far
+                full = len(batch) >= self.batch_size
+                over_budget = self.max_frames and batch and (len(batch) + 1) * self.lengths[i] > self.max_frames
+                if full or over_budget:
+                    batches.append(batch)
+                    batch = []
+                batch.append(i)
+            if batch:
+                batches.append(batch)
+        if self.shuffle:
+            perm = torch.randperm(len(batches), generator=g).tolist()
+            batches = [batches[i] for i in perm]
+        return batches
+
+    def __iter__(self):
+        seen = 0
+        for batch in self._batches():
+            if seen >= self.start:
+                yield batch
+            seen += len(batch)
+
+    def __len__(self):
+        seen, count = 0, 0
+        for batch in self._batches():
+            if seen >= self.start:
+                count += 1
+            seen += len(batch)
+        return count
@@ -19,11 +19,12 @@ def gaussian_kernel(size=11, sigma=1.5):
     return g.unsqueeze(0) * g.unsqueeze(1)
 
 
-def ssim(img1, img2, kernel_size=11, sigma=1.5, C1=0.01**2, C2=0.03**2):
+def ssim(img1, img2, kernel_size=11, sigma=1.5, C1=0.01**2, C2=0.03**2, reduction="mean"):
     """
     Single-scale SSIM
     Args:
         img1, img2: (B, C, H, W)
+        reduction: "mean" (scalar) or "none" (one value per image, (B,))
     """
     kernel = gaussian_kernel(kernel_size, sigma).to(img1.device)
     kernel = kernel.unsqueeze(0).unsqueeze(0)  # (1, 1, k, k)
@@ -42,16 +43,21 @@ def ssim(img1, img2, kernel_size=11, sigma=1.5, C1=0.01**2, C2=0.03**2):
     ssim_map = ((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / \
                ((mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2))
     
+    if reduction == "none":
+        return ssim_map.mean(dim=(1, 2, 3))
     return ssim_map.mean()
 
 
-def ms_ssim(img1, img2, kernel_size=11, sigma=1.5, weights=None, levels=5):
+def ms_ssim(img1, img2, kernel_size=11, sigma=1.5, weights=None, levels=5, reduction="mean"):
     """
     Multi-Scale SSIM (MS-SSIM)
     Args:
         img1, img2: (B, C, H, W)
         weights: weights for each scale, default [0.0448, 0.2856, 0.3001, 0.2363, 0.1333]
         levels: number of scales
+        reduction: "mean" (scalar, over the batch) or "none" (one value per
+            image, (B,)); per-image terms are clamped at 0 before the
+            fractional powers, so a very poor reconstruction scores 0, not NaN
     """
     if weights is None:
         weights = torch.tensor([0.0448, 0.2856, 0.3001, 0.2363, 0.1333], 
@@ -67,7 +73,7 @@ def ms_ssim(img1, img2, kernel_size=11, sigma=1.5, weights=None, levels=5):
     for i in range(levels):
         if i == levels - 1:
             # Last layer computes SSIM
-            ssim_val = ssim(img1, img2, kernel_size, sigma)
+            ssim_val = ssim(img1, img2, kernel_size, sigma, reduction=reduction)
         else:
             # Other layers compute contrast
             kernel = gaussian_kernel(kernel_size, sigma).to(img1.device)
@@ -82,7 +88,7 @@ def ms_ssim(img1, img2, kernel_size=11, sigma=1.5, weights=None, levels=5):
             
             C2 = 0.03 ** 2
             mcs = (2 * sigma12 + C2) / (sigma1_sq + sigma2_sq + C2)
-            mcs_list.append(mcs.mean())
+            mcs_list.append(mcs.mean(dim=(1, 2, 3)) if reduction == "none" else mcs.mean())
         
         # Downsample to next level
         if i < levels - 1:
@@ -90,6 +96,9 @@ def ms_ssim(img1, img2, kernel_size=11, sigma=1.5, weights=None, levels=5):
             img2 = F.avg_pool2d(img2, 2)
     
     # Combine all scales
+    if reduction == "none":
+        ssim_val = ssim_val.clamp(min=0)
+        mcs_list = [mcs.clamp(min=0) for mcs in mcs_list]
     ms_ssim_val = ssim_val
     for i, mcs in enumerate(mcs_list):
         ms_ssim_val = ms_ssim_val ** weights[i] * mcs ** weights[i]
@@ -97,7 +106,19 @@ def ms_ssim(img1, img2, kernel_size=11, sigma=1.5, weights=None, levels=5):
     return ms_ssim_val
 
 
-def reconstruction_loss(x_rec, x_true, l1_weight=0.5, ms_ssim_weight=0.5):
+def lengths_to_mask(lengths, max_len=None):
+    """
+    Boolean (B, T) mask of the valid timesteps of padded sequences
+    Args:
+        lengths: (B,) - number of real frames per sequence
+        max_len: padded length T (default: lengths.max())
+    """
+    max_len = max_len or int(lengths.max())
+    steps = torch.arange(max_len, device=lengths.device)
+    return steps.unsqueeze(0) < lengths.unsqueeze(1)
+
+
+def reconstruction_loss(x_rec, x_true, l1_weight=0.5, ms_ssim_weight=0.5, mask=None):
     """
     Combined reconstruction loss: L1 + MS-SSIM
     Args:
@@ -105,15 +126,21 @@ def reconstruction_loss(x_rec, x_true, l1_weight=0.5, ms_ssim_weight=0.5):
         x_true: (B, T, 1, H, W) - original video
         l1_weight: L1 loss weight
         ms_ssim_weight: MS-SSIM loss weight
+        mask: (B, T) bool - valid frames of padded sequences (optional);
+            padding frames do not contribute to either term
     """
     B, T, C, H, W = x_rec.shape
     
     # Flatten temporal dimension for MS-SSIM computation
-    x_rec_flat = x_rec.view(B * T, C, H, W)  # (B*T, 1, 128, 128)
-    x_true_flat = x_true.view(B * T, C, H, W)  # (B*T, 1, 128, 128)
+    if mask is None:
+        x_rec_flat = x_rec.reshape(B * T, C, H, W)  # (B*T, 1, H, W)
+        x_true_flat = x_true.reshape(B * T, C, H, W)  # (B*T, 1, H, W)
+    else:
+        x_rec_flat = x_rec[mask]  # (N_valid, 1, H, W)
+        x_true_flat = x_true[mask]
     
     # L1 Loss
-    l1_loss = F.l1_loss(x_rec, x_true)
+    l1_loss = F.l1_loss(x_rec_flat, x_true_flat)
     
     # MS-SSIM Loss
     ms_ssim_val = ms_ssim(x_rec_flat, x_true_flat)
@@ -129,18 +156,46 @@ def reconstruction_loss(x_rec, x_true, l1_weight=0.5, ms_ssim_weight=0.5):
     }
 
 
-def temporal_smoothness_loss(z_seq, weight=0.1):
+def frame_errors(x_rec, x_true, mask=None):
+    """
+    Per-frame reconstruction errors (anomaly scores)
+    Args:
+        x_rec: (B, T, 1, H, W) - reconstructed video
+        x_true: (B, T, 1, H, W) - original video
+        mask: (B, T) bool - valid frames of padded sequences (optional)
+    Returns:
+        l1: (B, T) mean absolute error per frame
+        ms_ssim: (B, T) MS-SSIM per frame (NaN for padding frames)
+    """
+    B, T, C, H, W = x_rec.shape
+    valid = mask if mask is not None else torch.ones(B, T, dtype=torch.bool, device=x_rec.device)
+    l1 = torch.full((B, T), float("nan"), device=x_rec.device)
+    ms = torch.full((B, T), float("nan"), device=x_rec.device)
+    rec, true = x_rec[valid], x_true[valid]  # (N_valid, 1, H, W)
+    l1[valid] = (rec - true).abs().mean(dim=(1, 2, 3))
+    ms[valid] = ms_ssim(rec, true, reduction="none")
+    return l1, ms
+
+
+def temporal_smoothness_loss(z_seq, weight=0.1, mask=None):
     """
     Temporal smoothness loss: encourages similar latents for adjacent timesteps
     Args:
         z_seq: (B, T, C, H, W) - latent sequence
         weight: loss weight
+        mask: (B, T) bool - valid timesteps of padded sequences (optional);
+            only pairs of two valid steps count
     """
     if z_seq.size(1) < 2:
         return torch.tensor(0.0, device=z_seq.device)
     
     # Compute difference between adjacent timesteps
     diff = z_seq[:, 1:] - z_seq[:, :-1]  # (B, T-1, C, H, W)
+    if mask is not None:
+        pairs = mask[:, 1:] & mask[:, :-1]  # (B, T-1)
+        if not pairs.any():
+            return torch.tensor(0.0, device=z_seq.device)
+        diff = diff[pairs]
     smooth_loss = (diff ** 2).mean()
     
     return weight * smooth_loss
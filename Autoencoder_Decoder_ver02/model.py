@@ -8,13 +8,50 @@ Complete High-Quality ConvLSTM Autoencoder
 """
 import torch
 import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
 from conv_lstm import ConvLSTM
 
 
+def _valid_steps(lengths, T):
+    """(B, T) bool mask of the real (non-padding) timesteps"""
+    return torch.arange(T, device=lengths.device).unsqueeze(0) < lengths.unsqueeze(1)
+
+
+def _run_spatial_masked(module, x, valid, use_checkpoint):
+    """
+    Apply a per-frame spatial stack to the real frames of a padded (B, T, ...) batch
+    
+    Padding frames are skipped (no compute, no effect on BatchNorm
+    statistics) and come out as zeros.
+    """
+    out = _run_spatial(module, x[valid], use_checkpoint)  # (N_valid, C, H, W)
+    full = out.new_zeros(valid.shape + out.shape[1:])
+    full[valid] = out
+    return full
+
+
+def _run_spatial(module, x, use_checkpoint):
+    """
+    Apply a per-frame spatial stack, optionally with activation checkpointing
+    
+    With checkpointing the stack's activations (the largest tensors of the
+    model, at full frame resolution for every frame of the window) are not
+    kept for backward but recomputed, trading ~30% more compute for a much
+    larger batch. BatchNorm running statistics are updated twice per step
+    in that mode.
+    """
+    if use_checkpoint and module.training and torch.is_grad_enabled():
+        return checkpoint(module, x, use_reentrant=False)
+    return module(x)
+
+
 class Encoder(nn.Module):
     """
     Encoder: 2D CNN spatial compression + ConvLSTM temporal modeling
     Output: z_seq (B, T, C, H, W) and z_last (B, C, H, W)
+    
+    Fully convolutional: any frame size divisible by 8 works with the same
+    weights, the latent grid is (H/8, W/8).
     """
     
     def __init__(self, input_channels=1, hidden_dim=256, num_layers=2):
@@ -53,42 +90,71 @@ class Encoder(nn.Module):
             batch_first=True,
             return_all_layers=False
         )
+        
+        # Recompute spatial_cnn activations in backward (see set_activation_checkpointing)
+        self.activation_checkpointing = False
     
-    def forward(self, x):
+    def forward(self, x, hidden_state=None, return_state=False, lengths=None):
         """
         Args:
             x: (B, T, 1, H, W) - input video sequence
+            hidden_state: [(h, c), ...] per ConvLSTM layer to continue from
+                (optional, zeros if None)
+            return_state: also return the final (h, c) of every layer, so the
+                next chunk of a long recording can continue from it
+            lengths: (B,) real number of frames of end-padded sequences
+                (optional); padding frames skip the spatial CNN and z_last is
+                taken at the last real frame. The ConvLSTM is causal, so
+                padding never changes the latents of real frames.
         
         Returns:
             z_seq: (B, T, hidden_dim, H_latent, W_latent) - full temporal sequence latent
             z_last: (B, hidden_dim, H_latent, W_latent) - last timestep latent
+            state: [(h, c), ...] per layer (only if return_state)
         """
         B, T, C, H, W = x.shape
         
         # Spatial compression: process each frame separately
-        x = x.view(B * T, C, H, W)  # (B*T, 1, 128, 128)
-        x = self.spatial_cnn(x)      # (B*T, 256, 16, 16)
-        _, C2, H2, W2 = x.shape
-        x = x.view(B, T, C2, H2, W2)  # (B, T, 256, 16, 16)
+        if lengths is None:
+            x = x.reshape(B * T, C, H, W)  # (B*T, 1, H, W)
+            x = _run_spatial(self.spatial_cnn, x, self.activation_checkpointing)  # (B*T, 256, H/8, W/8)
+            _, C2, H2, W2 = x.shape
+            x = x.view(B, T, C2, H2, W2)  # (B, T, 256, H/8, W/8)
+        else:
+            valid = _valid_steps(lengths.to(x.device), T)
+            x = _run_spatial_masked(self.spatial_cnn, x, valid, self.activation_checkpointing)
         
         # ConvLSTM processes temporal sequence
-        lstm_out, _ = self.convlstm(x)  # list of (B, T, hidden_dim, 16, 16)
+        lstm_out, state = self.convlstm(x, hidden_state, return_all_states=True)
         h_seq = lstm_out[0]             # (B, T, hidden_dim, 16, 16)
         
         # Version A: keep full temporal sequence latent
         z_seq = h_seq  # (B, T, hidden_dim, 16, 16)
         
         # Version B: take only last timestep
-        z_last = h_seq[:, -1]  # (B, hidden_dim, 16, 16)
+        if lengths is None:
+            z_last = h_seq[:, -1]  # (B, hidden_dim, 16, 16)
+        else:
+            z_last = h_seq[torch.arange(B, device=h_seq.device), lengths.to(h_seq.device) - 1]
         
+        if return_state:
+            return z_seq, z_last, state
         return z_seq, z_last
+    
+    def init_state(self, batch_size, image_size):
+        """Zero (h, c) for every ConvLSTM layer, for input frames of size image_size"""
+        h, w = image_size
+        for m in self.spatial_cnn:
+            if isinstance(m, nn.MaxPool2d):
+                h, w = h // 2, w // 2
+        return self.convlstm._init_hidden(batch_size, (h, w))
 
 
 class Decoder(nn.Module):
     """
     Decoder: ConvLSTM temporal decoding + ConvTranspose spatial reconstruction
     Input: z_seq (B, T, C, H, W)
-    Output: x_rec (B, T, 1, 128, 128)
+    Output: x_rec (B, T, 1, 8*H, 8*W) - (B, T, 1, 128, 128) for 16x16 latents
     """
     
     def __init__(self, seq_len, latent_dim=256, hidden_dim=128, num_layers=2):
@@ -126,14 +192,19 @@ class Decoder(nn.Module):
             nn.Conv2d(32, 1, kernel_size=3, padding=1),
             nn.Sigmoid()  # Assume pixels normalized to [0,1]
         )
+        
+        # Recompute spatial_decoder activations in backward
+        self.activation_checkpointing = False
     
-    def forward(self, z_seq):
+    def forward(self, z_seq, lengths=None):
         """
         Args:
             z_seq: (B, T, latent_dim, H_latent, W_latent) - latent sequence from encoder
+            lengths: (B,) real number of frames of end-padded sequences
+                (optional); padding steps are not decoded and come out as zeros
         
         Returns:
-            x_rec: (B, T, 1, 128, 128) - reconstructed video sequence
+            x_rec: (B, T, 1, 8*H_latent, 8*W_latent) - reconstructed video sequence
         """
         # ConvLSTM decodes temporal dimension
         lstm_out, _ = self.convlstm(z_seq)  # list of (B, T, hidden_dim, 16, 16)
@@ -141,9 +212,12 @@ class Decoder(nn.Module):
         
         # Spatial decoding: process each timestep separately
         B, T, C, H, W = h_seq.shape
+        if lengths is not None:
+            valid = _valid_steps(lengths.to(h_seq.device), T)
+            return _run_spatial_masked(self.spatial_decoder, h_seq, valid, self.activation_checkpointing)
         h_seq = h_seq.view(B * T, C, H, W)  # (B*T, hidden_dim, 16, 16)
-        x_rec = self.spatial_decoder(h_seq)  # (B*T, 1, 128, 128)
-        x_rec = x_rec.view(B, T, 1, 128, 128)  # (B, T, 1, 128, 128)
+        x_rec = _run_spatial(self.spatial_decoder, h_seq, self.activation_checkpointing)  # (B*T, 1, 8H, 8W)
+        x_rec = x_rec.view(B, T, *x_rec.shape[1:])  # (B, T, 1, 8H, 8W)
         
         return x_rec
 
@@ -230,11 +304,13 @@ class ConvLSTMAutoencoder(nn.Module):
                 num_classes=num_classes
             )
     
-    def forward(self, x, return_all=False):
+    def forward(self, x, return_all=False, lengths=None):
         """
         Args:
             x: (B, T, 1, H, W) - input video sequence
             return_all: whether to return all intermediate results
+            lengths: (B,) real number of frames when x is end-padded
+                (variable-length batches, optional)
         
         Returns:
             dict with keys:
@@ -244,10 +320,10 @@ class ConvLSTMAutoencoder(nn.Module):
                 - logits: (B, num_classes) - classification logits (if enabled)
         """
         # Encode
-        z_seq, z_last = self.encoder(x)
+        z_seq, z_last = self.encoder(x, lengths=lengths)
         
         # Decode
-        x_rec = self.decoder(z_seq)
+        x_rec = self.decoder(z_seq, lengths=lengths)
         
         # Build output dictionary
         output = {
@@ -263,12 +339,30 @@ class ConvLSTMAutoencoder(nn.Module):
         
         return output
     
-    def encode(self, x):
-        """Encode only, for extracting latent"""
-        z_seq, z_last = self.encoder(x)
-        return z_seq, z_last
+    def encode(self, x, hidden_state=None, return_state=False):
+        """
+        Encode only, for extracting latent
+        
+        A long recording can be encoded chunk by chunk, left to right, by
+        passing the state returned for one chunk into the next call. Each
+        frame is then encoded exactly once:
+        
+            state = None
+            for chunk in chunks:  # (B, T_chunk, 1, H, W)
+                z_seq, z_last, state = model.encode(chunk, state, return_state=True)
+        """
+        return self.encoder(x, hidden_state=hidden_state, return_state=return_state)
     
     def decode(self, z_seq):
         """Decode only, for reconstructing from latent"""
         return self.decoder(z_seq)
+    
+    def set_activation_checkpointing(self, enabled=True):
+        """
+        Recompute the per-frame CNN activations of encoder and decoder during
+        backward instead of storing them (larger batches fit in GPU memory)
+        """
+        self.encoder.activation_checkpointing = enabled
+        self.decoder.activation_checkpointing = enabled
+        return self
 
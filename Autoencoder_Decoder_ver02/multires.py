@@ -0,0 +1,109 @@
+"""
+Multi-resolution training helpers
+
+- Progressive-resize schedule: early epochs at low resolution, later epochs
+  at higher resolution (e.g. "0:64,10:128,30:256"). ConvLSTMAutoencoder is
+  fully convolutional, so the same weights train at every size.
+- MultiResFrameCache: on-disk cache of preprocessed frames at every
+  resolution of the schedule. The first time a frame is needed, the image is
+  decoded once and resized to all cached sizes, so switching resolution later
+  does not decode the JPEGs again.
+"""
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+SIZE_MULTIPLE = 8  # three 2x poolings in Encoder.spatial_cnn
+
+
+def parse_resize_schedule(spec):
+    """
+    Parse "epoch:size,epoch:size,..." into a sorted list of (epoch, size)
+
+    Epochs are 0-based. The first entry must start at epoch 0, and every size
+    must be a multiple of 8.
+
+    Returns:
+        list of (start_epoch, size)
+    """
+    schedule = []
+    for part in spec.split(","):
+        epoch, size = (int(v) for v in part.split(":"))
+        if size % SIZE_MULTIPLE:
+            raise ValueError(f"Image size {size} is not a multiple of {SIZE_MULTIPLE}")
+        schedule.append((epoch, size))
+    schedule.sort()
+    if not schedule or schedule[0][0] != 0:
+        raise ValueError(f"Resize schedule must start at epoch 0: {spec!r}")
+    return schedule
+
+
+def resolution_at(schedule, epoch):
+    """Image size of ``epoch`` under a parsed schedule"""
+    size = schedule[0][1]
+    for start, s in schedule:
+        if epoch >= start:
+            size = s
+    return size
+
+
+class MultiResFrameCache:
+    """
+    Preprocessed grayscale frames (uint8) per resolution, stored as .npy
+
+    Entries are keyed by image path, modification time and size, so edited
+    images are re-read. Writes go through a temporary file and an atomic
+    rename, so DataLoader workers can share one cache directory.
+
+    Args:
+        cache_dir: directory of the cache (one subdirectory per size)
+        sizes: resolutions to produce whenever an image is decoded
+    """
+
+    def __init__(self, cache_dir, sizes):
+        self.cache_dir = Path(cache_dir)
+        self.sizes = sorted(set(sizes))
+        for size in self.sizes:
+            (self.cache_dir / str(size)).mkdir(parents=True, exist_ok=True)
+
+    def _path(self, path, size):
+        stat = os.stat(path)
+        key = hashlib.sha1(f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}".encode()).hexdigest()
+        return self.cache_dir / str(size) / f"{key}.npy"
+
+    @staticmethod
+    def _write(arr, target):
+        tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, arr, allow_pickle=False)
+        os.replace(tmp, target)
+
+    def get(self, path, size):
+        """
+        Frame ``path`` as a (size, size) uint8 array
+
+        Resized with the same bilinear filter as IVFSequenceDataset, so
+        cached and uncached frames are identical.
+        """
+        target = self._path(path, size)
+        try:
+            return np.load(target, allow_pickle=False)
+        except (OSError, ValueError):
+            pass  # not cached yet (or a truncated entry)
+
+        img = Image.open(path).convert("L")
+        result = None
+        for s in sorted(set(self.sizes) | {size}):
+            arr = np.array(img.resize((s, s), Image.BILINEAR), dtype=np.uint8)
+            if s in self.sizes:
+                self._write(arr, self._path(path, s))
+            if s == size:
+                result = arr
+        return result
+
+    def nbytes(self):
+        """Total size of the cache on disk"""
+        return sum(p.stat().st_size for p in self.cache_dir.rglob("*.npy"))
@@ -0,0 +1,224 @@
+"""
+Linear, MLP and scikit-learn probes on a feature store
+
+Fits several heads on the stored encoder features (feature_store.py) and
+reports accuracy and balanced accuracy on the held-out embryos. Nothing
+runs the encoder once the store exists, so comparing heads, feature kinds
+or label sets takes seconds.
+
+Models:
+    linear   nn.Linear on standardized features
+    mlp      one hidden layer (PROBE_HIDDEN units, ReLU, dropout)
+    logreg   sklearn LogisticRegression
+    knn      sklearn KNeighborsClassifier
+    rf       sklearn RandomForestClassifier
+All models weight classes by their inverse frequency. Torch probes train
+with large batches (--batch_size 1024) on the GPU when there is one.
+
+Usage:
+    python probe.py --checkpoint checkpoints/best_model.pt --index_csv index.csv \
+        --labels_csv labels.csv --features last mean --models linear mlp logreg
+"""
+import json
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from feature_store import build_feature_store, FEATURE_KINDS
+from labels import window_labels, class_counts, classification_metrics, UNLABELED
+
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+TORCH_MODELS = ("linear", "mlp")
+SKLEARN_MODELS = ("logreg", "knn", "rf")
+PROBE_HIDDEN = 256
+
+
+def class_weights(y, num_classes):
+    """Inverse-frequency class weights (sklearn's class_weight="balanced")"""
+    counts = np.bincount(y, minlength=num_classes).astype(np.float64)
+    return len(y) / (num_classes * np.maximum(counts, 1))
+
+
+def fit_torch_probe(model_name, X, y, num_classes, epochs=100, batch_size=1024, learning_rate=1e-3,
+                    weight_decay=1e-4, seed=0, device="cpu"):
+    """
+    Train a linear or MLP probe on standardized features
+
+    Returns:
+        predict function: (n, d) array -> (n,) class indices
+    """
+    torch.manual_seed(seed)
+    mean, std = X.mean(axis=0), X.std(axis=0) + 1e-6
+    Xt = torch.from_numpy((X - mean) / std).float().to(device)
+    yt = torch.from_numpy(y).long().to(device)
+    d = X.shape[1]
+    if model_name == "linear":
+        net = nn.Linear(d, num_classes)
+    else:
+        net = nn.Sequential(nn.Linear(d, PROBE_HIDDEN), nn.ReLU(inplace=True), nn.Dropout(0.2),
+                            nn.Linear(PROBE_HIDDEN, num_classes))
+    net = net.to(device)
+    optimizer = torch.optim.AdamW(net.parameters(), lr=learning_rate, weight_decay=weight_decay)
+    weight = torch.tensor(class_weights(y, num_classes), dtype=torch.float32, device=device)
+    criterion = nn.CrossEntropyLoss(weight=weight)
+    g = torch.Generator().manual_seed(seed)
+    net.train()
+    for _ in range(epochs):
+        order = torch.randperm(len(yt), generator=g).to(device)
+        for s in range(0, len(order), batch_size):
+            idx = order[s:s + batch_size]
+            loss = criterion(net(Xt[idx]), yt[idx])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+    net.eval()
+
+    def predict(X_new):
+        with torch.no_grad():
+            x = torch.from_numpy((X_new - mean) / std).float().to(device)
+            return net(x).argmax(dim=1).cpu().numpy()
+    return predict
+
+
+def fit_sklearn_probe(model_name, X, y, seed=0):
+    """
+    Fit a scikit-learn probe (standardized features)
+
+    Returns:
+        predict function: (n, d) array -> (n,) class indices
+    """
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    if model_name == "logreg":
+        from sklearn.linear_model import LogisticRegression
+        clf = LogisticRegression(max_iter=2000, class_weight="balanced")
+    elif model_name == "knn":
+        from sklearn.neighbors import KNeighborsClassifier
+        clf = KNeighborsClassifier(n_neighbors=min(5, len(y)), weights="distance")
+    else:
+        from sklearn.ensemble import RandomForestClassifier
+        clf = RandomForestClassifier(n_estimators=200, class_weight="balanced", n_jobs=-1, random_state=seed)
+    pipe = make_pipeline(StandardScaler(), clf).fit(X, y)
+    return pipe.predict
+
+
+def probe_split(df, labeled):
+    """
+    Train/val masks over the labeled windows: the index's split column, else
+    a hash split of the embryos (build_index.embryo_split)
+    """
+    if "split" in df.columns and (df["split"].iloc[labeled] == "val").any():
+        is_val = (df["split"].iloc[labeled] == "val").to_numpy()
+    else:
+        from build_index import embryo_split
+        cells = df["cell_id"].iloc[labeled]
+        splits = embryo_split(cells.unique(), val_fraction=0.2)
+        is_val = (cells.map(splits) == "val").to_numpy()
+    return ~is_val, is_val
+
+
+def run_probes(store, labels_csv=None, feature_kinds=("last",), models=TORCH_MODELS + ("logreg",),
+               epochs=100, batch_size=1024, learning_rate=1e-3, weight_decay=1e-4, seed=0, device="cpu"):
+    """
+    Fit every (feature kind, model) pair on the store's labeled windows
+
+    Returns:
+        list of result dicts (features, model, fit_seconds, train_/val_ metrics)
+    """
+    y_all, classes = window_labels(store.df, labels_csv)
+    if not classes:
+        raise ValueError("No labels: add a label column to the index (build_index.py LABELS_CSV) "
+                         "or pass --labels_csv")
+    labeled = (y_all != UNLABELED).nonzero().flatten().numpy()
+    y = y_all[labeled].numpy()
+    train, val = probe_split(store.df, labeled)
+    num_classes = len(classes)
+    print(f"Classes: {classes}, labeled windows: {len(labeled)}/{len(store)} "
+          f"({int(train.sum())} train / {int(val.sum())} val), "
+          f"per class: {class_counts(y_all, num_classes).tolist()}")
+
+    results = []
+    for kind in feature_kinds:
+        X = store.features(kind, labeled)
+        for name in models:
+            t0 = time.perf_counter()
+            if name in TORCH_MODELS:
+                predict = fit_torch_probe(name, X[train], y[train], num_classes, epochs, batch_size,
+                                          learning_rate, weight_decay, seed, device)
+            elif name in SKLEARN_MODELS:
+                predict = fit_sklearn_probe(name, X[train], y[train], seed)
+            else:
+                raise ValueError(f"Unknown probe {name!r}, use one of {TORCH_MODELS + SKLEARN_MODELS}")
+            entry = {"features": kind, "model": name, "fit_seconds": round(time.perf_counter() - t0, 3)}
+            entry.update({f"train_{k}": v for k, v in
+                          classification_metrics(predict(X[train]), y[train], num_classes).items()})
+            if val.any():
+                entry.update({f"val_{k}": v for k, v in
+                              classification_metrics(predict(X[val]), y[val], num_classes).items()})
+            results.append(entry)
+    return results
+
+
+def main(checkpoint, index_csv="index.csv", labels_csv=None, feature_store="feature_store", image_size=128,
+         feature_kinds=("last",), models=TORCH_MODELS + ("logreg",), epochs=100, batch_size=1024,
+         learning_rate=1e-3, weight_decay=1e-4, seed=0, encode_batch_size=32, out="probe_results.json"):
+    store = build_feature_store(checkpoint, index_csv, feature_store, image_size, encode_batch_size, DEVICE)
+    results = run_probes(store, labels_csv, feature_kinds, models, epochs, batch_size, learning_rate,
+                         weight_decay, seed, DEVICE)
+
+    print(f"\n{'features':<10} {'model':<8} {'fit':>8} {'train bacc':>11} {'val acc':>8} {'val bacc':>9}")
+    for r in results:
+        print(f"{r['features']:<10} {r['model']:<8} {r['fit_seconds']:7.2f}s "
+              f"{r['train_balanced_accuracy']:11.3f} {r.get('val_accuracy', float('nan')):8.3f} "
+              f"{r.get('val_balanced_accuracy', float('nan')):9.3f}")
+    if out:
+        with open(out, "w") as f:
+            json.dump({"store": str(store.path), "labels_csv": labels_csv, "results": results}, f, indent=2)
+        print(f"Saved: {out}")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fit linear / MLP / scikit-learn probes on stored encoder features")
+    parser.add_argument("--checkpoint", type=str, required=True,
+                        help="Trained autoencoder (training checkpoint or inference artifact)")
+    parser.add_argument("--index_csv", type=str, default="index.csv")
+    parser.add_argument("--labels_csv", type=str, default=None,
+                        help="CSV of cell_id,label joined on cell_id (overrides the index's label column)")
+    parser.add_argument("--feature_store", type=str, default="feature_store",
+                        help="Feature store directory (built if missing or stale)")
+    parser.add_argument("--image_size", type=int, default=128)
+    parser.add_argument("--features", nargs="+", default=["last"], choices=FEATURE_KINDS,
+                        help="Pooled feature kinds to probe")
+    parser.add_argument("--models", nargs="+", default=["linear", "mlp", "logreg"],
+                        choices=TORCH_MODELS + SKLEARN_MODELS)
+    parser.add_argument("--epochs", type=int, default=100, help="Epochs of the torch probes")
+    parser.add_argument("--batch_size", type=int, default=1024, help="Batch size of the torch probes")
+    parser.add_argument("--learning_rate", type=float, default=1e-3)
+    parser.add_argument("--weight_decay", type=float, default=1e-4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--encode_batch_size", type=int, default=32,
+                        help="Windows per encoder batch when building the store")
+    parser.add_argument("--out", type=str, default="probe_results.json")
+    args = parser.parse_args()
+
+    main(
+        checkpoint=args.checkpoint,
+        index_csv=args.index_csv,
+        labels_csv=args.labels_csv,
+        feature_store=args.feature_store,
+        image_size=args.image_size,
+        feature_kinds=args.features,
+        models=args.models,
+        epochs=args.epochs,
+        batch_size=args.batch_size,
+        learning_rate=args.learning_rate,
+        weight_decay=args.weight_decay,
+        seed=args.seed,
+        encode_batch_size=args.encode_batch_size,
+        out=args.out
+    )
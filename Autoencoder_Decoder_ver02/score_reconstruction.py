@@ -0,0 +1,148 @@
+"""
+Reconstruction-error anomaly scores for every embryo of an index
+
+One batched pass runs the full autoencoder over every window (bf16 autocast
+and large batches on GPU) and stores per-frame L1 and per-image MS-SSIM in
+the feature store (feature_store.py, reconstruction=True). The scores are
+then aggregated:
+  - per timepoint: frames shared by overlapping windows are averaged
+    -> recon_per_timepoint.csv (cell_id, t_index, time_h, l1, ms_ssim, error)
+  - per embryo: mean / max error, worst timepoint and a robust z-score
+    (median / MAD over all embryos) -> recon_anomaly_ranking.csv, sorted
+    from the most to the least anomalous embryo
+
+The per-frame error is the training reconstruction loss of that frame,
+0.5 * L1 + 0.5 * (1 - MS-SSIM), so it is on the same scale as the logged
+losses.
+
+Usage:
+    python score_reconstruction.py --checkpoint checkpoints/best_model.pt --index_csv index.csv \
+        --batch_size 64 --num_workers 8
+"""
+import numpy as np
+import pandas as pd
+import torch
+
+from feature_store import build_feature_store
+from frame_metadata import parse_times
+
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def frame_scores(store, l1_weight=0.5, ms_ssim_weight=0.5):
+    """
+    Per-frame scores of every window as a long table
+
+    Returns:
+        DataFrame with cell_id, t_index (frame index within the embryo's
+        subsampled sequence), time_h (NaN without acquisition times), l1,
+        ms_ssim and error
+    """
+    if store.recon_l1 is None:
+        raise ValueError("The feature store has no reconstruction errors (build it with reconstruction=True)")
+    l1 = np.asarray(store.recon_l1)
+    ms = np.asarray(store.recon_ms_ssim)
+    valid = np.isfinite(l1)
+    w, t = np.nonzero(valid)
+    df = store.df
+    start = df["start_idx"].to_numpy()
+    time_h = np.full(len(w), np.nan)
+    if "times" in df.columns:
+        times = [parse_times(v) for v in df["times"]]
+        known = np.array([times[i] is not None for i in w], dtype=bool)
+        time_h[known] = [times[i][j] for i, j in zip(w[known], t[known])]
+    return pd.DataFrame({
+        "cell_id": df["cell_id"].to_numpy()[w],
+        "t_index": start[w] + t,
+        "time_h": time_h,
+        "l1": l1[valid],
+        "ms_ssim": ms[valid],
+        "error": l1_weight * l1[valid] + ms_ssim_weight * (1 - ms[valid]),
+    })
+
+
+def per_timepoint(frames):
+    """Average the scores of frames that several overlapping windows share"""
+    out = frames.groupby(["cell_id", "t_index"], sort=True).agg(
+        time_h=("time_h", "first"), l1=("l1", "mean"), ms_ssim=("ms_ssim", "mean"),
+        error=("error", "mean"), n_windows=("error", "size"))
+    return out.reset_index()
+
+
+def per_embryo(timepoints):
+    """
+    Per-embryo summary ranked by anomaly score
+
+    The score is the robust z-score of the embryo's mean error over all
+    embryos: (mean_error - median) / (1.4826 * MAD).
+
+    Returns:
+        DataFrame sorted by anomaly_z (descending) with a rank column
+    """
+    g = timepoints.groupby("cell_id")
+    worst = timepoints.loc[g["error"].idxmax(), ["cell_id", "t_index", "time_h"]]
+    out = pd.DataFrame({
+        "n_timepoints": g.size(),
+        "mean_error": g["error"].mean(),
+        "max_error": g["error"].max(),
+        "p95_error": g["error"].quantile(0.95),
+        "mean_l1": g["l1"].mean(),
+        "mean_ms_ssim": g["ms_ssim"].mean(),
+        "min_ms_ssim": g["ms_ssim"].min(),
+    })
+    out = out.join(worst.set_index("cell_id").rename(columns={"t_index": "worst_t_index",
+                                                              "time_h": "worst_time_h"}))
+    median = out["mean_error"].median()
+    mad = 1.4826 * (out["mean_error"] - median).abs().median()
+    out["anomaly_z"] = (out["mean_error"] - median) / mad if mad > 0 else 0.0
+    out = out.sort_values("anomaly_z", ascending=False).reset_index()
+    out.insert(0, "rank", np.arange(1, len(out) + 1))
+    return out
+
+
+def main(checkpoint, index_csv="index.csv", feature_store="feature_store", image_size=128, batch_size=32,
+         num_workers=0, amp=True, out_timepoints="recon_per_timepoint.csv",
+         out_ranking="recon_anomaly_ranking.csv", top=20):
+    store = build_feature_store(checkpoint, index_csv, feature_store, image_size, batch_size, DEVICE,
+                                reconstruction=True, num_workers=num_workers, amp=amp)
+    timepoints = per_timepoint(frame_scores(store))
+    ranking = per_embryo(timepoints)
+    timepoints.to_csv(out_timepoints, index=False)
+    ranking.to_csv(out_ranking, index=False)
+
+    print(f"\nScored {len(timepoints)} timepoints of {len(ranking)} embryos "
+          f"(mean error {timepoints['error'].mean():.4f}, mean MS-SSIM {timepoints['ms_ssim'].mean():.4f})")
+    print(f"\nMost anomalous embryos (robust z of the mean reconstruction error):")
+    for _, row in ranking.head(top).iterrows():
+        print(f"  {int(row['rank']):3d}. {row['cell_id']}: z {row['anomaly_z']:6.2f}, "
+              f"mean {row['mean_error']:.4f}, max {row['max_error']:.4f} at t={int(row['worst_t_index'])}")
+    print(f"\nSaved: {out_timepoints}, {out_ranking}")
+    return ranking
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Rank embryos by autoencoder reconstruction error")
+    parser.add_argument("--checkpoint", type=str, required=True,
+                        help="Trained autoencoder (training checkpoint or inference artifact)")
+    parser.add_argument("--index_csv", type=str, default="index.csv")
+    parser.add_argument("--feature_store", type=str, default="feature_store",
+                        help="Feature store directory (the errors are stored next to the features)")
+    parser.add_argument("--image_size", type=int, default=128)
+    parser.add_argument("--batch_size", type=int, default=32, help="Windows per batch")
+    parser.add_argument("--num_workers", type=int, default=0, help="DataLoader processes decoding frames")
+    parser.add_argument("--no_amp", action="store_true", help="Disable bf16 autocast on GPU")
+    parser.add_argument("--top", type=int, default=20, help="Embryos listed in the printout")
+    args = parser.parse_args()
+
+    main(
+        checkpoint=args.checkpoint,
+        index_csv=args.index_csv,
+        feature_store=args.feature_store,
+        image_size=args.image_size,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        amp=not args.no_amp,
+        top=args.top
+    )
@@ -0,0 +1,369 @@
+"""
+Step-level profiler for the training loops
+
+Times named regions of every training step (data wait, host-to-device copy,
+forward per submodule, loss, backward, optimizer) and keeps rolling
+percentiles over the last ``window`` steps. Every ``memory_every`` steps it
+also samples the memory of the training process and of each DataLoader
+worker (Linux /proc): RSS, PSS (shared pages split between the processes
+sharing them, so PSS adds up to what the job really uses) and USS (pages
+only this process holds, i.e. copy-on-write copies). Optionally captures a
+torch.profiler trace for a few steps.
+
+Disabled by default. When disabled, region() returns a shared no-op context,
+wrap() returns the loader unchanged and step() returns immediately, so the
+instrumentation can stay in the training loop permanently.
+
+Usage:
+    profiler = StepProfiler(enabled=True, device=DEVICE)
+    profiler.watch(model, ["encoder.spatial_cnn", "encoder.convlstm"])
+    for vol, _ in profiler.wrap(loader):
+        with profiler.region("h2d"):
+            vol = vol.to(DEVICE)
+        with profiler.region("forward"):
+            out = model(vol)
+        ...
+        profiler.step()
+    log_entry["profile"] = profiler.summary()
+    log_entry["memory"] = profiler.memory_summary()
+"""
+import contextlib
+import os
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+import torch
+
+_NULL_CONTEXT = contextlib.nullcontext()
+_MEMORY_FIELDS = {"Rss": "rss", "Pss": "pss", "Private_Clean": "uss", "Private_Dirty": "uss"}
+
+
+def process_memory(pid="self"):
+    """
+    RSS, PSS and USS of a process in bytes (/proc/<pid>/smaps_rollup)
+
+    Returns:
+        {"rss", "pss", "uss"}, or None if the process is gone or this is not Linux
+    """
+    out = {"rss": 0, "pss": 0, "uss": 0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in _MEMORY_FIELDS:
+                    out[_MEMORY_FIELDS[key]] += int(value.split()[0]) * 1024
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return None
+    return out
+
+
+def worker_pids(pid=None):
+    """
+    Child processes running the same program as ``pid`` (default: this process)
+
+    DataLoader workers are forked, so they share the parent's command line;
+    subprocesses started with exec (e.g. compiler workers) do not.
+    """
+    pid = pid or os.getpid()
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            cmdline = f.read()
+        entries = os.listdir("/proc")
+    except FileNotFoundError:
+        return []
+    pids = []
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            if ppid != pid:
+                continue
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                if f.read() == cmdline:
+                    pids.append(int(entry))
+        except (FileNotFoundError, ProcessLookupError, IndexError, ValueError):
+            continue
+    return sorted(pids)
+
+
+class StepProfiler:
+    """
+    Rolling per-region step timings, with an optional torch.profiler trace
+
+    On CUDA, regions are timed with CUDA events. The events are resolved once
+    per step, after the last one has completed, so they measure GPU time
+    without synchronizing inside the step. On CPU, and for host-side regions
+    such as waiting for the DataLoader, perf_counter is used.
+
+    Args:
+        enabled: turn timing on
+        device: "cuda" or "cpu"
+        window: number of recent steps the percentiles are computed over
+        trace_dir: if set, write a torch.profiler trace (TensorBoard / Chrome
+            format) here
+        trace_start: step at which the trace starts (skip compilation and
+            cudnn autotuning in the first steps)
+        trace_steps: number of steps to trace
+        memory_every: sample process / worker memory every this many steps
+            (0 = never)
+    """
+
+    def __init__(self, enabled=False, device="cpu", window=200,
+                 trace_dir=None, trace_start=10, trace_steps=5, memory_every=50):
+        self.enabled = enabled or trace_dir is not None
+        self.cuda = str(device).startswith("cuda") and torch.cuda.is_available()
+        self.window = window
+        self.history = defaultdict(lambda: deque(maxlen=window))
+        self.steps = 0
+        self._pending = []
+        self._open = defaultdict(list)
+        self._hooks = []
+        self._last_step_end = None
+        self.memory_every = memory_every
+        self.memory = {}       # latest sample: {"main": {...}, "workers": [{...}, ...]}
+        self.memory_peak = {}  # peak over the run: {"main_pss", "worker_uss", "total_pss", ...}
+
+        self._trace = None
+        self._trace_end = None
+        if trace_dir is not None:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.cuda:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            # warmup=1 so the first recorded step is not distorted by profiler startup
+            warmup = 1 if trace_start > 0 else 0
+            self._trace = torch.profiler.profile(
+                activities=activities,
+                schedule=torch.profiler.schedule(
+                    wait=max(trace_start - warmup, 0), warmup=warmup, active=trace_steps, repeat=1),
+                on_trace_ready=torch.profiler.tensorboard_trace_handler(str(trace_dir)),
+                record_shapes=True,
+            )
+            self._trace_end = trace_start + trace_steps
+            self._trace.start()
+
+    # ------------------------------------------------------------------
+    # Timing primitives
+    # ------------------------------------------------------------------
+    def _mark(self, host=False):
+        if self.cuda and not host:
+            event = torch.cuda.Event(enable_timing=True)
+            event.record()
+            return event
+        return time.perf_counter()
+
+    @staticmethod
+    def _elapsed_ms(start, end):
+        if isinstance(start, float):
+            return (end - start) * 1000.0
+        return start.elapsed_time(end)
+
+    @contextlib.contextmanager
+    def _region(self, name, host):
+        label = torch.profiler.record_function(name) if self._trace is not None else _NULL_CONTEXT
+        with label:
+            start = self._mark(host)
+            try:
+                yield
+            finally:
+                self._pending.append((name, start, self._mark(host)))
+
+    def region(self, name, host=False):
+        """
+        Context manager timing one named region of the current step
+
+        Args:
+            name: region name, e.g. "forward", "loss", "backward"
+            host: time on the host with perf_counter even on CUDA (for regions
+                where the host waits, such as I/O)
+        """
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return self._region(name, host)
+
+    def wrap(self, loader):
+        """Iterate over ``loader``, timing each fetch as the "data_wait" region"""
+        if not self.enabled:
+            return loader
+        return self._timed_iter(loader)
+
+    def _timed_iter(self, loader):
+        # Step time is measured between consecutive steps of one pass, so the
+        # time spent between epochs (checkpointing, logging) is not counted
+        self._last_step_end = None
+        it = iter(loader)
+        while True:
+            start = self._mark(host=True)
+            try:
+                batch = next(it)
+            except StopIteration:
+                return
+            self._pending.append(("data_wait", start, self._mark(host=True)))
+            yield batch
+
+    # ------------------------------------------------------------------
+    # Submodule forward timing
+    # ------------------------------------------------------------------
+    def watch(self, model, names):
+        """
+        Time the forward pass of the named submodules as "forward/<name>"
+
+        Hooks are only registered when the profiler is enabled.
+
+        Args:
+            model: nn.Module
+            names: dotted submodule names, e.g. ["encoder.convlstm", "decoder"]
+        """
+        if not self.enabled:
+            return self
+        modules = dict(model.named_modules())
+        for name in names:
+            if name not in modules:
+                raise ValueError(f"Unknown submodule '{name}'")
+            label = f"forward/{name}"
+            self._hooks.append(modules[name].register_forward_pre_hook(
+                lambda _m, _inp, label=label: self._open[label].append(self._mark())))
+            self._hooks.append(modules[name].register_forward_hook(
+                lambda _m, _inp, _out, label=label: self._pending.append(
+                    (label, self._open[label].pop(), self._mark()))))
+        return self
+
+    # ------------------------------------------------------------------
+    # Step bookkeeping
+    # ------------------------------------------------------------------
+    def step(self):
+        """Close the current step: resolve its timings and advance the trace"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if self._pending:
+            if self.cuda:
+                # Wait for the last recorded event so that every event of the step is complete
+                for _, _, end in reversed(self._pending):
+                    if not isinstance(end, float):
+                        end.synchronize()
+                        break
+            per_step = defaultdict(float)
+            for name, start, end in self._pending:
+                per_step[name] += self._elapsed_ms(start, end)
+            for name, ms in per_step.items():
+                self.history[name].append(ms)
+            self._pending = []
+        if self._last_step_end is not None:
+            self.history["step"].append((now - self._last_step_end) * 1000.0)
+        self._last_step_end = time.perf_counter()
+        self.steps += 1
+
+        if self.memory_every and self.steps % self.memory_every == 0:
+            self.sample_memory()
+
+        if self._trace is not None:
+            self._trace.step()
+            if self.steps >= self._trace_end:
+                self._stop_trace()
+
+    def sample_memory(self):
+        """Record the memory of this process and its DataLoader workers now"""
+        main = process_memory()
+        if main is None:
+            return
+        workers = [m for m in map(process_memory, worker_pids()) if m is not None]
+        self.memory = {"main": main, "workers": workers}
+        current = {
+            "main_rss": main["rss"],
+            "main_pss": main["pss"],
+            "worker_rss": max((w["rss"] for w in workers), default=0),
+            "worker_pss": max((w["pss"] for w in workers), default=0),
+            "worker_uss": max((w["uss"] for w in workers), default=0),
+            "total_pss": main["pss"] + sum(w["pss"] for w in workers),
+        }
+        for key, value in current.items():
+            self.memory_peak[key] = max(self.memory_peak.get(key, 0), value)
+
+    def _stop_trace(self):
+        if self._trace is not None:
+            self._trace.stop()
+            self._trace = None
+
+    def summary(self):
+        """
+        Rolling percentiles of every region over the last ``window`` steps
+
+        Returns:
+            dict mapping region name to {"mean_ms", "p50_ms", "p90_ms", "p99_ms", "n"}
+        """
+        out = {}
+        for name, values in self.history.items():
+            if not values:
+                continue
+            v = np.fromiter(values, dtype=np.float64)
+            p50, p90, p99 = np.percentile(v, [50, 90, 99])
+            out[name] = {
+                "mean_ms": round(float(v.mean()), 3),
+                "p50_ms": round(float(p50), 3),
+                "p90_ms": round(float(p90), 3),
+                "p99_ms": round(float(p99), 3),
+                "n": len(v),
+            }
+        return out
+
+    def memory_summary(self):
+        """
+        Latest memory sample and run peaks in MB
+
+        Returns:
+            dict with num_workers, main / per-worker {"rss_mb", "pss_mb",
+            "uss_mb"}, total_pss_mb and peak_* entries ({} before the first sample)
+        """
+        if not self.memory:
+            return {}
+        def mb(n):
+            return round(n / 2 ** 20, 1)
+
+        workers = self.memory["workers"]
+        return {
+            "num_workers": len(workers),
+            "main": {f"{k}_mb": mb(v) for k, v in self.memory["main"].items()},
+            "workers": [{f"{k}_mb": mb(v) for k, v in w.items()} for w in workers],
+            "total_pss_mb": mb(self.memory["main"]["pss"] + sum(w["pss"] for w in workers)),
+            **{f"peak_{k}_mb": mb(v) for k, v in self.memory_peak.items()},
+        }
+
+    def format_memory(self):
+        """One-paragraph summary of memory_summary()"""
+        m = self.memory_summary()
+        if not m:
+            return "  (no memory sample)"
+        lines = [f"  main: RSS {m['main']['rss_mb']:.0f} MB, PSS {m['main']['pss_mb']:.0f} MB"]
+        if m["workers"]:
+            lines.append(f"  {m['num_workers']} workers: RSS {m['peak_worker_rss_mb']:.0f} MB, "
+                         f"PSS {m['peak_worker_pss_mb']:.0f} MB, private {m['peak_worker_uss_mb']:.0f} MB "
+                         f"(peak per worker)")
+        lines.append(f"  total PSS {m['total_pss_mb'] / 1024:.2f} GB (peak {m['peak_total_pss_mb'] / 1024:.2f} GB)")
+        return "\n".join(lines)
+
+    def format_summary(self):
+        """Human-readable table of summary(), slowest regions first"""
+        summary = self.summary()
+        step_ms = summary.get("step", {}).get("p50_ms")
+        lines = [f"  {'region':<32} {'p50':>9} {'p90':>9} {'p99':>9}  share"]
+        for name, s in sorted(summary.items(), key=lambda kv: -kv[1]["p50_ms"]):
+            share = f"{100 * s['p50_ms'] / step_ms:5.1f}%" if step_ms and name != "step" else ""
+            lines.append(f"  {name:<32} {s['p50_ms']:8.2f}ms {s['p90_ms']:8.2f}ms "
+                         f"{s['p99_ms']:8.2f}ms  {share}")
+        return "\n".join(lines)
+
+    def reset(self):
+        """Forget the timings collected so far (e.g. at the start of an epoch)"""
+        self.history.clear()
+        self._pending = []
+        self._last_step_end = None
+
+    def close(self):
+        """Remove hooks and flush an unfinished trace"""
+        for handle in self._hooks:
+            handle.remove()
+        self._hooks = []
+        self._stop_trace()
@@ -10,7 +10,12 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
 
 from model import ConvLSTMAutoencoder
-from losses import reconstruction_loss, temporal_smoothness_loss
+from losses import reconstruction_loss, temporal_smoothness_loss, lengths_to_mask, frame_errors, ms_ssim
+from inference_engine import InferenceEngine
+from cpu_inference import cpu_engine
+from length_bucketing import pad_collate
+from latent_codec import LatentArrayWriter, pool_maps
+from checkpointing import capture_rng_state, restore_rng_state
 
 
 def test_model():
@@ -110,8 +115,42 @@ def test_model():
     assert x_rec.shape == x.shape, "Decode shape mismatch"
     print("   ✓ Encode/decode test passed\n")
     
+    # Test stateful chunked encoding
+    print("7. Testing stateful chunked encoding...")
+    model.eval()
+    with torch.no_grad():
+        z_full, _ = model.encode(x)
+        state, chunks = None, []
+        for s in range(0, seq_len, 8):
+            z_chunk, _, state = model.encode(x[:, s:s+8], state, return_state=True)
+            chunks.append(z_chunk)
+    assert len(state) == 2, "State should hold (h, c) for every encoder layer"
+    assert torch.allclose(torch.cat(chunks, dim=1), z_full, atol=1e-5), \
+        "Chunked encoding with carried state differs from full encoding"
+    print("   ✓ Chunked encoding matches full-sequence encoding\n")
+    
+    # Test optimized inference engine
+    print("8. Testing inference engine (folded BatchNorm, traced, bucketed)...")
+    engine = InferenceEngine(model, device=device, backend="trace", fold_bn=True, buckets=(1, 2))
+    with torch.no_grad():
+        z_ref, z_last_ref = model.encode(x[:3])
+    z_eng, z_last_eng = engine.encode(x[:3])  # 3 windows -> buckets of 2 + 1
+    assert torch.allclose(z_eng, z_ref.cpu(), atol=1e-4), "Engine z_seq differs from eager encode"
+    assert torch.allclose(z_last_eng, z_last_ref.cpu(), atol=1e-4), "Engine z_last differs from eager encode"
+    print("   ✓ Engine output matches eager encoding\n")
+    
+    # Test CPU int8 profile
+    print("9. Testing CPU inference profile (int8 spatial CNN, channels_last)...")
+    calibration = [x[2:].cpu()]  # same distribution as the encoded windows
+    engine = cpu_engine(model, calibration, buckets=(1, 2))
+    z_int8, _ = engine.encode(x[:2])
+    rel_err = ((z_int8 - z_ref[:2].cpu()).norm() / z_ref[:2].cpu().norm()).item()
+    print(f"   Relative error vs fp32: {rel_err:.4f}")
+    assert rel_err < 0.05, f"int8 latents deviate too much from fp32 ({rel_err:.4f})"
+    print("   ✓ CPU int8 encoding matches fp32 within tolerance\n")
+    
     # Test different batch sizes
-    print("7. Testing different batch sizes...")
+    print("10. Testing different batch sizes...")
     model.eval()  # Use eval mode to avoid BatchNorm issues with batch_size=1
     for bs in [1, 2, 8]:
         x_test = torch.randn(bs, seq_len, 1, H, W).to(device)
@@ -121,6 +160,84 @@ def test_model():
             f"Batch size {bs} failed"
     print("   ✓ Different batch sizes work\n")
     
+    # Test other resolutions (progressive resizing trains one model at several sizes)
+    print("11. Testing different resolutions...")
+    for size in [64, 96]:
+        x_test = torch.rand(1, 4, 1, size, size).to(device)
+        with torch.no_grad():
+            output_test = model(x_test)
+        assert output_test['reconstruction'].shape == x_test.shape, \
+            f"Resolution {size} failed: {output_test['reconstruction'].shape}"
+        assert output_test['z_last'].shape[-1] == size // 8, "Latent grid should be 1/8 of the frame"
+    print("   ✓ Different resolutions work\n")
+    
+    # Test variable-length windows (end-padded batch with lengths)
+    print("12. Testing variable-length windows...")
+    long_seq, short_seq = torch.rand(6, 1, 64, 64), torch.rand(3, 1, 64, 64)
+    vol, _, lengths = pad_collate([(long_seq, "a"), (short_seq, "b")])
+    with torch.no_grad():
+        output_pad = model(vol.to(device), lengths=lengths)
+        output_short = model(short_seq[None].to(device))
+    assert torch.allclose(output_pad['z_last'][1], output_short['z_last'][0], atol=1e-5), \
+        "z_last of a padded window should match the unpadded window"
+    assert output_pad['reconstruction'][1, 3:].abs().max() == 0, "Padding frames should not be decoded"
+    mask = lengths_to_mask(lengths).to(device)
+    rec_masked, _ = reconstruction_loss(output_pad['reconstruction'], vol.to(device), mask=mask)
+    assert torch.isfinite(rec_masked), "Masked reconstruction loss is not finite"
+    print("   ✓ Padded windows match unpadded encoding\n")
+    
+    # Test per-frame reconstruction errors (anomaly scoring)
+    print("13. Testing per-frame reconstruction errors...")
+    l1_frames, ms_frames = frame_errors(output_pad['reconstruction'], vol.to(device), mask=mask)
+    assert l1_frames.shape == (2, 6) and torch.isnan(ms_frames[1, 3:]).all(), \
+        "Padding frames should have no score"
+    frame = (output_pad['reconstruction'][0, :1], vol[:1, 0].to(device))
+    assert torch.allclose(ms_frames[0, 0], ms_ssim(*frame), atol=1e-5), \
+        "Per-image MS-SSIM should match MS-SSIM of the single frame"
+    print("   ✓ Per-frame L1 / MS-SSIM computed in one pass\n")
+    
+    # Test compressed latent storage (int8 + pooling + zlib, rows written out of order)
+    print("14. Testing compressed latent maps...")
+    import tempfile
+    z_maps = output_pad['z_seq'].float().cpu().numpy()
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = LatentArrayWriter(tmp, len(z_maps), z_maps.shape[1:], dtype="int8", grid=2,
+                                   compression="zlib", chunk_rows=1)
+        writer.put([1], z_maps[1:])
+        writer.put([0], z_maps[:1])
+        decoded = writer.close()[[1, 0]]
+    expected = pool_maps(z_maps, 2)[[1, 0]]
+    assert decoded.shape == expected.shape, "Pooled maps have the wrong shape"
+    assert abs(decoded - expected).max() <= abs(expected).max() / 127, "int8 error above one quantization step"
+    print("   ✓ Latent maps round-trip within int8 precision\n")
+    
+    # Test RNG state round trip through a checkpoint loaded onto the training device
+    print("15. Testing RNG state restore after map_location...")
+    import io
+    import random
+    import numpy as np
+    buffer = io.BytesIO()
+    torch.save({"rng_state": capture_rng_state()}, buffer)
+    expected = (random.random(), np.random.rand(), torch.rand(1))
+    buffer.seek(0)
+    restore_rng_state(torch.load(buffer, map_location=device)["rng_state"])
+    assert expected == (random.random(), np.random.rand(), torch.rand(1)), \
+        "Restored generators should repeat the same draws"
+    print("   ✓ RNG state restores from device tensors\n")
+
+    # Test the per-hour speed plot of export_latents_unique.py
+    print("16. Testing speed plot with and without acquisition times...")
+    import tempfile
+    import matplotlib
+    matplotlib.use("Agg")
+    from export_latents_unique import plot_speed
+    z_traj = np.random.rand(6, 128).astype(np.float32)
+    with tempfile.TemporaryDirectory() as out_dir:
+        for cell_id, times in (("timed", [0.0, 0.5, 1.0, 1.5, 2.5, 3.0]), ("untimed", None)):
+            plot_speed(z_traj, times, cell_id, out_dir=out_dir)
+            assert (Path(out_dir) / f"{cell_id}_speed.png").exists(), "Speed plot not written"
+    print("   ✓ Speed plots written\n")
+
     print("=" * 60)
     print("All tests passed! ✓")
     print("=" * 60)
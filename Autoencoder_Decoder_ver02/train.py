@@ -2,7 +2,7 @@
 Complete High-Quality Training Script
 - Uses MS-SSIM + L1 Loss
 - Supports classification task (optional)
-- Complete training loop, validation, saving
+- Complete training loop, embryo-level validation, early stopping, saving
 - Maximum quality configuration, no computational savings
 """
 import torch
@@ -13,6 +13,7 @@ import os
 from pathlib import Path
 from tqdm import tqdm
 import json
+import time
 from datetime import datetime
 
 # Add current directory and parent directories to path to find dataset_ivf
@@ -38,8 +39,22 @@ from model import ConvLSTMAutoencoder
 from losses import (
     reconstruction_loss,
     temporal_smoothness_loss,
-    classification_loss
+    classification_loss,
+    lengths_to_mask
 )
+from step_profiler import StepProfiler
+from autotune import autotune, AUTOTUNE_CACHE
+from checkpointing import (
+    CheckpointManager,
+    ResumableSampler,
+    capture_rng_state,
+    restore_rng_state,
+    inference_state
+)
+from multires import MultiResFrameCache, parse_resize_schedule, resolution_at
+from length_bucketing import LengthBucketBatchSampler, pad_collate, window_lengths
+from validation import ValidationSet, EarlyStopping, evaluate, index_has_split
+from labels import window_labels, class_counts, ClassBalancedSampler, UNLABELED
 
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 print(f"Using device: {DEVICE}")
@@ -59,7 +74,31 @@ def train(
     use_classifier=False,
     save_dir="checkpoints",
     log_dir="logs",
-    resume_from=None
+    resume_from=None,
+    profile=False,
+    profile_trace_dir=None,
+    profile_trace_start=10,
+    profile_trace_steps=5,
+    use_autotune=False,
+    autotune_max_batch=256,
+    lr_scaling="sqrt",
+    autotune_cache=AUTOTUNE_CACHE,
+    retune=False,
+    checkpoint_every_steps=0,
+    keep_last=5,
+    seed=0,
+    image_size=128,
+    resize_schedule=None,
+    frame_cache_dir=None,
+    variable_length=False,
+    max_frames_per_batch=None,
+    val_every=1,
+    val_windows=64,
+    val_batch_size=None,
+    patience=0,
+    min_delta=0.0,
+    labels_csv=None,
+    balance_classes=False
 ):
     """
     Training function
@@ -75,10 +114,51 @@ def train(
         ms_ssim_weight: MS-SSIM loss weight
         smooth_weight: temporal smoothness loss weight
         cls_weight: classification loss weight (if classifier enabled)
-        use_classifier: whether to use classifier
+        use_classifier: train the LatentClassifier head jointly (needs labels
+            and cls_weight > 0; otherwise no head is built)
         save_dir: directory to save models
         log_dir: directory to save logs
-        resume_from: checkpoint to resume training from
+        resume_from: checkpoint to resume training from ("auto" = newest
+            checkpoint in save_dir, if any); mid-epoch checkpoints resume at
+            the next batch
+        profile: time each step's regions (data wait, H2D, forward per
+            submodule, loss, backward, optimizer) and log their percentiles,
+            plus the memory (RSS / PSS / USS) of this process and each DataLoader worker
+        profile_trace_dir: if set, also write a torch.profiler trace here
+        profile_trace_start: first step of the trace
+        profile_trace_steps: number of traced steps
+        use_autotune: probe this node for batch size, activation
+            checkpointing and DataLoader settings (overrides batch_size and
+            num_workers, and scales learning_rate to the new batch size)
+        autotune_max_batch: upper bound for the batch-size probe
+        lr_scaling: "sqrt", "linear" or "none" (applied when autotuning)
+        autotune_cache: JSON cache of tuned settings per hardware fingerprint
+        retune: ignore the cached autotune result for this node
+        checkpoint_every_steps: also checkpoint every N steps (0 = only at
+            epoch ends), so a preempted job loses at most N steps
+        keep_last: number of epoch checkpoints to keep (None = all)
+        seed: seed of the data order (per-epoch permutations)
+        image_size: frame size (any multiple of 8) when no schedule is given
+        resize_schedule: progressive resizing, "epoch:size,..." with 0-based
+            epochs, e.g. "0:64,10:128,30:256" (overrides image_size)
+        frame_cache_dir: cache the resized frames of every scheduled size
+            here, so each image is decoded only once
+        variable_length: the index has windows of different lengths
+            (build_index.py VARIABLE_LENGTH); batches are bucketed by length,
+            padded at the end and the losses ignore the padding
+        max_frames_per_batch: with variable_length, cap batch_size x longest
+            window instead of using a fixed batch size (batch_size is then
+            the upper bound)
+        val_every: validate every N epochs (0 = never) when the index has a
+            split column; trains on the "train" split only
+        val_windows: size of the fixed, pre-loaded validation subset
+        val_batch_size: validation batch size (default 4 x batch_size)
+        patience: stop after this many validation passes without
+            improvement (0 = no early stopping)
+        min_delta: smallest validation-loss decrease counted as improvement
+        labels_csv: CSV of cell_id,label (default: the index's label column)
+        balance_classes: draw labeled windows class-balanced
+            (labels.ClassBalancedSampler) instead of plain shuffling
     """
     # Create directories
     os.makedirs(save_dir, exist_ok=True)
@@ -86,29 +166,127 @@ def train(
     
     # Dataset
     print("Loading dataset...")
-    train_dataset = IVFSequenceDataset(index_csv, resize=128, norm="minmax01")
-    train_loader = DataLoader(
-        train_dataset,
-        batch_size=batch_size,
-        shuffle=True,
-        num_workers=4,
-        pin_memory=True if DEVICE == "cuda" else False,
-        persistent_workers=True
-    )
+    schedule = parse_resize_schedule(resize_schedule) if resize_schedule else [(0, image_size)]
+    sizes = sorted({size for _, size in schedule})
+    frame_cache = MultiResFrameCache(frame_cache_dir, sizes) if frame_cache_dir else None
+    # Start at the largest size, so autotune probes the worst-case memory use
+    has_split = index_has_split(index_csv)
+    train_dataset = IVFSequenceDataset(index_csv, resize=sizes[-1], norm="minmax01",
+                                       frame_cache=frame_cache,
+                                       split="train" if has_split else None)
     print(f"Dataset size: {len(train_dataset)}")
     
+    # Embryo-level validation subset (decoded once, always at the largest size,
+    # so losses stay comparable across a resize schedule)
+    val_set = None
+    if has_split and val_every > 0:
+        val_dataset = IVFSequenceDataset(index_csv, resize=sizes[-1], norm="minmax01",
+                                         frame_cache=frame_cache, split="val")
+        if len(val_dataset):
+            val_set = ValidationSet(val_dataset, max_windows=val_windows)
+            print(f"Validation: {len(val_set)} of {len(val_dataset)} windows "
+                  f"from {val_set.n_embryos} held-out embryos, every {val_every} epoch(s)")
+    elif not has_split:
+        print("Index has no split column: training on all windows without validation "
+              "(rebuild it with build_index.py to hold out embryos)")
+    if patience and val_set is None:
+        raise ValueError("Early stopping (--patience) needs validation windows: "
+                         "build the index with a split and use --val_every > 0")
+    stopper = EarlyStopping(patience=patience, min_delta=min_delta)
+    
+    # Labels for the classifier head (per window, UNLABELED for unlabeled embryos)
+    window_y, classes = window_labels(train_dataset.df, labels_csv)
+    train_classifier = use_classifier and bool(classes) and cls_weight > 0
+    if use_classifier and not train_classifier:
+        print("Note: the classifier head is not trained (needs labels and --cls_weight > 0) "
+              "and is not built; train it later with train_head.py")
+    if train_classifier:
+        print(f"Classes: {classes}, labeled windows per class: "
+              f"{class_counts(window_y, len(classes)).tolist()}")
+        cell_class = dict(zip(train_dataset.df["cell_id"], window_y.tolist()))
+        cls_criterion = nn.CrossEntropyLoss(ignore_index=UNLABELED)
+    if balance_classes and (not train_classifier or variable_length):
+        raise ValueError("--balance_classes needs labels, --use_classifier, --cls_weight > 0 "
+                         "and fixed-length windows")
+    lengths = window_lengths(train_dataset)
+    if variable_length:
+        print(f"Window lengths: {min(lengths)}-{max(lengths)} frames, {sum(lengths)} frames in total")
+    elif len(set(lengths)) > 1:
+        raise ValueError("The index has windows of different lengths, use --variable_length")
+    elif lengths and lengths[0] != seq_len:
+        print(f"Note: windows have {lengths[0]} frames (set by build_index.py); "
+              f"seq_len={seq_len} is only stored in the model config")
+    
     # Model
     print("Initializing model...")
-    model = ConvLSTMAutoencoder(
+    model_config = dict(
         seq_len=seq_len,
         input_channels=1,
         encoder_hidden_dim=256,  # High-quality configuration
         encoder_layers=2,
         decoder_hidden_dim=128,
         decoder_layers=2,
-        use_classifier=use_classifier,
-        num_classes=2
-    ).to(DEVICE)
+        use_classifier=train_classifier,  # an untrained head would only cost compute
+        num_classes=len(classes) if train_classifier else 2
+    )
+    model = ConvLSTMAutoencoder(**model_config).to(DEVICE)
+    
+    # DataLoader settings (fixed defaults, or tuned for this node)
+    loader_config = {
+        "num_workers": 4,
+        "prefetch_factor": 2,
+        "pin_memory": DEVICE == "cuda",
+    }
+    tuned = None
+    if use_autotune:
+        def autotune_step(model, vol):
+            output = model(vol)
+            rec_loss, _ = reconstruction_loss(
+                output["reconstruction"], vol,
+                l1_weight=l1_weight,
+                ms_ssim_weight=ms_ssim_weight
+            )
+            loss = rec_loss + temporal_smoothness_loss(output["z_seq"], weight=smooth_weight)
+            loss.backward()
+        
+        tuned = autotune(
+            model, train_dataset, autotune_step, DEVICE,
+            base_batch_size=batch_size,
+            base_lr=learning_rate,
+            lr_rule=lr_scaling,
+            max_batch_size=autotune_max_batch,
+            workload={"encoder_hidden_dim": 256, "decoder_hidden_dim": 128, "layers": 2},
+            cache_path=autotune_cache,
+            retune=retune,
+            sample_shape=(max(lengths),) + tuple(train_dataset[0][0].shape[1:]),
+            collate_fn=pad_collate if variable_length else None
+        )
+        batch_size = tuned["batch_size"]
+        learning_rate = tuned["learning_rate"]
+        loader_config = {k: tuned[k] for k in loader_config}
+    
+    # Seeded per-epoch shuffling that can resume mid-epoch
+    if variable_length:
+        sampler = LengthBucketBatchSampler(lengths, batch_size, shuffle=True, seed=seed,
+                                           max_frames=max_frames_per_batch)
+        batching = {"batch_sampler": sampler, "collate_fn": pad_collate}
+    else:
+        if balance_classes:
+            sampler = ClassBalancedSampler(window_y, seed=seed)
+        else:
+            sampler = ResumableSampler(train_dataset, shuffle=True, seed=seed)
+        # The head's BatchNorm1d cannot train on a last batch of one window
+        batching = {"batch_size": batch_size, "sampler": sampler, "drop_last": train_classifier}
+    def make_loader():
+        return DataLoader(
+            train_dataset,
+            **batching,
+            num_workers=loader_config["num_workers"],
+            pin_memory=loader_config["pin_memory"],
+            persistent_workers=loader_config["num_workers"] > 0,
+            prefetch_factor=loader_config["prefetch_factor"] if loader_config["num_workers"] > 0 else None
+        )
+    train_loader = None  # created per resolution in the epoch loop
     
     # Count parameters
     total_params = sum(p.numel() for p in model.parameters())
@@ -131,21 +309,102 @@ def train(
         eta_min=1e-6
     )
     
+    # Checkpoints are written from a background thread
+    manager = CheckpointManager(save_dir)
+    training_log = []
+    
     # Resume training
     start_epoch = 0
+    global_step = 0
+    resume_batches = 0
+    resume_losses = None
+    if resume_from == "auto":
+        resume_from = manager.latest("checkpoint_*.pt")
+        if resume_from is None:
+            print("No checkpoint to resume from, starting fresh")
     if resume_from:
         print(f"Resuming from {resume_from}...")
-        checkpoint = torch.load(resume_from, map_location=DEVICE)
+        checkpoint = torch.load(resume_from, map_location="cpu")  # load_state_dict moves the tensors
         model.load_state_dict(checkpoint['model_state_dict'])
         optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
         scheduler.load_state_dict(checkpoint['scheduler_state_dict'])
-        start_epoch = checkpoint['epoch'] + 1
+        global_step = checkpoint.get('global_step', 0)
+        training_log = checkpoint.get('training_log', [])
+        sampler.seed = checkpoint.get('seed', seed)
+        if 'early_stopping' in checkpoint:
+            stopper.load_state_dict(checkpoint['early_stopping'])
+        if 'rng_state' in checkpoint:
+            restore_rng_state(checkpoint['rng_state'])
+        if checkpoint.get('samples_seen'):
+            # Mid-epoch checkpoint: continue the same epoch after the last finished batch
+            start_epoch = checkpoint['epoch']
+            resume_batches = checkpoint['batches_done']
+            resume_losses = checkpoint['losses']
+            sampler.set_epoch(start_epoch)
+            sampler.set_start(checkpoint['samples_seen'])
+            print(f"  Continuing epoch {start_epoch+1} after {resume_batches} batches")
+        else:
+            start_epoch = checkpoint['epoch'] + 1
+    
+    def training_state(epoch, epoch_losses, batches_done=0, samples_seen=0):
+        return {
+            'epoch': epoch,
+            'global_step': global_step,
+            'batches_done': batches_done,
+            'samples_seen': samples_seen,
+            'model_state_dict': model.state_dict(),
+            'optimizer_state_dict': optimizer.state_dict(),
+            'scheduler_state_dict': scheduler.state_dict(),
+            'rng_state': capture_rng_state(),
+            'seed': sampler.seed,
+            'losses': epoch_losses,
+            'early_stopping': stopper.state_dict(),
+            'training_log': training_log,
+            'config': {
+                'batch_size': batch_size,
+                'seq_len': seq_len,
+                'learning_rate': learning_rate,
+                'weight_decay': weight_decay,
+                'image_size': train_dataset.resize,
+                'variable_length': variable_length,
+                'max_frames_per_batch': max_frames_per_batch,
+                'val_every': val_every,
+                'val_windows': val_windows,
+                'patience': patience,
+                'classes': classes if train_classifier else None,
+                'balance_classes': balance_classes,
+                'resize_schedule': schedule,
+                'autotune': tuned,
+                'model': model_config,
+            }
+        }
+    
+    # Step profiler (no-op unless enabled)
+    profiler = StepProfiler(
+        enabled=profile,
+        device=DEVICE,
+        trace_dir=profile_trace_dir,
+        trace_start=profile_trace_start,
+        trace_steps=profile_trace_steps
+    )
+    profiler.watch(model, [
+        "encoder.spatial_cnn",
+        "encoder.convlstm",
+        "decoder.convlstm",
+        "decoder.spatial_decoder"
+    ])
     
     # Training loop
     print("\nStarting training...")
-    training_log = []
     
     for epoch in range(start_epoch, num_epochs):
+        resolution = resolution_at(schedule, epoch)
+        if train_loader is None or resolution != train_dataset.resize:
+            # Persistent workers keep their own copy of the dataset: restart them at the new size
+            train_dataset.set_resolution(resolution)
+            train_loader = make_loader()
+            print(f"Image size: {resolution}x{resolution}")
+        
         model.train()
         epoch_losses = {
             "total": 0.0,
@@ -155,47 +414,70 @@ def train(
             "smooth": 0.0,
             "classification": 0.0
         }
+        batches_done = 0
+        if epoch == start_epoch and resume_losses is not None:
+            # Loss sums of the part of this epoch trained before preemption
+            epoch_losses = dict(resume_losses)
+            batches_done = resume_batches
+        else:
+            sampler.set_epoch(epoch)
+        samples_seen = sampler.start
+        frame_counts = {"frames": 0, "padding_frames": 0}
         
         pbar = tqdm(train_loader, desc=f"Epoch {epoch+1}/{num_epochs}")
         
-        for batch_idx, (vol, cell_id) in enumerate(pbar):
-            vol = vol.to(DEVICE)  # (B, T, 1, 128, 128)
+        for batch_idx, batch in enumerate(profiler.wrap(pbar), start=batches_done):
+            vol, cell_id = batch[0], batch[1]
+            with profiler.region("h2d"):
+                vol = vol.to(DEVICE)  # (B, T, 1, H, W)
+                if variable_length:
+                    seq_lengths = batch[2].to(DEVICE)
+                    mask = lengths_to_mask(seq_lengths, vol.shape[1])  # (B, T), False = padding
+                else:
+                    seq_lengths = mask = None
+            n_real = int(batch[2].sum()) if variable_length else vol.shape[0] * vol.shape[1]
+            frame_counts["frames"] += n_real
+            frame_counts["padding_frames"] += vol.shape[0] * vol.shape[1] - n_real
             
             # Forward pass
-            output = model(vol)
+            with profiler.region("forward"):
+                output = model(vol, lengths=seq_lengths)
             x_rec = output["reconstruction"]
             z_seq = output["z_seq"]
             
-            # Reconstruction loss
-            rec_loss, rec_details = reconstruction_loss(
-                x_rec, vol,
-                l1_weight=l1_weight,
-                ms_ssim_weight=ms_ssim_weight
-            )
-            
-            # Temporal smoothness loss
-            smooth_loss = temporal_smoothness_loss(z_seq, weight=smooth_weight)
+            with profiler.region("loss"):
+                # Reconstruction loss
+                rec_loss, rec_details = reconstruction_loss(
+                    x_rec, vol,
+                    l1_weight=l1_weight,
+                    ms_ssim_weight=ms_ssim_weight,
+                    mask=mask
+                )
+                
+                # Temporal smoothness loss
+                smooth_loss = temporal_smoothness_loss(z_seq, weight=smooth_weight, mask=mask)
+                
+                # Total loss
+                total_loss = rec_loss + smooth_loss
             
-            # Total loss
-            total_loss = rec_loss + smooth_loss
-            
-            # Classification loss (if enabled)
-            if use_classifier and "logits" in output:
-                # Need real labels here, skip for now
-                # If label data available, do:
-                # labels = ...  # Get from data
-                # cls_loss = classification_loss(output["logits"], labels)
-                # total_loss += cls_weight * cls_loss
-                pass
+                # Classification loss on the labeled windows of the batch
+                cls_loss = None
+                if train_classifier:
+                    labels = torch.tensor([cell_class[c] for c in cell_id], device=DEVICE)
+                    if (labels != UNLABELED).any():
+                        cls_loss = classification_loss(output["logits"], labels, cls_criterion)
+                        total_loss = total_loss + cls_weight * cls_loss
             
             # Backward pass
-            optimizer.zero_grad()
-            total_loss.backward()
-            
-            # Gradient clipping
-            torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=1.0)
+            with profiler.region("backward"):
+                optimizer.zero_grad()
+                total_loss.backward()
             
-            optimizer.step()
+            with profiler.region("optimizer"):
+                # Gradient clipping
+                torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=1.0)
+                
+                optimizer.step()
             
             # Record losses
             epoch_losses["total"] += total_loss.item()
@@ -203,6 +485,8 @@ def train(
             epoch_losses["l1"] += rec_details["l1_loss"]
             epoch_losses["ms_ssim"] += rec_details["ms_ssim_loss"]
             epoch_losses["smooth"] += smooth_loss.item()
+            if cls_loss is not None:
+                epoch_losses["classification"] += cls_loss.item()
             
             # Update progress bar
             pbar.set_postfix({
@@ -213,9 +497,23 @@ def train(
                 "smooth": f"{smooth_loss.item():.4f}",
                 "ms_ssim_val": f"{rec_details['ms_ssim_value']:.4f}"
             })
+            
+            # Mid-epoch checkpoint (written in the background)
+            global_step += 1
+            batches_done += 1
+            samples_seen += vol.shape[0]
+            if checkpoint_every_steps and global_step % checkpoint_every_steps == 0:
+                with profiler.region("checkpoint", host=True):
+                    manager.save(
+                        training_state(epoch, epoch_losses, batches_done, samples_seen),
+                        f"checkpoint_step_{global_step}.pt",
+                        rotate="checkpoint_step_*.pt",
+                        keep_last=2
+                    )
+            profiler.step()
         
         # Average losses
-        num_batches = len(train_loader)
+        num_batches = max(batches_done, 1)
         for key in epoch_losses:
             epoch_losses[key] /= num_batches
         
@@ -227,8 +525,30 @@ def train(
         log_entry = {
             "epoch": epoch + 1,
             "lr": current_lr,
+            "image_size": resolution,
+            **frame_counts,
             **epoch_losses
         }
+        if profiler.enabled:
+            profiler.sample_memory()
+            log_entry["profile"] = profiler.summary()
+            log_entry["memory"] = profiler.memory_summary()
+        
+        # Validation on held-out embryos
+        improved = stop = False
+        if val_set is not None and ((epoch + 1) % val_every == 0 or epoch == num_epochs - 1):
+            t0 = time.perf_counter()
+            val_losses = evaluate(
+                model, val_set, DEVICE,
+                batch_size=val_batch_size or 4 * batch_size,
+                l1_weight=l1_weight,
+                ms_ssim_weight=ms_ssim_weight,
+                smooth_weight=smooth_weight
+            )
+            log_entry["val"] = val_losses
+            log_entry["val_time"] = time.perf_counter() - t0
+            improved = stopper.step(val_losses["total"], epoch + 1)
+            stop = stopper.should_stop
         training_log.append(log_entry)
         
         # Print epoch summary
@@ -238,34 +558,63 @@ def train(
         print(f"    - L1: {epoch_losses['l1']:.4f}")
         print(f"    - MS-SSIM: {epoch_losses['ms_ssim']:.4f}")
         print(f"  Smooth: {epoch_losses['smooth']:.4f}")
+        if train_classifier:
+            print(f"  Classification: {epoch_losses['classification']:.4f}")
+        if variable_length:
+            print(f"  Frames: {frame_counts['frames']} real, {frame_counts['padding_frames']} padding")
         print(f"  Learning Rate: {current_lr:.6f}")
+        if "val" in log_entry:
+            print(f"  Val Loss: {log_entry['val']['total']:.4f} "
+                  f"(MS-SSIM {log_entry['val']['ms_ssim_value']:.4f}, {log_entry['val_time']:.1f}s)"
+                  f"{' *best*' if improved else f', best {stopper.best:.4f} at epoch {stopper.best_epoch}'}")
+        if profiler.enabled:
+            print(f"  Step profile (last {profiler.window} steps):")
+            print(profiler.format_summary())
+            print("  Memory (main process and DataLoader workers):")
+            print(profiler.format_memory())
         
-        # Save checkpoint
-        if (epoch + 1) % 5 == 0 or epoch == num_epochs - 1:
-            checkpoint_path = os.path.join(save_dir, f"checkpoint_epoch_{epoch+1}.pt")
-            torch.save({
-                'epoch': epoch,
-                'model_state_dict': model.state_dict(),
-                'optimizer_state_dict': optimizer.state_dict(),
-                'scheduler_state_dict': scheduler.state_dict(),
-                'losses': epoch_losses,
-                'config': {
-                    'batch_size': batch_size,
-                    'seq_len': seq_len,
-                    'learning_rate': learning_rate,
-                    'weight_decay': weight_decay,
-                }
-            }, checkpoint_path)
+        # Best model on the validation split
+        if improved:
+            manager.save(training_state(epoch, epoch_losses), "best_model.pt")
+            manager.save(
+                inference_state(model, model_config, epoch=epoch + 1, losses=log_entry["val"],
+                                image_size=sizes[-1]),
+                "best_model_inference_fp16.pt"
+            )
+        
+        # Save checkpoint (plus the slim fp16 artifact used by the export scripts)
+        if (epoch + 1) % 5 == 0 or epoch == num_epochs - 1 or stop:
+            checkpoint_path = manager.save(
+                training_state(epoch, epoch_losses),
+                f"checkpoint_epoch_{epoch+1}.pt",
+                rotate="checkpoint_epoch_*.pt",
+                keep_last=keep_last
+            )
+            manager.save(
+                inference_state(model, model_config, epoch=epoch + 1, losses=epoch_losses,
+                                image_size=resolution),
+                "model_inference_fp16.pt"
+            )
             print(f"  Saved checkpoint: {checkpoint_path}")
         
         # Save training log
         log_path = os.path.join(log_dir, "training_log.json")
         with open(log_path, 'w') as f:
             json.dump(training_log, f, indent=2)
+        
+        if stop:
+            print(f"\nEarly stopping: no validation improvement in {patience} passes "
+                  f"(best {stopper.best:.4f} at epoch {stopper.best_epoch})")
+            break
     
+    profiler.close()
+    manager.close()
     print("\nTraining completed!")
     print(f"Final model saved in: {save_dir}")
     print(f"Training log saved in: {log_path}")
+    if stopper.best is not None:
+        print(f"Best model (val loss {stopper.best:.4f}, epoch {stopper.best_epoch}): "
+              f"{os.path.join(save_dir, 'best_model.pt')}")
 
 
 if __name__ == "__main__":
@@ -294,12 +643,61 @@ if __name__ == "__main__":
                        help="Use classifier head")
     parser.add_argument("--cls_weight", type=float, default=0.0,
                        help="Classification loss weight")
+    parser.add_argument("--labels_csv", type=str, default=None,
+                       help="CSV of cell_id,label for the classifier (default: the index's label column)")
+    parser.add_argument("--balance_classes", action="store_true",
+                       help="Draw labeled windows class-balanced (with --use_classifier)")
     parser.add_argument("--save_dir", type=str, default="checkpoints",
                        help="Directory to save checkpoints")
     parser.add_argument("--log_dir", type=str, default="logs",
                        help="Directory to save logs")
     parser.add_argument("--resume_from", type=str, default=None,
-                       help="Resume training from checkpoint")
+                       help="Resume training from checkpoint ('auto' = newest in save_dir)")
+    parser.add_argument("--checkpoint_every_steps", type=int, default=0,
+                       help="Also checkpoint every N steps for mid-epoch resume (0 = epoch ends only)")
+    parser.add_argument("--keep_last", type=int, default=5,
+                       help="Number of epoch checkpoints to keep (0 = keep all)")
+    parser.add_argument("--seed", type=int, default=0,
+                       help="Seed of the data order")
+    parser.add_argument("--image_size", type=int, default=128,
+                       help="Frame size (multiple of 8) when no resize schedule is given")
+    parser.add_argument("--resize_schedule", type=str, default=None,
+                       help="Progressive resizing 'epoch:size,...' (0-based epochs), e.g. '0:64,10:128,30:256'")
+    parser.add_argument("--frame_cache_dir", type=str, default=None,
+                       help="Cache resized frames of every scheduled size here (decode each image once)")
+    parser.add_argument("--variable_length", action="store_true",
+                       help="Index has variable-length windows: bucket batches by length and mask padding in the losses")
+    parser.add_argument("--max_frames_per_batch", type=int, default=None,
+                       help="With --variable_length: frame budget per batch (batch size varies, --batch_size is the cap)")
+    parser.add_argument("--val_every", type=int, default=1,
+                       help="Validate on the held-out embryos every N epochs (0 = never)")
+    parser.add_argument("--val_windows", type=int, default=64,
+                       help="Number of validation windows (fixed subset, pre-loaded in memory)")
+    parser.add_argument("--val_batch_size", type=int, default=None,
+                       help="Validation batch size (default 4 x batch size)")
+    parser.add_argument("--patience", type=int, default=0,
+                       help="Stop after N validation passes without improvement (0 = no early stopping)")
+    parser.add_argument("--min_delta", type=float, default=0.0,
+                       help="Smallest validation-loss decrease that counts as improvement")
+    parser.add_argument("--autotune", action="store_true",
+                       help="Probe this node for batch size, activation checkpointing and DataLoader settings")
+    parser.add_argument("--autotune_max_batch", type=int, default=256,
+                       help="Upper bound for the batch-size probe")
+    parser.add_argument("--lr_scaling", type=str, default="sqrt", choices=["sqrt", "linear", "none"],
+                       help="How to scale the learning rate when autotune changes the batch size")
+    parser.add_argument("--autotune_cache", type=str, default=AUTOTUNE_CACHE,
+                       help="Cache of tuned settings per hardware fingerprint")
+    parser.add_argument("--retune", action="store_true",
+                       help="Ignore the cached autotune result for this node")
+    parser.add_argument("--profile", action="store_true",
+                       help="Log per-region step timings (data wait, H2D, forward, loss, backward, optimizer) "
+                            "and per-worker memory")
+    parser.add_argument("--profile_trace_dir", type=str, default=None,
+                       help="Write a torch.profiler trace of a few steps to this directory")
+    parser.add_argument("--profile_trace_start", type=int, default=10,
+                       help="First step of the profiler trace")
+    parser.add_argument("--profile_trace_steps", type=int, default=5,
+                       help="Number of steps in the profiler trace")
     
     args = parser.parse_args()
     
@@ -317,6 +715,30 @@ if __name__ == "__main__":
         use_classifier=args.use_classifier,
         save_dir=args.save_dir,
         log_dir=args.log_dir,
-        resume_from=args.resume_from
+        resume_from=args.resume_from,
+        profile=args.profile,
+        profile_trace_dir=args.profile_trace_dir,
+        profile_trace_start=args.profile_trace_start,
+        profile_trace_steps=args.profile_trace_steps,
+        use_autotune=args.autotune,
+        autotune_max_batch=args.autotune_max_batch,
+        lr_scaling=args.lr_scaling,
+        autotune_cache=args.autotune_cache,
+        retune=args.retune,
+        checkpoint_every_steps=args.checkpoint_every_steps,
+        keep_last=args.keep_last or None,
+        seed=args.seed,
+        image_size=args.image_size,
+        resize_schedule=args.resize_schedule,
+        frame_cache_dir=args.frame_cache_dir,
+        variable_length=args.variable_length,
+        max_frames_per_batch=args.max_frames_per_batch,
+        val_every=args.val_every,
+        val_windows=args.val_windows,
+        val_batch_size=args.val_batch_size,
+        patience=args.patience,
+        min_delta=args.min_delta,
+        labels_csv=args.labels_csv,
+        balance_classes=args.balance_classes
     )
 
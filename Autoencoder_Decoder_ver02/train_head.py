@@ -0,0 +1,176 @@
+"""
+Train the LatentClassifier head on cached encoder features
+
+The encoder is frozen: the windows are encoded once into a feature store
+(feature_store.py) and only the head is trained, on the stored features.
+The head starts with a global average pool, so training runs its remaining
+layers on the pooled (N, latent_dim) z_last, which gives the same result as
+running the full head on z_last. An epoch takes milliseconds instead of a
+full autoencoder epoch. probe.py compares other heads on the same store.
+
+Usage:
+    python train_head.py --checkpoint checkpoints/best_model.pt --index_csv index.csv \
+        --labels_csv labels.csv --epochs 200
+"""
+import time
+
+import torch
+import torch.nn as nn
+
+from model import LatentClassifier
+from losses import classification_loss
+from checkpointing import inference_state, atomic_save
+from feature_store import build_feature_store, load_autoencoder
+from labels import (window_labels, class_counts, classification_metrics, ClassBalancedSampler,
+                    UNLABELED)
+
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def head_layers(classifier):
+    """The layers of LatentClassifier after its global pool + flatten"""
+    return classifier.head[2:]
+
+
+def evaluate_head(layers, features, y, num_classes):
+    """Accuracy and balanced accuracy (mean per-class recall) of the head"""
+    layers.eval()
+    with torch.no_grad():
+        pred = layers(features).argmax(dim=1)
+    return classification_metrics(pred, y, num_classes)
+
+
+def train_head(classifier, features, y, num_classes, epochs=200, batch_size=64, learning_rate=1e-3,
+               weight_decay=1e-4, balance=True, seed=0, val=None, device="cpu"):
+    """
+    Train a LatentClassifier on pooled features (the encoder is not involved)
+
+    Args:
+        classifier: LatentClassifier to train (in place)
+        features: (N, latent_dim) pooled z_last
+        y: (N,) class indices
+        balance: draw windows with ClassBalancedSampler (else plain shuffling)
+        val: optional (features, y) evaluated after every epoch
+
+    Returns:
+        list of per-epoch log dicts
+    """
+    layers = head_layers(classifier).to(device)
+    features, y = features.to(device), y.to(device)
+    optimizer = torch.optim.AdamW(layers.parameters(), lr=learning_rate, weight_decay=weight_decay)
+    criterion = nn.CrossEntropyLoss()
+    sampler = ClassBalancedSampler(y.cpu(), seed=seed) if balance else None
+    g = torch.Generator().manual_seed(seed)
+    history = []
+    for epoch in range(epochs):
+        layers.train()
+        if sampler is not None:
+            sampler.set_epoch(epoch)
+            order = torch.tensor(list(sampler))
+        else:
+            order = torch.randperm(len(y), generator=g)
+        total, n = 0.0, 0
+        for s in range(0, len(order), batch_size):
+            idx = order[s:s + batch_size].to(device)
+            if len(idx) < 2:
+                continue  # BatchNorm1d needs more than one sample
+            loss = classification_loss(layers(features[idx]), y[idx], criterion)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total += loss.item() * len(idx)
+            n += len(idx)
+        entry = {"epoch": epoch + 1, "loss": total / max(n, 1)}
+        entry.update({f"train_{k}": v for k, v in evaluate_head(layers, features, y, num_classes).items()})
+        if val is not None:
+            entry.update({f"val_{k}": v for k, v in
+                          evaluate_head(layers, val[0].to(device), val[1].to(device), num_classes).items()})
+        history.append(entry)
+    return history
+
+
+def main(checkpoint, index_csv="index.csv", labels_csv=None, out="head_model.pt",
+         feature_store="feature_store", image_size=128, epochs=200, batch_size=64,
+         learning_rate=1e-3, weight_decay=1e-4, balance=True, seed=0, encode_batch_size=32):
+    """Encode the windows once (feature store), train the head, save the autoencoder with the trained head"""
+    torch.manual_seed(seed)
+    store = build_feature_store(checkpoint, index_csv, feature_store, image_size, encode_batch_size, DEVICE)
+    y_all, classes = window_labels(store.df, labels_csv)
+    if not classes:
+        raise ValueError("No labels: add a label column to the index (build_index.py LABELS_CSV) "
+                         "or pass --labels_csv")
+    labeled = (y_all != UNLABELED).nonzero().flatten().tolist()
+    print(f"Classes: {classes}, labeled windows: {len(labeled)}/{len(store)}, "
+          f"per class: {class_counts(y_all, len(classes)).tolist()}")
+
+    features = torch.from_numpy(store.features("last", labeled))
+    y = y_all[labeled]
+
+    # Held-out embryos of the index's split, if there is one
+    if "split" in store.df.columns:
+        is_val = torch.tensor((store.df["split"].iloc[labeled] == "val").to_numpy())
+    else:
+        is_val = torch.zeros(len(labeled), dtype=torch.bool)
+    val = (features[is_val], y[is_val]) if is_val.any() else None
+
+    model, model_config = load_autoencoder(checkpoint, DEVICE)
+    classifier = LatentClassifier(latent_dim=model_config.get("encoder_hidden_dim", 256),
+                                  num_classes=len(classes))
+    t0 = time.perf_counter()
+    history = train_head(classifier, features[~is_val], y[~is_val], len(classes), epochs, batch_size,
+                         learning_rate, weight_decay, balance, seed, val, DEVICE)
+    last = history[-1]
+    print(f"Trained head for {epochs} epochs in {time.perf_counter() - t0:.1f}s: "
+          + ", ".join(f"{k} {v:.4f}" for k, v in last.items() if k != "epoch"))
+
+    # Autoencoder with the trained head, loadable like any inference artifact
+    model.use_classifier = True
+    model.classifier = classifier.to(DEVICE).eval()
+    model_config = {**model_config, "use_classifier": True, "num_classes": len(classes)}
+    atomic_save(inference_state(model, model_config, dtype=torch.float32, classes=classes,
+                                head_history=history, image_size=image_size), out)
+    print(f"Saved: {out}")
+    return history
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Train the LatentClassifier head on cached z_last features")
+    parser.add_argument("--checkpoint", type=str, required=True,
+                        help="Trained autoencoder (training checkpoint or inference artifact)")
+    parser.add_argument("--index_csv", type=str, default="index.csv",
+                        help="Index with a label column (or combine with --labels_csv)")
+    parser.add_argument("--labels_csv", type=str, default=None,
+                        help="CSV of cell_id,label joined on cell_id (overrides the index's label column)")
+    parser.add_argument("--out", type=str, default="head_model.pt",
+                        help="Output: autoencoder + trained head (inference artifact)")
+    parser.add_argument("--feature_store", type=str, default="feature_store",
+                        help="Feature store directory (built if missing or stale, see feature_store.py)")
+    parser.add_argument("--image_size", type=int, default=128)
+    parser.add_argument("--epochs", type=int, default=200)
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--learning_rate", type=float, default=1e-3)
+    parser.add_argument("--weight_decay", type=float, default=1e-4)
+    parser.add_argument("--no_balance", action="store_true",
+                        help="Plain shuffling instead of class-balanced sampling")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--encode_batch_size", type=int, default=32,
+                        help="Windows per batch when encoding the features")
+    args = parser.parse_args()
+
+    main(
+        checkpoint=args.checkpoint,
+        index_csv=args.index_csv,
+        labels_csv=args.labels_csv,
+        out=args.out,
+        feature_store=args.feature_store,
+        image_size=args.image_size,
+        epochs=args.epochs,
+        batch_size=args.batch_size,
+        learning_rate=args.learning_rate,
+        weight_decay=args.weight_decay,
+        balance=not args.no_balance,
+        seed=args.seed,
+        encode_batch_size=args.encode_batch_size
+    )
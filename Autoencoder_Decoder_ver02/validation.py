@@ -0,0 +1,181 @@
+"""
+Embryo-level validation during training
+
+build_index.py assigns whole embryos (cell_id) to a "train" or "val" split,
+so overlapping windows of one embryo never end up on both sides. During
+training a fixed subset of the validation windows is decoded once, kept in
+memory and evaluated every few epochs under inference_mode with large
+batches (bf16 autocast on GPU). Only the cached tensors go through the
+model, so a validation pass costs a few seconds, and its loss drives early
+stopping and the best-checkpoint selection.
+"""
+import csv
+from collections import defaultdict
+
+import torch
+
+from losses import reconstruction_loss, temporal_smoothness_loss, lengths_to_mask
+from length_bucketing import pad_collate
+
+
+def index_has_split(index_csv):
+    """Whether index_csv has the split column written by build_index.py"""
+    with open(index_csv, newline="") as f:
+        return "split" in next(csv.reader(f), [])
+
+
+def spread_over_embryos(cell_ids, max_windows):
+    """
+    Indices of up to ``max_windows`` windows, taken round-robin over embryos
+
+    Every embryo contributes its first window before any embryo contributes
+    a second one, so a small subset still covers as many embryos as possible.
+    The choice depends only on the index, so it is the same in every epoch
+    and every run.
+    """
+    by_cell = defaultdict(list)
+    for i, cell_id in enumerate(cell_ids):
+        by_cell[cell_id].append(i)
+    queues = [by_cell[c] for c in sorted(by_cell)]
+    picked = []
+    depth = 0
+    while len(picked) < max_windows and any(depth < len(q) for q in queues):
+        for q in queues:
+            if depth < len(q) and len(picked) < max_windows:
+                picked.append(q[depth])
+        depth += 1
+    return sorted(picked)
+
+
+class ValidationSet:
+    """
+    Fixed subset of validation windows, pre-loaded into memory
+
+    Windows are decoded once (again only when the dataset's resolution
+    changes) and kept as float16 CPU tensors, grouped into batches of similar
+    length; variable-length batches are padded like in training.
+
+    Args:
+        dataset: IVFSequenceDataset of the "val" split
+        max_windows: size of the subset (None = all validation windows)
+    """
+
+    def __init__(self, dataset, max_windows=64):
+        self.dataset = dataset
+        cell_ids = dataset.df["cell_id"].tolist()
+        n = len(cell_ids) if max_windows is None else max_windows
+        self.indices = spread_over_embryos(cell_ids, n)
+        self.n_embryos = len({cell_ids[i] for i in self.indices})
+        self._windows = None
+        self._resize = None
+
+    def __len__(self):
+        return len(self.indices)
+
+    def _load(self):
+        if self._windows is None or self._resize != self.dataset.resize:
+            windows = [self.dataset[i][0].half() for i in self.indices]
+            self._windows = sorted(windows, key=lambda v: v.shape[0])
+            self._resize = self.dataset.resize
+        return self._windows
+
+    def batches(self, batch_size):
+        """
+        Yield (vol, lengths) batches; lengths is None when all windows in
+        the batch have the same length
+        """
+        windows = self._load()
+        pin = torch.cuda.is_available()
+        for start in range(0, len(windows), batch_size):
+            chunk = windows[start:start + batch_size]
+            if len({v.shape[0] for v in chunk}) == 1:
+                vol, lengths = torch.stack(chunk), None
+            else:
+                vol, _, lengths = pad_collate([(v, None) for v in chunk])
+            yield (vol.pin_memory() if pin else vol), lengths
+
+
+def evaluate(model, val_set, device, batch_size=32, l1_weight=0.5, ms_ssim_weight=0.5,
+             smooth_weight=0.1, amp=True):
+    """
+    Mean validation losses of ``model`` on a ValidationSet
+
+    The forward pass runs in eval mode under inference_mode (and bf16
+    autocast on CUDA when ``amp``); the losses are computed in float32.
+
+    Returns:
+        dict with total, reconstruction, l1, ms_ssim, smooth and ms_ssim_value,
+        averaged over windows
+    """
+    was_training = model.training
+    model.eval()
+    sums = defaultdict(float)
+    n = 0
+    use_amp = amp and str(device).startswith("cuda")
+    with torch.inference_mode():
+        for vol, lengths in val_set.batches(batch_size):
+            vol = vol.to(device, non_blocking=True).float()
+            mask = None
+            if lengths is not None:
+                lengths = lengths.to(device)
+                mask = lengths_to_mask(lengths, vol.shape[1])
+            with torch.autocast("cuda", dtype=torch.bfloat16, enabled=use_amp):
+                output = model(vol, lengths=lengths)
+            rec_loss, rec_details = reconstruction_loss(
+                output["reconstruction"].float(), vol,
+                l1_weight=l1_weight,
+                ms_ssim_weight=ms_ssim_weight,
+                mask=mask
+            )
+            smooth_loss = temporal_smoothness_loss(output["z_seq"].float(), weight=smooth_weight, mask=mask)
+
+            b = vol.shape[0]
+            sums["total"] += (rec_loss + smooth_loss).item() * b
+            sums["reconstruction"] += rec_loss.item() * b
+            sums["l1"] += rec_details["l1_loss"] * b
+            sums["ms_ssim"] += rec_details["ms_ssim_loss"] * b
+            sums["ms_ssim_value"] += rec_details["ms_ssim_value"] * b
+            sums["smooth"] += smooth_loss.item() * b
+            n += b
+    model.train(was_training)
+    return {k: v / max(n, 1) for k, v in sums.items()}
+
+
+class EarlyStopping:
+    """
+    Tracks the best validation loss and counts evaluations without improvement
+
+    Args:
+        patience: stop after this many validation passes without improvement
+            (0 = never stop, only track the best)
+        min_delta: smallest decrease of the loss that counts as improvement
+    """
+
+    def __init__(self, patience=0, min_delta=0.0):
+        self.patience = patience
+        self.min_delta = min_delta
+        self.best = None
+        self.best_epoch = None
+        self.bad_evals = 0
+
+    def step(self, value, epoch):
+        """Record a validation loss; returns True if it is a new best"""
+        if self.best is None or value < self.best - self.min_delta:
+            self.best = value
+            self.best_epoch = epoch
+            self.bad_evals = 0
+            return True
+        self.bad_evals += 1
+        return False
+
+    @property
+    def should_stop(self):
+        return self.patience > 0 and self.bad_evals >= self.patience
+
+    def state_dict(self):
+        return {"best": self.best, "best_epoch": self.best_epoch, "bad_evals": self.bad_evals}
+
+    def load_state_dict(self, state):
+        self.best = state["best"]
+        self.best_epoch = state["best_epoch"]
+        self.bad_evals = state["bad_evals"]
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache for analysis stages
+
+Every cached result is addressed by (stage, parameters, checkpoint hash,
+input hash). A stage's key can be passed as the ``input_hash`` of the next
+stage, so keys form a chain: changing one parameter changes the key of that
+stage and of everything below it, while the stages above it stay cached.
+
+Entries live in a single directory and are evicted least-recently-used once
+the directory grows past ``max_bytes``. The directory is scanned once when
+the cache is opened; after that the total size is tracked as entries are
+written, and it is only rescanned when that estimate crosses ``max_bytes``.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = ".analysis_cache"
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2 GB
+
+_file_hash_memo = {}
+
+
+def hash_bytes(data):
+    """Short hex digest of a bytes object"""
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def hash_array(arr):
+    """Hash of an array's dtype, shape and contents"""
+    arr = np.ascontiguousarray(arr)
+    h = hashlib.sha256()
+    h.update(str(arr.dtype).encode())
+    h.update(str(arr.shape).encode())
+    h.update(arr.tobytes())
+    return h.hexdigest()[:32]
+
+
+def hash_latents(latents):
+    """Hash of a {cell_id: latent array} dict (changes whenever the checkpoint does)"""
+    return hash_bytes("|".join(f"{k}:{hash_array(z)}" for k, z in latents.items()).encode())
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """
+    Hash of a file's contents (e.g. a checkpoint)
+
+    Memoized per process on (path, size, mtime) so repeated calls are free.
+    """
+    st = os.stat(path)
+    memo_key = (str(Path(path).resolve()), st.st_size, st.st_mtime_ns)
+    if memo_key not in _file_hash_memo:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                h.update(chunk)
+        _file_hash_memo[memo_key] = h.hexdigest()[:32]
+    return _file_hash_memo[memo_key]
+
+
+def hash_params(params):
+    """Stable hash of a JSON-serializable parameter dict"""
+    blob = json.dumps(params or {}, sort_keys=True, default=str)
+    return hash_bytes(blob.encode())
+
+
+class StageCache:
+    """
+    On-disk, size-bounded LRU cache for intermediate analysis results
+
+    Args:
+        cache_dir: directory holding the cache entries
+        max_bytes: total size above which least-recently-used entries are evicted
+        enabled: if False, every lookup misses and nothing is written
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, enabled=True):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.total_bytes = 0
+        if enabled:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self.total_bytes = sum(size for _, size, _ in self._entries())
+
+    @staticmethod
+    def key(stage, params=None, checkpoint_hash=None, input_hash=None):
+        """
+        Build the content address of a stage result
+
+        Args:
+            stage: stage name, e.g. "latents", "knn_graph"
+            params: dict of parameters that affect the result
+            checkpoint_hash: hash of the model checkpoint (if the stage uses one)
+            input_hash: hash of the stage input, or the key of the upstream stage
+        """
+        blob = json.dumps({
+            "stage": stage,
+            "params": hash_params(params),
+            "checkpoint": checkpoint_hash,
+            "input": input_hash,
+        }, sort_keys=True)
+        return f"{stage}-{hash_bytes(blob.encode())}"
+
+    def _find(self, key):
+        for suffix in (".npy", ".pkl"):
+            path = self.cache_dir / f"{key}{suffix}"
+            if path.exists():
+                return path
+        return None
+
+    def __contains__(self, key):
+        return self.enabled and self._find(key) is not None
+
+    def get(self, key, default=None):
+        """Load a cached value, or return ``default`` on a miss"""
+        if not self.enabled:
+            return default
+        path = self._find(key)
+        if path is None:
+            return default
+        try:
+            if path.suffix == ".npy":
+                value = np.load(path, allow_pickle=False)
+            else:
+                with open(path, "rb") as f:
+                    value = pickle.load(f)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            # Truncated or corrupted entry: drop it and recompute
+            self._remove(path)
+            return default
+        # Touch the entry so it counts as recently used
+        os.utime(path)
+        return value
+
+    def put(self, key, value):
+        """Store a value (NumPy arrays as .npy, anything else pickled)"""
+        if not self.enabled:
+            return
+        is_array = isinstance(value, np.ndarray) and value.dtype != object
+        suffix = ".npy" if is_array else ".pkl"
+        path = self.cache_dir / f"{key}{suffix}"
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if is_array:
+                    np.save(f, value, allow_pickle=False)
+                else:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                size = f.tell()
+            try:
+                self.total_bytes -= path.stat().st_size  # overwriting an entry
+            except FileNotFoundError:
+                pass
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        self.total_bytes += size
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for ``key``, computing and storing it on a miss"""
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def _entries(self):
+        """(mtime, size, path) of every entry on disk"""
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for e in it:
+                if e.is_file() and not e.name.endswith(".tmp"):
+                    st = e.stat()
+                    entries.append((st.st_mtime_ns, st.st_size, e.path))
+        return entries
+
+    def _remove(self, path):
+        try:
+            size = os.stat(path).st_size
+            os.remove(path)
+            self.total_bytes -= size
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Delete least-recently-used entries until the cache fits in ``max_bytes``"""
+        # Rescan: other processes may have written or evicted entries meanwhile
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        self.total_bytes = total
+
+    def clear(self):
+        """Remove every entry"""
+        if not self.cache_dir.exists():
+            return
+        for path in self.cache_dir.iterdir():
+            if path.is_file():
+                path.unlink()
+        self.total_bytes = 0
+
+    def summary(self):
+        return f"cache {self.cache_dir}: {self.hits} hits, {self.misses} misses"
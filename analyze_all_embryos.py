@@ -5,24 +5,39 @@
 """
 
 import numpy as np
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 from pathlib import Path
 import pandas as pd
+from analysis_cache import StageCache, hash_latents
+from trajectory_dtw import dtw_matrix_cached, knn_outlier_scores, save_dtw_matrix
+from trajectory_topology import diagrams_cached, topology_features, save_diagrams
 
-def analyze_all_embryos():
-    print("="*60)
-    print("📊 分析所有胚胎特征")
-    print("="*60)
-    
+CACHE_DIR = ".analysis_cache"
+FEATURES_VERSION = 2  # 修改 build_feature_table 时加一，让旧的快取失效
+DTW_WINDOW = 3        # Sakoe-Chiba 带宽（时间步）
+TOPO_N_PERM = 64      # 持续同调：每条轨迹最多取几个点（贪心子采样）
+TOPO_METHOD = "image" # 持续图向量化："image"、"landscape" 或 "none"（只留摘要）
+
+def load_latents(latent_dir="latents_unique"):
+    """读取所有胚胎的潜在轨迹 {embryo_id: z}"""
+    latents = {}
+    for z_file in sorted(Path(latent_dir).glob("*_z.npy")):
+        embryo_id = z_file.stem.replace("_z", "")
+        latents[embryo_id] = np.load(z_file)  # [16, 128]
+    return latents
+
+def load_times(latent_dir="latents_unique"):
+    """读取每帧的拍摄时间 {embryo_id: t}（小时；export 时索引有 times 栏才会有 *_t.npy）"""
+    times = {}
+    for t_file in sorted(Path(latent_dir).glob("*_t.npy")):
+        times[t_file.stem[:-len("_t")]] = np.load(t_file)
+    return times
+
+def build_feature_table(latents, times=None):
+    times = times or {}
     # 收集所有胚胎的特征
     embryo_data = []
     
-    for z_file in sorted(Path("latents_unique").glob("*_z.npy")):
-        embryo_id = z_file.stem.replace("_z", "")
-        z = np.load(z_file)  # [16, 128]
-        
+    for embryo_id, z in latents.items():
         # 计算各种特征
         # 1. 速度
         speeds = np.linalg.norm(z[1:] - z[:-1], axis=1)  # [15]
@@ -40,6 +55,16 @@ def analyze_all_embryos():
         mean_feature = z.mean()
         std_feature = z.std()
         
+        # 5. 每小时速度（有拍摄时间时）：不受下采样间隔与拍摄频率影响
+        t = times.get(embryo_id)
+        if t is not None and len(t) == len(z) and t[-1] > t[0]:
+            dt = np.diff(t)
+            duration_h = t[-1] - t[0]
+            mean_speed_per_h = traj_length / duration_h
+            max_speed_per_h = (speeds[dt > 0] / dt[dt > 0]).max()
+        else:
+            duration_h = mean_speed_per_h = max_speed_per_h = np.nan
+        
         embryo_data.append({
             'embryo_id': embryo_id,
             'mean_speed': mean_speed,
@@ -48,15 +73,46 @@ def analyze_all_embryos():
             'traj_length': traj_length,
             'start_end_dist': start_end_dist,
             'mean_feature': mean_feature,
-            'std_feature': std_feature
+            'std_feature': std_feature,
+            'duration_h': duration_h,
+            'mean_speed_per_h': mean_speed_per_h,
+            'max_speed_per_h': max_speed_per_h
         })
     
     # 转成 DataFrame
-    df = pd.DataFrame(embryo_data)
+    return pd.DataFrame(embryo_data)
+
+def analyze_all_embryos(cache_dir=CACHE_DIR):
+    print("="*60)
+    print("📊 分析所有胚胎特征")
+    print("="*60)
+    
+    latents = load_latents("latents_unique")
+    times = load_times("latents_unique")
+    cache = StageCache(cache_dir)
+    key = cache.key("features", params={"version": FEATURES_VERSION},
+                    input_hash=hash_latents({**latents, **{f"{k}_t": t for k, t in times.items()}}))
+    df = cache.get_or_compute(key, lambda: build_feature_table(latents, times))
+    
+    # DTW 对齐后的轨迹距离：对发育快慢和第一个窗口的起点不敏感
+    # 距离矩阵存进快取和 dtw_distances.npz，分群/异常检测可直接重用
+    ids, D = dtw_matrix_cached(latents, window=DTW_WINDOW, cache=cache)
+    save_dtw_matrix(ids, D)
+    dtw_scores = pd.Series(knn_outlier_scores(D, k=5), index=ids)
+    df['dtw_outlier_score'] = dtw_scores.reindex(df['embryo_id']).values
+    
+    # 持续同调：每个胚胎的持续图按潜在向量的哈希快取，只有新胚胎/新 checkpoint 才重算
+    dgms = diagrams_cached(latents, n_perm=TOPO_N_PERM, cache=cache)
+    save_diagrams(dgms)
+    df = df.merge(topology_features(dgms, method=TOPO_METHOD), on='embryo_id', how='left')
     
     print(f"\n✅ 分析了 {len(df)} 个胚胎")
     print(f"\n📊 统计摘要:")
     print(df[['mean_speed', 'traj_length', 'start_end_dist']].describe())
+    has_time = df['mean_speed_per_h'].notna()
+    if has_time.any():
+        print(f"\n⏱️  每小时速度（{has_time.sum()} 个胚胎有拍摄时间）:")
+        print(df.loc[has_time, ['duration_h', 'mean_speed_per_h', 'max_speed_per_h']].describe())
     
     # 保存结果
     df.to_csv("embryo_features_summary.csv", index=False)
@@ -81,6 +137,14 @@ def analyze_all_embryos():
     for _, row in speed_low_outliers.iterrows():
         print(f"   {row['embryo_id']}: 速度 {row['mean_speed']:.4f}")
     
+    # 每小时速度异常高的（与拍摄间隔无关，可和每步速度对照）
+    if has_time.sum() > 2:
+        timed = df[has_time]
+        hour_threshold = timed['mean_speed_per_h'].mean() + 2 * timed['mean_speed_per_h'].std()
+        print(f"\n⚠️  每小时发育速度异常快的胚胎 (>{hour_threshold:.4f}/h):")
+        for _, row in timed[timed['mean_speed_per_h'] > hour_threshold].iterrows():
+            print(f"   {row['embryo_id']}: {row['mean_speed_per_h']:.4f}/h (每步 {row['mean_speed']:.4f})")
+    
     # 轨迹长度异常的
     traj_threshold = df['traj_length'].mean() + 2 * df['traj_length'].std()
     traj_outliers = df[df['traj_length'] > traj_threshold]
@@ -88,11 +152,29 @@ def analyze_all_embryos():
     for _, row in traj_outliers.iterrows():
         print(f"   {row['embryo_id']}: 长度 {row['traj_length']:.4f}")
     
+    # DTW 轨迹形状异常的
+    dtw_threshold = df['dtw_outlier_score'].mean() + 2 * df['dtw_outlier_score'].std()
+    dtw_outliers = df[df['dtw_outlier_score'] > dtw_threshold]
+    print(f"\n⚠️  DTW 对齐后轨迹与其他胚胎差异大的胚胎 (>{dtw_threshold:.4f}):")
+    for _, row in dtw_outliers.iterrows():
+        print(f"   {row['embryo_id']}: DTW 距离 {row['dtw_outlier_score']:.4f}")
+    
+    # 轨迹环结构（H1 总持续度）异常的
+    h1_threshold = df['h1_total_persistence'].mean() + 2 * df['h1_total_persistence'].std()
+    h1_outliers = df[df['h1_total_persistence'] > h1_threshold]
+    print(f"\n⚠️  轨迹环结构异常明显的胚胎 (H1 总持续度 >{h1_threshold:.4f}):")
+    for _, row in h1_outliers.iterrows():
+        print(f"   {row['embryo_id']}: H1 {row['h1_total_persistence']:.4f} ({int(row['h1_count'])} 个环)")
+    
     # 可视化分布
     print(f"\n{'='*60}")
     print(f"📈 生成分布图")
     print(f"{'='*60}")
     
+    # matplotlib 只在画图时才载入（启动更快）
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
     fig, axes = plt.subplots(2, 2, figsize=(12, 10))
     
     # 1. Speed Distribution
@@ -166,6 +248,8 @@ def analyze_all_embryos():
     print(f"\n📁 产生的文件:")
     print(f"  - embryo_features_summary.csv (所有特征数据)")
     print(f"  - all_embryos_analysis.png (分布图)")
+    print(f"  - dtw_distances.npz (DTW 距离矩阵)")
+    print(f"  - persistence_diagrams.npz (每个胚胎的 H0/H1 持续图)")
     print(f"\n📊 查看方式:")
     print(f"  cat embryo_features_summary.csv | head")
     print(f"  在 Cursor 中打开 all_embryos_analysis.png")
@@ -0,0 +1,7 @@
+"""
+Benchmark suite for the data pipeline, models, losses and T-PHATE stages
+
+Run from the repository root:
+    python3 -m benchmarks.run --out bench.json
+    python3 -m benchmarks.run --compare baseline.json
+"""
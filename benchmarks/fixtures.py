@@ -0,0 +1,43 @@
+"""
+Synthetic data fixtures for the benchmarks
+
+The fake dataset mimics the real layout: one directory per embryo,
+containing grayscale JPEG frames named <cell_id>_RUN<i>.jpeg.
+"""
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+
+def make_fake_dataset(root, n_cells=8, n_frames=60, size=500, seed=0):
+    """
+    Write a fake embryo directory tree of JPEGs
+
+    Each frame is a blurred disc ("embryo") that drifts and grows slowly over
+    time on a noisy background, so decode and resize costs are realistic.
+
+    Returns:
+        Path to the dataset root
+    """
+    root = Path(root)
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size]
+    for c in range(n_cells):
+        cell_id = f"FAKE{c:03d}-{c % 9 + 1}"
+        cell_dir = root / cell_id
+        cell_dir.mkdir(parents=True, exist_ok=True)
+        cx, cy = rng.uniform(0.4, 0.6, size=2) * size
+        for t in range(n_frames):
+            r = size * (0.2 + 0.1 * t / n_frames)
+            dist = np.sqrt((xx - cx - t) ** 2 + (yy - cy) ** 2)
+            img = 60 + 120 * np.clip(1 - dist / r, 0, 1) + rng.normal(0, 10, (size, size))
+            Image.fromarray(np.clip(img, 0, 255).astype(np.uint8)).save(
+                cell_dir / f"{cell_id}_RUN{t + 1}.jpeg", quality=90)
+    return root
+
+
+def make_fake_latents(n_points=256, dim=128, seed=0):
+    """Smooth random-walk latent trajectory [n_points, dim] for the T-PHATE stages"""
+    rng = np.random.default_rng(seed)
+    return np.cumsum(rng.normal(0, 0.1, (n_points, dim)), axis=0).astype(np.float32)
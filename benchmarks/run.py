@@ -0,0 +1,120 @@
+"""
+Run the benchmark suite and compare against a saved baseline
+
+Usage:
+    python3 -m benchmarks.run --out bench.json            # record
+    python3 -m benchmarks.run --compare baseline.json     # record + compare
+    python3 -m benchmarks.run --only model_ver02 ms_ssim  # subset
+
+With --compare, the exit code is 1 if any benchmark's median time exceeds
+the baseline by more than --tolerance. A 15-hour cluster job can then be
+gated on it.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import torch
+
+from benchmarks.fixtures import make_fake_dataset, make_fake_latents
+from benchmarks.suite import BENCHMARKS, run_benchmarks
+
+
+def environment():
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "cpu_count": os.cpu_count(),
+        "cuda_device": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print a comparison table and return the names of regressed benchmarks"""
+    regressions = []
+    print(f"\n{'benchmark':<28} {'baseline':>12} {'current':>12} {'ratio':>8}")
+    for name, stats in results.items():
+        if name not in baseline:
+            print(f"{name:<28} {'-':>12} {stats['median_s'] * 1000:10.2f}ms {'new':>8}")
+            continue
+        base = baseline[name]["median_s"]
+        ratio = stats["median_s"] / base if base > 0 else float("inf")
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = "  ✗ SLOWER"
+        elif ratio < 1 - tolerance:
+            flag = "  ✓ faster"
+        print(f"{name:<28} {base * 1000:10.2f}ms {stats['median_s'] * 1000:10.2f}ms {ratio:8.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark data pipeline, models and losses")
+    parser.add_argument("--out", type=str, default="bench_results.json",
+                        help="Where to write the JSON results")
+    parser.add_argument("--compare", type=str, default=None,
+                        help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed slowdown before a benchmark counts as regressed (0.2 = 20%%)")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=None,
+                        help="Run only these benchmarks")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed repetitions per benchmark")
+    parser.add_argument("--batch_size", type=int, default=2)
+    parser.add_argument("--seq_len", type=int, default=16)
+    parser.add_argument("--n_cells", type=int, default=6, help="Embryos in the fake dataset")
+    parser.add_argument("--n_frames", type=int, default=60, help="Frames per fake embryo")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4],
+                        help="DataLoader worker counts to try")
+    parser.add_argument("--data_dir", type=str, default=None,
+                        help="Reuse/keep the fake dataset here (default: temporary directory)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = Path(args.data_dir or tmp)
+        dataset_root = data_dir / "fake_embryos"
+        if not dataset_root.exists():
+            print(f"Generating fake dataset in {dataset_root}...")
+            make_fake_dataset(dataset_root, n_cells=args.n_cells, n_frames=args.n_frames)
+        ctx = {
+            "device": "cuda" if torch.cuda.is_available() else "cpu",
+            "dataset_root": dataset_root,
+            "index_csv": data_dir / "bench_index.csv",
+            "latents": make_fake_latents(),
+            "repeat": args.repeat,
+            "batch_size": args.batch_size,
+            "seq_len": args.seq_len,
+            "worker_counts": args.workers,
+        }
+        # build_index writes the index the dataset benchmarks read
+        only = args.only
+        if only and ("dataset" in only or "dataloader" in only) and "build_index" not in only:
+            only = ["build_index"] + only
+
+        print(f"Running benchmarks on {ctx['device']}...")
+        results = run_benchmarks(ctx, only=only)
+
+    report = {"environment": environment(), "config": vars(args), "results": results}
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n✗ {len(regressions)} benchmark(s) slower than baseline: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\n✓ No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
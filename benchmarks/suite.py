@@ -0,0 +1,336 @@
+"""
+Benchmark definitions
+
+Each benchmark is a generator registered with @benchmark. It takes the
+shared context dict and yields (name, stats) pairs, so one benchmark can
+report several variants (e.g. one entry per DataLoader worker count).
+"""
+import contextlib
+import importlib.util
+import io
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+VER02_DIR = REPO_ROOT / "Autoencoder_Decoder_ver02"
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a benchmark generator under ``name``"""
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+def load_module(name, path):
+    """
+    Import a module from a file path under a unique name
+
+    The root and ver02 directories both contain build_index.py and
+    dataset_ivf.py, so plain imports would collide.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def ver02_module(name):
+    if str(VER02_DIR) not in sys.path:
+        sys.path.append(str(VER02_DIR))
+    return load_module(f"ver02_{name}", VER02_DIR / f"{name}.py")
+
+
+def root_module(name):
+    if str(REPO_ROOT) not in sys.path:
+        sys.path.append(str(REPO_ROOT))
+    return load_module(f"root_{name}", REPO_ROOT / f"{name}.py")
+
+
+def time_fn(fn, repeat=5, warmup=1, device="cpu"):
+    """
+    Time ``fn`` and return summary statistics in seconds
+
+    CUDA work is synchronized before and after every call.
+    """
+    sync = torch.cuda.synchronize if device == "cuda" else (lambda: None)
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        sync()
+        start = time.perf_counter()
+        fn()
+        sync()
+        times.append(time.perf_counter() - start)
+    return {
+        "median_s": statistics.median(times),
+        "min_s": min(times),
+        "mean_s": statistics.fmean(times),
+        "repeat": repeat,
+    }
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence prints and tqdm bars of the code under test"""
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+
+@benchmark("build_index")
+def bench_build_index(ctx):
+    build_index = ver02_module("build_index")
+    build_index.DATASET_ROOT = ctx["dataset_root"]
+    build_index.OUT_CSV = str(ctx["index_csv"])
+
+    def run():
+        with quiet():
+            build_index.main()
+
+    yield "build_index", time_fn(run, repeat=ctx["repeat"])
+
+
+@benchmark("frame_quality")
+def bench_frame_quality(ctx):
+    frame_quality = ver02_module("frame_quality")
+    paths = sorted(str(p) for p in Path(ctx["dataset_root"]).rglob("*.jpeg"))[:64]
+    # Per-frame signature from the draft-mode decode, versus a full decode of the same frames
+    from PIL import Image
+    results = [
+        ("frame_signature_64", time_fn(lambda: [frame_quality.frame_signature(p) for p in paths],
+                                       repeat=ctx["repeat"])),
+        ("full_decode_64", time_fn(lambda: [np.asarray(Image.open(p).convert("L")) for p in paths],
+                                   repeat=ctx["repeat"])),
+    ]
+    yield from results
+
+
+@benchmark("time_grid")
+def bench_time_grid(ctx):
+    time_grid = ver02_module("time_grid")
+    # 500 embryos of 400-600 frames at 10-20 minute intervals, resampled every 30 minutes
+    rng = np.random.default_rng(0)
+    times = [np.cumsum(rng.uniform(1 / 6, 1 / 3, size=rng.integers(400, 600))) for _ in range(500)]
+    for method in time_grid.METHODS:
+        yield (f"time_grid_{method}",
+               time_fn(lambda: time_grid.resample_embryos(times, 0.5, method), repeat=ctx["repeat"]))
+
+
+@benchmark("dataset")
+def bench_dataset(ctx):
+    dataset_ivf = ver02_module("dataset_ivf")
+    ds = dataset_ivf.IVFSequenceDataset(str(ctx["index_csv"]), resize=128, norm="minmax01")
+    n = min(len(ds), 8)
+    stats = time_fn(lambda: [ds[i] for i in range(n)], repeat=ctx["repeat"])
+    stats["per_item_s"] = stats["median_s"] / n
+    yield "dataset_getitem", stats
+
+
+@benchmark("dataloader")
+def bench_dataloader(ctx):
+    from torch.utils.data import DataLoader
+    dataset_ivf = ver02_module("dataset_ivf")
+    ds = dataset_ivf.IVFSequenceDataset(str(ctx["index_csv"]), resize=128, norm="minmax01")
+    for workers in ctx["worker_counts"]:
+        loader = DataLoader(ds, batch_size=4, shuffle=False, num_workers=workers,
+                            pin_memory=ctx["device"] == "cuda")
+
+        def run():
+            for _ in loader:
+                pass
+
+        stats = time_fn(run, repeat=max(1, ctx["repeat"] // 2), warmup=0)
+        stats["windows_per_s"] = len(ds) / stats["median_s"]
+        yield f"dataloader_workers{workers}", stats
+
+
+def _train_step(model, vol, loss_fn):
+    out = model(vol)
+    loss = loss_fn(out, vol)
+    model.zero_grad(set_to_none=True)
+    loss.backward()
+
+
+@benchmark("model_v1")
+def bench_model_v1(ctx):
+    ConvLSTMAE = root_module("model_conv_lstm_ae").ConvLSTMAE
+    device = ctx["device"]
+    model = ConvLSTMAE().to(device)
+    vol = torch.rand(ctx["batch_size"], ctx["seq_len"], 1, 128, 128, device=device)
+
+    model.eval()
+    with torch.no_grad():
+        yield "v1_forward", time_fn(lambda: model(vol), repeat=ctx["repeat"], device=device)
+    model.train()
+    l1 = torch.nn.L1Loss()
+    yield "v1_forward_backward", time_fn(
+        lambda: _train_step(model, vol, lambda out, x: l1(out[0], x)),
+        repeat=ctx["repeat"], device=device)
+
+
+@benchmark("model_ver02")
+def bench_model_ver02(ctx):
+    ConvLSTMAutoencoder = ver02_module("model").ConvLSTMAutoencoder
+    reconstruction_loss = ver02_module("losses").reconstruction_loss
+    device = ctx["device"]
+    model = ConvLSTMAutoencoder(seq_len=ctx["seq_len"], use_classifier=False).to(device)
+    vol = torch.rand(ctx["batch_size"], ctx["seq_len"], 1, 128, 128, device=device)
+
+    model.eval()
+    with torch.no_grad():
+        yield "ver02_forward", time_fn(lambda: model(vol), repeat=ctx["repeat"], device=device)
+    model.train()
+    yield "ver02_forward_backward", time_fn(
+        lambda: _train_step(model, vol, lambda out, x: reconstruction_loss(out["reconstruction"], x)[0]),
+        repeat=ctx["repeat"], device=device)
+
+
+@benchmark("inference_engine")
+def bench_inference_engine(ctx):
+    engine_mod = ver02_module("inference_engine")
+    ConvLSTMAutoencoder = ver02_module("model").ConvLSTMAutoencoder
+    ConvLSTMAE = root_module("model_conv_lstm_ae").ConvLSTMAE
+    device = ctx["device"]
+    vol = torch.rand(2 * ctx["batch_size"], ctx["seq_len"], 1, 128, 128)
+
+    def eager_loop(model):
+        with torch.no_grad():
+            return [model.encode(vol[i:i + 1].to(device)) for i in range(len(vol))]
+
+    models = {
+        "ver02": ConvLSTMAutoencoder(seq_len=ctx["seq_len"], use_classifier=False).to(device).eval(),
+        "v1": ConvLSTMAE().to(device).eval(),
+    }
+    results = []
+    with quiet():
+        for name, model in models.items():
+            engine = engine_mod.InferenceEngine(model, device=device)
+            results.append((f"{name}_encode_eager_bs1",
+                            time_fn(lambda: eager_loop(model), repeat=ctx["repeat"], device=device)))
+            results.append((f"{name}_encode_engine",
+                            time_fn(lambda: engine.encode(vol), repeat=ctx["repeat"], device=device)))
+        if device == "cpu":
+            engine = engine_mod.InferenceEngine(models["v1"], device=device, quantize=True)
+            results.append(("v1_encode_engine_int8",
+                            time_fn(lambda: engine.encode(vol), repeat=ctx["repeat"], device=device)))
+    yield from results
+
+
+@benchmark("cpu_inference")
+def bench_cpu_inference(ctx):
+    cpu_inference = ver02_module("cpu_inference")
+    ConvLSTMAutoencoder = ver02_module("model").ConvLSTMAutoencoder
+    ConvLSTMAE = root_module("model_conv_lstm_ae").ConvLSTMAE
+    vol = torch.rand(2 * ctx["batch_size"], ctx["seq_len"], 1, 128, 128)
+    calibration = [torch.rand(2, ctx["seq_len"], 1, 128, 128) for _ in range(2)]
+
+    def eager_loop(model):
+        with torch.no_grad():
+            return [model.encode(vol[i:i + 1]) for i in range(len(vol))]
+
+    models = {
+        "ver02": ConvLSTMAutoencoder(seq_len=ctx["seq_len"], use_classifier=False).eval(),
+        "v1": ConvLSTMAE().eval(),
+    }
+    results = []
+    with quiet():
+        threads = cpu_inference.configure_cpu_threads()
+        for name, model in models.items():
+            engine = cpu_inference.cpu_engine(model, calibration)
+            results.append((f"{name}_cpu_fp32_eager_bs1",
+                            time_fn(lambda: eager_loop(model), repeat=ctx["repeat"])))
+            results.append((f"{name}_cpu_int8_profile",
+                            time_fn(lambda: engine.encode(vol), repeat=ctx["repeat"])))
+    for name, stats in results:
+        stats["threads"] = threads
+    yield from results
+
+
+@benchmark("ms_ssim")
+def bench_ms_ssim(ctx):
+    ms_ssim = ver02_module("losses").ms_ssim
+    device = ctx["device"]
+    n = ctx["batch_size"] * ctx["seq_len"]
+    a = torch.rand(n, 1, 128, 128, device=device)
+    b = torch.rand(n, 1, 128, 128, device=device)
+    yield "ms_ssim", time_fn(lambda: ms_ssim(a, b), repeat=ctx["repeat"], device=device)
+
+
+@benchmark("tphate")
+def bench_tphate(ctx):
+    tphate = root_module("tphate_from_existing_latents")
+    data = ctx["latents"]
+    repeat = ctx["repeat"]
+    results = []
+    with quiet():
+        results.append(("tphate_pca", time_fn(lambda: tphate.apply_pca(data), repeat=repeat)))
+        results.append(("tphate_tsne", time_fn(lambda: tphate.apply_tsne(data), repeat=1, warmup=0)))
+        kernel = tphate.build_adaptive_graph(data, k=5)
+        results.append(("tphate_knn_graph",
+                        time_fn(lambda: tphate.build_adaptive_graph(data, k=5), repeat=repeat)))
+        diffused = tphate.apply_diffusion(kernel, t=1)
+        results.append(("tphate_diffusion",
+                        time_fn(lambda: tphate.apply_diffusion(kernel, t=1), repeat=repeat)))
+        potential = tphate.compute_potential(diffused)
+        results.append(("tphate_potential",
+                        time_fn(lambda: tphate.compute_potential(diffused), repeat=repeat)))
+        results.append(("tphate_mds",
+                        time_fn(lambda: tphate.embed_potential(potential), repeat=1, warmup=0)))
+    yield from results
+
+
+@benchmark("topology")
+def bench_topology(ctx):
+    topology = root_module("trajectory_topology")
+    # Whole-embryo random-walk trajectories (300 frames), subsampled to 64 points each
+    rng = np.random.default_rng(0)
+    trajs = [np.cumsum(rng.normal(size=(300, 128)), axis=0).astype(np.float32) for _ in range(4)]
+    stats = time_fn(lambda: [topology.rips_diagrams(z) for z in trajs], repeat=max(1, ctx["repeat"] // 2))
+    stats["per_embryo_s"] = stats["median_s"] / len(trajs)
+    yield "topology_diagrams", stats
+    dgms = {i: topology.rips_diagrams(z) for i, z in enumerate(trajs * 50)}
+    yield "topology_images", time_fn(lambda: topology.topology_features(dgms, "image"), repeat=ctx["repeat"])
+
+
+@benchmark("latent_codec")
+def bench_latent_codec(ctx):
+    import tempfile
+    codec = ver02_module("latent_codec")
+    # 16 windows of ver02 z_seq maps (T=8, 256x16x16), read back in random order
+    rng = np.random.default_rng(0)
+    z = np.tanh(rng.normal(size=(16, 8, 256, 16, 16))).astype(np.float32)
+    rows = rng.permutation(len(z))
+    with tempfile.TemporaryDirectory() as tmp:
+        for dtype, grid, compression in (("float16", None, None), ("int8", None, "zlib"), ("int8", 4, "zlib")):
+            name = f"latent_read_{dtype}_{grid or 'full'}_{compression or 'none'}"
+            writer = codec.LatentArrayWriter(Path(tmp) / name, len(z), z.shape[1:], dtype, grid, compression,
+                                             chunk_rows=4)
+            writer.put(np.arange(len(z)), z)
+            array = writer.close()
+            stats = time_fn(lambda: codec.LatentArray(array.path)[rows], repeat=ctx["repeat"])
+            stats["bytes_per_window"] = array.nbytes / len(z)
+            yield name, stats
+
+
+def run_benchmarks(ctx, only=None):
+    """Run the registered benchmarks (optionally a subset) and return {name: stats}"""
+    results = {}
+    for key, fn in BENCHMARKS.items():
+        if only and key not in only:
+            continue
+        for name, stats in fn(ctx):
+            results[name] = stats
+            print(f"  {name:<28} median {stats['median_s'] * 1000:10.2f} ms")
+    return results
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Compare many checkpoints in a single pass over the data
+
+Model selection over the epoch checkpoints of a run (ae_epoch*.pt, or the
+ver02 checkpoints/checkpoint_epoch_*.pt written by train.py) used to mean one export_latents_unique.py run per
+checkpoint, each reading and normalizing every image again. Here every batch
+of windows is decoded once, moved to the device once and then pushed
+through all checkpoints in turn. Per checkpoint it records:
+
+  - reconstruction L1, MSE and PSNR of every window
+    -> window_metrics.csv (window, cell_id, start_idx, checkpoint, l1, mse, smoothness)
+  - the mean over all windows -> checkpoint_metrics.csv, sorted by L1
+  - the latent trajectory of every window (spatially pooled for ver02)
+    -> latents/<checkpoint>_z.npy, (N, T_max, C) float16, zero after each
+       window's length, rows in the order of windows.csv / lengths.npy
+
+With ``stacked=True`` checkpoints of the same architecture are evaluated
+together with torch.func: their weights are stacked and one vmap'd
+functional_call runs all of them on the batch. This works for the ver02
+ConvLSTM; the v1 model's nn.LSTM has no vmap batching rule, so v1
+checkpoints always run one after another (still on the same decoded batch).
+Stacking pays off on a GPU that one small model leaves mostly idle; on CPU
+running the checkpoints in turn is usually faster.
+
+Usage:
+    python3 compare_checkpoints.py --checkpoints "ae_epoch*.pt" --index_csv index.csv --num_workers 8
+    python3 compare_checkpoints.py --checkpoints "Autoencoder_Decoder_ver02/checkpoints/checkpoint_epoch_*.pt" \
+        --index_csv Autoencoder_Decoder_ver02/index.csv --stacked
+"""
+
+import argparse
+import copy
+import glob
+import importlib.util
+import re
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+
+VER02_DIR = Path(__file__).parent / "Autoencoder_Decoder_ver02"
+sys.path.append(str(VER02_DIR))
+from length_bucketing import window_lengths, equal_length_batches
+from streaming_scorer import load_model
+
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def checkpoint_paths(patterns):
+    """Checkpoint files matching the patterns, ordered by the numbers in their names (epoch order)"""
+    paths = sorted({p for pattern in patterns for p in (glob.glob(pattern) or [pattern])})
+    return sorted(paths, key=lambda p: [int(n) for n in re.findall(r"\d+", Path(p).name)] or [-1])
+
+
+def load_dataset(index_csv, v1, resize=128):
+    """
+    The dataset the checkpoints were trained with: root dataset_ivf (OpenCV)
+    for v1, Autoencoder_Decoder_ver02/dataset_ivf.py (Pillow) for ver02
+    """
+    if v1:
+        from dataset_ivf import IVFSequenceDataset
+    else:
+        # Both files are called dataset_ivf.py, so import the ver02 one by path
+        spec = importlib.util.spec_from_file_location("ver02_dataset_ivf", VER02_DIR / "dataset_ivf.py")
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        IVFSequenceDataset = module.IVFSequenceDataset
+    return IVFSequenceDataset(index_csv, resize=resize, norm="minmax01")
+
+
+def first_windows(df, n_cells=None):
+    """Positions of the first window of each embryo (the windows export_latents_unique.py encodes)"""
+    rows = np.flatnonzero(~df["cell_id"].duplicated().to_numpy())
+    return rows if n_cells is None else rows[:n_cells]
+
+
+def _outputs(out):
+    """(reconstruction, per-frame latents (B, T, C)) of a v1 tuple or ver02 dict output"""
+    if isinstance(out, dict):
+        return out["reconstruction"], out["z_seq"].mean(dim=(-2, -1))
+    recon, z_seq = out
+    return recon, z_seq
+
+
+def stacked_forward(models):
+    """
+    One function running every model on the same batch via torch.func.vmap
+
+    Returns:
+        forward(vol) -> list of model outputs, or None if the models cannot
+        be stacked (different architectures, or an nn.LSTM inside)
+    """
+    from torch.func import functional_call, stack_module_state, vmap
+    shapes = {tuple((k, tuple(v.shape)) for k, v in m.state_dict().items()) for m in models}
+    if len(models) < 2 or len(shapes) > 1 or any(isinstance(m, nn.LSTM) for m in models[0].modules()):
+        return None
+    params, buffers = stack_module_state(models)
+    base = copy.deepcopy(models[0]).to("meta")  # template only, the weights come from params
+
+    def call(p, b, vol):
+        return _outputs(functional_call(base, (p, b), (vol,)))
+
+    batched = vmap(call, in_dims=(0, 0, None))
+
+    def forward(vol):
+        recon, z = batched(params, buffers, vol)
+        return list(zip(recon.unbind(0), z.unbind(0)))
+    return forward
+
+
+def window_metrics(recon, vol, z):
+    """Per-window L1, MSE and latent smoothness, each (B,)"""
+    recon, z = recon.float(), z.float()
+    dims = tuple(range(1, vol.dim()))
+    l1 = (recon - vol).abs().mean(dim=dims)
+    mse = ((recon - vol) ** 2).mean(dim=dims)
+    if z.shape[1] > 1:
+        smooth = ((z[:, 1:] - z[:, :-1]) ** 2).mean(dim=(1, 2))
+    else:
+        smooth = torch.zeros_like(l1)
+    return l1, mse, smooth
+
+
+def compare_checkpoints(checkpoints, index_csv="index.csv", out_dir="checkpoint_comparison", image_size=128,
+                        batch_size=16, num_workers=0, all_windows=False, n_cells=None, stacked=False,
+                        save_latents=True, amp=True, device=DEVICE):
+    """
+    Evaluate every checkpoint on the same windows with one data pass
+
+    Args:
+        checkpoints: checkpoint paths (v1 and ver02 cannot be mixed: they
+            use different preprocessing)
+        all_windows: every window of the index; default: the first window
+            of each embryo (at most n_cells embryos)
+        stacked: run same-architecture checkpoints together with torch.func.vmap
+        save_latents: write latents/<checkpoint>_z.npy
+
+    Returns:
+        DataFrame of per-checkpoint means, sorted by L1
+    """
+    from torch.utils.data import DataLoader, Subset
+
+    names = [Path(c).stem for c in checkpoints]
+    if len(set(names)) < len(names):
+        raise ValueError("Checkpoint file names must be unique (they name the outputs)")
+    models = [load_model(c).float().to(device).eval() for c in checkpoints]
+    v1 = {type(m).__name__ == "ConvLSTMAE" for m in models}
+    if len(v1) > 1:
+        raise ValueError("Cannot compare v1 and ver02 checkpoints in one run")
+    v1 = v1.pop()
+    forward = stacked_forward(models) if stacked else None
+    if stacked and forward is None:
+        print("Checkpoints cannot be stacked (nn.LSTM or different shapes), running them one after another")
+    use_amp = amp and str(device).startswith("cuda")
+
+    dataset = load_dataset(index_csv, v1, image_size)
+    rows = np.arange(len(dataset)) if all_windows else first_windows(dataset.df, n_cells)
+    lengths = np.asarray(window_lengths(dataset), dtype=np.int64)[rows]
+    N, T_max = len(rows), int(lengths.max())
+    batches = equal_length_batches(lengths, batch_size)
+    loader = DataLoader(Subset(dataset, rows), batch_sampler=batches, num_workers=num_workers,
+                        pin_memory=str(device).startswith("cuda"))
+
+    out_dir = Path(out_dir)
+    (out_dir / "latents").mkdir(parents=True, exist_ok=True)
+    metrics = np.zeros((len(models), 3, N), dtype=np.float64)  # l1, mse, smoothness
+    latents = [None] * len(models)
+    print(f"Comparing {len(models)} checkpoints on {N} windows ({len(batches)} batches)")
+
+    t0 = time.perf_counter()
+    for batch_rows, (vol, _) in zip(batches, loader):
+        T = vol.shape[1]
+        vol = vol.to(device, non_blocking=True)
+        with torch.inference_mode(), torch.autocast("cuda", dtype=torch.bfloat16, enabled=use_amp):
+            outputs = forward(vol) if forward else [_outputs(m(vol)) for m in models]
+        with torch.inference_mode():
+            for k, (recon, z) in enumerate(outputs):
+                for j, value in enumerate(window_metrics(recon, vol, z)):
+                    metrics[k, j, batch_rows] = value.cpu().numpy()
+                if save_latents:
+                    if latents[k] is None:
+                        latents[k] = np.lib.format.open_memmap(
+                            out_dir / "latents" / f"{names[k]}_z.npy", mode="w+",
+                            dtype=np.float16, shape=(N, T_max, z.shape[-1]))
+                        latents[k][:] = 0
+                    latents[k][batch_rows, :T] = z.float().cpu().numpy().astype(np.float16)
+    elapsed = time.perf_counter() - t0
+    for z in latents:
+        if z is not None:
+            z.flush()
+
+    windows = dataset.df.iloc[rows][["cell_id", "start_idx"]].reset_index(drop=True)
+    windows.to_csv(out_dir / "windows.csv", index=False)
+    np.save(out_dir / "lengths.npy", lengths)
+    per_window = pd.concat([
+        windows.assign(window=np.arange(N), checkpoint=name,
+                       l1=metrics[k, 0], mse=metrics[k, 1], smoothness=metrics[k, 2])
+        for k, name in enumerate(names)], ignore_index=True)
+    per_window.to_csv(out_dir / "window_metrics.csv", index=False)
+
+    mean = metrics.mean(axis=2)
+    summary = pd.DataFrame({
+        "checkpoint": names,
+        "path": [str(c) for c in checkpoints],
+        "l1": mean[:, 0],
+        "mse": mean[:, 1],
+        "psnr": 10 * np.log10(1.0 / np.maximum(mean[:, 1], 1e-12)),  # images in [0, 1]
+        "smoothness": mean[:, 2],
+        "num_windows": N,
+    }).sort_values("l1").reset_index(drop=True)
+    summary.to_csv(out_dir / "checkpoint_metrics.csv", index=False)
+
+    print(f"\nOne data pass, {len(models)} checkpoints: {elapsed:.1f}s "
+          f"({elapsed / max(N, 1) * 1000:.1f}ms per window)")
+    print(f"\n{'checkpoint':<28} {'L1':>8} {'MSE':>9} {'PSNR':>7} {'smooth':>9}")
+    for _, r in summary.iterrows():
+        print(f"{r['checkpoint']:<28} {r['l1']:8.4f} {r['mse']:9.5f} {r['psnr']:7.2f} {r['smoothness']:9.5f}")
+    print(f"\nBest by L1: {summary['checkpoint'].iloc[0]}")
+    print(f"Saved: {out_dir}/checkpoint_metrics.csv, window_metrics.csv"
+          + (", latents/*_z.npy" if save_latents else ""))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate many checkpoints with a single pass over the data")
+    parser.add_argument("--checkpoints", nargs="+", default=["ae_epoch*.pt"],
+                        help="Checkpoint files or glob patterns (quote them)")
+    parser.add_argument("--index_csv", type=str, default="index.csv")
+    parser.add_argument("--out", type=str, default="checkpoint_comparison", help="Output directory")
+    parser.add_argument("--image_size", type=int, default=128)
+    parser.add_argument("--batch_size", type=int, default=16, help="Windows per batch")
+    parser.add_argument("--num_workers", type=int, default=0, help="DataLoader processes decoding frames")
+    parser.add_argument("--all_windows", action="store_true",
+                        help="Every window of the index (default: first window of each embryo)")
+    parser.add_argument("--n_cells", type=int, default=None, help="At most this many embryos (first windows)")
+    parser.add_argument("--stacked", action="store_true",
+                        help="Run same-architecture checkpoints together with torch.func.vmap (ver02 only)")
+    parser.add_argument("--no_latents", action="store_true", help="Only the metrics, no latents/*.npy")
+    parser.add_argument("--no_amp", action="store_true", help="Disable bf16 autocast on GPU")
+    args = parser.parse_args()
+
+    checkpoints = checkpoint_paths(args.checkpoints)
+    missing = [c for c in checkpoints if not Path(c).exists()]
+    if missing:
+        parser.error(f"checkpoint not found: {', '.join(missing)}")
+    compare_checkpoints(checkpoints, args.index_csv, args.out, args.image_size, args.batch_size,
+                        args.num_workers, args.all_windows, args.n_cells, args.stacked,
+                        save_latents=not args.no_latents, amp=not args.no_amp)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,185 @@
 # export_latents_unique.py - 只處理不同的胚胎（不重複）
-import numpy as np, torch, pandas as pd
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from torch.utils.data import DataLoader
+import numpy as np, torch
 from dataset_ivf import IVFSequenceDataset
 from model_conv_lstm_ae import ConvLSTMAE
-from sklearn.decomposition import PCA
+from analysis_cache import StageCache, hash_bytes, hash_file
 from pathlib import Path
+import sys
+
+# checkpointing / inference_engine / cpu_inference 在 ver02 目錄中
+sys.path.append(str(Path(__file__).parent / "Autoencoder_Decoder_ver02"))
+from checkpointing import load_model_state
+from inference_engine import InferenceEngine
+from cpu_inference import configure_cpu_threads, calibration_windows, encode_sharded
+from frame_metadata import parse_times
 
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+CACHE_DIR = ".analysis_cache"
+
+def encode_window(model, ds, idx):
+    vol, _ = ds[idx]
+    vol = vol.unsqueeze(0).to(DEVICE)
+    with torch.no_grad():
+        recon, z_seq = model(vol)
+    return z_seq.squeeze(0).cpu().numpy()
+
+def embryo_frame_paths(df, cell_id):
+    # 把同一胚胎所有（重疊的）視窗合併成完整、不重複的影格序列
+    frames = {}
+    for _, row in df[df["cell_id"] == cell_id].iterrows():
+        for k, p in enumerate(row["paths"].split("|")):
+            frames[row["start_idx"] + k] = p
+    return [frames[i] for i in sorted(frames)]
+
+def embryo_frame_times(df, cell_id):
+    # 與 embryo_frame_paths 相同順序的拍攝時間（小時）；索引沒有時間時回傳 None
+    if "times" not in df.columns:
+        return None
+    times = {}
+    for _, row in df[df["cell_id"] == cell_id].iterrows():
+        t = parse_times(row["times"])
+        if t is None:
+            return None
+        for k, v in enumerate(t):
+            times[row["start_idx"] + k] = v
+    return [times[i] for i in sorted(times)]
+
+def encode_whole_embryo(model, ds, paths, chunk=16):
+    # 整段錄影分段編碼，LSTM 狀態接續到下一段：每一幀只編碼一次
+    state, zs = None, []
+    for s in range(0, len(paths), chunk):
+        vol = np.stack([ds._read_gray(p) for p in paths[s:s+chunk]], axis=0)
+        vol = ds._normalize_video(vol)[None, :, None]          # [1,T,1,H,W]
+        with torch.no_grad():
+            z_seq, state = model.encode(torch.from_numpy(vol).to(DEVICE), state, return_state=True)
+        zs.append(z_seq.squeeze(0).cpu().numpy())
+    return np.concatenate(zs, axis=0)                          # [N_frames,128]
+
+def window_key(cache, ds, ckpt_hash, paths, int8=False):
+    params = {"resize": ds.resize, "norm": ds.norm}
+    if int8:
+        params["int8"] = True      # int8 特徵與 fp32 略有差異，分開快取
+    return cache.key("latents", params=params,
+                     checkpoint_hash=ckpt_hash, input_hash=hash_bytes(paths.encode()))
+
+def precompute_first_windows(model, ds, cache, ckpt_hash, n_unique_cells, batch_size=16,
+                             cpu_int8=False, shards=1):
+    # 快取中沒有的「每個胚胎第一個視窗」一次批次編碼（編譯後的推論引擎），之後逐一畫圖時都會命中快取
+    # 位置索引（ds[idx] 用 iloc），不是 DataFrame 的標籤
+    first = np.flatnonzero(~ds.df["cell_id"].duplicated().to_numpy())[:n_unique_cells]
+    todo = [(int(idx), window_key(cache, ds, ckpt_hash, ds.df["paths"].iloc[idx], cpu_int8))
+            for idx in first]
+    todo = [(idx, key) for idx, key in todo if key not in cache]
+    if not todo:
+        return
+    print(f"批次編碼 {len(todo)} 個視窗 (batch_size={batch_size})...")
+    indices = [idx for idx, _ in todo]
+    if DEVICE == "cpu":
+        # CPU：明確設定執行緒、channels_last，可選 int8 卷積與多行程分片
+        print(f"CPU 執行緒: {configure_cpu_threads()}")
+        calibration = calibration_windows(ds) if cpu_int8 else None
+        zs = encode_sharded(model, ds, indices, n_shards=shards, calibration=calibration,
+                            batch_size=batch_size, quantize_dynamic=cpu_int8,
+                            backend="eager" if cpu_int8 else "auto")
+    else:
+        engine = InferenceEngine(model, device=DEVICE)
+        zs = engine.encode_dataset(ds, indices, batch_size=batch_size)
+    for (_, key), z in zip(todo, zs):
+        cache.put(key, z)
+
+def plot_speed(z, times, cell_id, out_dir="latents_unique"):
+    # 速度曲線：有拍攝時間（小時）時為每小時速度，否則為每個時間步
+    import matplotlib.pyplot as plt
+    d = np.linalg.norm(z[1:]-z[:-1], axis=1)
+    if times is not None and np.all(np.diff(times) > 0):
+        x = np.asarray(times[1:])
+        d = d / np.diff(times)
+        xlabel, ylabel = 'Time (h)', 'Speed per hour (||dz||/dt)'
+        mean_speed = np.linalg.norm(z[1:]-z[:-1], axis=1).sum() / (times[-1] - times[0])
+    else:
+        x = np.arange(len(d))
+        xlabel, ylabel = 'Time Step', 'Speed (||z(t+1)-z(t)||)'
+        mean_speed = d.mean()
+
+    plt.figure(figsize=(10, 5))
+    plt.plot(x, d, '-o', color='blue', linewidth=2, markersize=8)
+    plt.fill_between(x, d, alpha=0.3)
+    plt.title(f"Development Speed: {cell_id}", fontsize=14, fontweight='bold')
+    plt.xlabel(xlabel, fontsize=12)
+    plt.ylabel(ylabel, fontsize=12)
+    plt.grid(True, alpha=0.3)
+
+    # 添加平均速度線
+    plt.axhline(y=mean_speed, color='red', linestyle='--', 
+               label=f'Mean: {mean_speed:.4f}')
+    plt.legend()
+    plt.tight_layout()
+    plt.savefig(f"{out_dir}/{cell_id}_speed.png", dpi=150)
+    plt.close()
+
+def export_and_plot_unique(checkpoint="ae_epoch17.pt", n_unique_cells=50, cache_dir=CACHE_DIR,
+                           whole_embryo=False, chunk=16, batch_size=16, cpu_int8=False, shards=1):
+    # 畫圖相關的套件只在這裡載入
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from sklearn.decomposition import PCA
 
-def export_and_plot_unique(checkpoint="ae_epoch17.pt", n_unique_cells=50):
     print(f"載入資料集...")
     ds = IVFSequenceDataset("index.csv", resize=128, norm="minmax01")
-    loader = DataLoader(ds, batch_size=1, shuffle=False)
     
     print(f"載入模型: {checkpoint}")
     model = ConvLSTMAE()
-    model.load_state_dict(torch.load(checkpoint, map_location=DEVICE))
+    # 可直接讀 state_dict、完整訓練 checkpoint 或 fp16 推論檔
+    state, _ = load_model_state(checkpoint, map_location=DEVICE)
+    model.load_state_dict(state)
     model.to(DEVICE)
     model.eval()
     print("✅ 模型載入成功")
 
+    # 特徵快取：以 (checkpoint hash, 輸入影格) 為鍵，不只是 cell_id
+    cache = StageCache(cache_dir)
+    ckpt_hash = hash_file(checkpoint)
+
     print(f"\n尋找 {n_unique_cells} 個不同的胚胎...")
     seen_cells = set()
+    if not whole_embryo:
+        precompute_first_windows(model, ds, cache, ckpt_hash, n_unique_cells, batch_size,
+                                 cpu_int8=cpu_int8 and DEVICE == "cpu", shards=shards)
     
-    for vol, cell_id in loader:
+    # 每個胚胎只讀第一個視窗（跳過的視窗不再解碼影像）
+    for idx in range(len(ds)):
+        row = ds.df.iloc[idx]   # idx 是位置，與 ds[idx] 一致（索引標籤可能不連續）
+        cell_id = row["cell_id"]
         # 跳過已經處理過的胚胎
-        if cell_id[0] in seen_cells:
+        if cell_id in seen_cells:
             continue
         
-        print(f"\n處理胚胎 {len(seen_cells)+1}/{n_unique_cells}: {cell_id[0]}")
-        seen_cells.add(cell_id[0])
+        print(f"\n處理胚胎 {len(seen_cells)+1}/{n_unique_cells}: {cell_id}")
+        seen_cells.add(cell_id)
         
-        vol = vol.to(DEVICE)
-        with torch.no_grad():
-            recon, z_seq = model(vol)
-        z = z_seq.squeeze(0).cpu().numpy()
+        if whole_embryo:
+            # 整個胚胎的完整軌跡（而不只是第一個 16 幀視窗）
+            paths = embryo_frame_paths(ds.df, cell_id)
+            key = cache.key("latents_full", params={"resize": ds.resize, "norm": ds.norm, "chunk": chunk},
+                            checkpoint_hash=ckpt_hash, input_hash=hash_bytes("|".join(paths).encode()))
+            z = cache.get_or_compute(key, lambda: encode_whole_embryo(model, ds, paths, chunk))
+            times = embryo_frame_times(ds.df, cell_id)
+        else:
+            int8 = cpu_int8 and DEVICE == "cpu"
+            z = cache.get(window_key(cache, ds, ckpt_hash, row["paths"], int8)) if int8 else None
+            if z is None:
+                # 逐一補算用 fp32 模型，所以存在 fp32 的鍵下（不能冒充 int8 結果）
+                key = window_key(cache, ds, ckpt_hash, row["paths"])
+                z = cache.get_or_compute(key, lambda: encode_window(model, ds, idx))
+            times = parse_times(row["times"]) if "times" in ds.df.columns else None
         
-        # 儲存特徵
-        np.save(f"latents_unique/{cell_id[0]}_z.npy", z)
+        # 儲存特徵（有拍攝時間時另存 *_t.npy，供每小時速度使用）
+        np.save(f"latents_unique/{cell_id}_z.npy", z)
+        if times is not None:
+            np.save(f"latents_unique/{cell_id}_t.npy", np.asarray(times, dtype=np.float32))
+        else:
+            Path(f"latents_unique/{cell_id}_t.npy").unlink(missing_ok=True)
         print(f"  ✅ 儲存特徵")
 
         # 2D 投影（PCA）
@@ -65,43 +204,27 @@ def export_and_plot_unique(checkpoint="ae_epoch17.pt", n_unique_cells=50):
         plt.scatter(z2[-1,0], z2[-1,1], c='red', s=200, marker='s', 
                    label='End', zorder=5, edgecolors='black', linewidths=2)
         
-        plt.title(f"Latent Trajectory: {cell_id[0]}", fontsize=14, fontweight='bold')
+        plt.title(f"Latent Trajectory: {cell_id}", fontsize=14, fontweight='bold')
         plt.xlabel('PC1', fontsize=12)
         plt.ylabel('PC2', fontsize=12)
         plt.legend()
         plt.grid(True, alpha=0.3)
         plt.tight_layout()
-        plt.savefig(f"latents_unique/{cell_id[0]}_traj.png", dpi=150)
+        plt.savefig(f"latents_unique/{cell_id}_traj.png", dpi=150)
         plt.close()
         print(f"  ✅ 儲存軌跡圖")
 
-        # 速度曲線
-        d = np.linalg.norm(z[1:]-z[:-1], axis=1)
-        
-        plt.figure(figsize=(10, 5))
-        plt.plot(range(len(d)), d, '-o', color='blue', linewidth=2, markersize=8)
-        plt.fill_between(range(len(d)), d, alpha=0.3)
-        plt.title(f"Development Speed: {cell_id[0]}", fontsize=14, fontweight='bold')
-        plt.xlabel('Time Step', fontsize=12)
-        plt.ylabel('Speed (||z(t+1)-z(t)||)', fontsize=12)
-        plt.grid(True, alpha=0.3)
-        
-        # 添加平均速度線
-        mean_speed = d.mean()
-        plt.axhline(y=mean_speed, color='red', linestyle='--', 
-                   label=f'Mean: {mean_speed:.4f}')
-        plt.legend()
-        plt.tight_layout()
-        plt.savefig(f"latents_unique/{cell_id[0]}_speed.png", dpi=150)
-        plt.close()
+        # 速度曲線（有拍攝時間時為每小時速度）
+        plot_speed(z, times, cell_id)
         print(f"  ✅ 儲存速度圖")
         
         if len(seen_cells) >= n_unique_cells:
             break
     
     print(f"\n🎉 完成！共處理 {len(seen_cells)} 個不同的胚胎")
+    print(f"💾 {cache.summary()}")
     print(f"📁 結果儲存在: latents_unique/")
-    print(f"   - 特徵文件: *_z.npy")
+    print(f"   - 特徵文件: *_z.npy（拍攝時間: *_t.npy）")
     print(f"   - 軌跡圖: *_traj.png")
     print(f"   - 速度圖: *_speed.png")
 
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Single command-line entry point for the IVF pipeline
+
+Only the standard library is imported up front. Each subcommand imports what
+it needs when it runs, so `ivf.py index` does not pay for torch, sklearn or
+matplotlib.
+
+Usage:
+    python3 ivf.py index [--v1] [--root data] [--out index.csv] [--variable --min_len 4] [--val_fraction 0.1] [--time_dir DIR] [--exif] [--quality]
+                        [--labels labels.csv]
+                        [--time_step 0.5 [--time_method interp] [--max_gap 1.0]]
+    python3 ivf.py pack [latent_index.py build options]
+    python3 ivf.py train [--v1] [train.py options]
+    python3 ivf.py head --checkpoint best_model.pt [train_head.py options]
+    python3 ivf.py probe --checkpoint best_model.pt [probe.py options]
+    python3 ivf.py score --checkpoint best_model.pt [score_reconstruction.py options]
+    python3 ivf.py compare --checkpoints "ae_epoch*.pt" [compare_checkpoints.py options]
+    python3 ivf.py export [--checkpoint ae_epoch17.pt] [--n_cells 50] [--whole_embryo] [--batch_size 16] [--cpu_int8 --shards 4]
+    python3 ivf.py analyze
+    python3 ivf.py tphate
+    python3 ivf.py bench [benchmarks.run options]
+
+    python3 ivf.py --importtime index ...   # also report the slowest imports
+"""
+import argparse
+import importlib.util
+import re
+import runpy
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent
+VER02_DIR = REPO_ROOT / "Autoencoder_Decoder_ver02"
+
+
+def _load(name, path):
+    """Import a script by path (root and ver02 share module names such as build_index)"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _run_script(path, argv):
+    """Run a script's ``__main__`` block with ``argv`` as its arguments"""
+    sys.argv = [str(path), *argv]
+    sys.path.insert(0, str(Path(path).parent))
+    runpy.run_path(str(path), run_name="__main__")
+
+
+def cmd_index(args):
+    if args.v1:
+        build_index = _load("build_index", REPO_ROOT / "build_index.py")
+    else:
+        sys.path.insert(0, str(VER02_DIR))  # frame_metadata.py
+        build_index = _load("build_index", VER02_DIR / "build_index.py")
+    if args.root:
+        build_index.DATASET_ROOT = Path(args.root) if not args.v1 else args.root
+    if args.variable:
+        if args.v1:
+            sys.exit("--variable is only supported by the ver02 build_index.py")
+        build_index.VARIABLE_LENGTH = True
+        build_index.MIN_T = args.min_len
+    if args.val_fraction is not None:
+        if args.v1:
+            sys.exit("--val_fraction is only supported by the ver02 build_index.py")
+        build_index.VAL_FRACTION = args.val_fraction
+    if args.time_dir or args.exif:
+        if args.v1:
+            sys.exit("--time_dir/--exif are only supported by the ver02 build_index.py")
+        build_index.TIME_ELAPSED_DIR = args.time_dir
+        build_index.USE_EXIF = args.exif
+    if args.quality:
+        if args.v1:
+            sys.exit("--quality is only supported by the ver02 build_index.py")
+        build_index.QUALITY_FILTER = True
+        build_index.QUALITY_WORKERS = args.quality_workers
+    if args.time_step is not None:
+        if args.v1:
+            sys.exit("--time_step is only supported by the ver02 build_index.py")
+        build_index.TIME_STEP_H = args.time_step
+        build_index.TIME_METHOD = args.time_method
+        build_index.MAX_GAP_H = args.max_gap
+    if args.labels:
+        if args.v1:
+            sys.exit("--labels is only supported by the ver02 build_index.py")
+        build_index.LABELS_CSV = args.labels
+    build_index.OUT_CSV = args.out
+    build_index.main()
+
+
+def cmd_pack(args):
+    # Packs the exported latents into the IVF-PQ similarity index
+    _run_script(REPO_ROOT / "latent_index.py", ["build", *args.args])
+
+
+def cmd_train(args):
+    if args.v1:
+        _run_script(REPO_ROOT / "train_ae.py", args.args)
+    else:
+        _run_script(VER02_DIR / "train.py", args.args)
+
+
+def cmd_head(args):
+    _run_script(VER02_DIR / "train_head.py", args.args)
+
+
+def cmd_probe(args):
+    _run_script(VER02_DIR / "probe.py", args.args)
+
+
+def cmd_score(args):
+    _run_script(VER02_DIR / "score_reconstruction.py", args.args)
+
+
+def cmd_compare(args):
+    _run_script(REPO_ROOT / "compare_checkpoints.py", args.args)
+
+
+def cmd_export(args):
+    sys.path.insert(0, str(REPO_ROOT))
+    from export_latents_unique import export_and_plot_unique
+    Path("latents_unique").mkdir(exist_ok=True)
+    export_and_plot_unique(checkpoint=args.checkpoint, n_unique_cells=args.n_cells,
+                           whole_embryo=args.whole_embryo, chunk=args.chunk, batch_size=args.batch_size,
+                           cpu_int8=args.cpu_int8, shards=args.shards)
+
+
+def cmd_analyze(args):
+    sys.path.insert(0, str(REPO_ROOT))
+    from analyze_all_embryos import analyze_all_embryos
+    analyze_all_embryos()
+
+
+def cmd_tphate(args):
+    sys.path.insert(0, str(REPO_ROOT))
+    from tphate_from_existing_latents import main
+    main()
+
+
+def cmd_bench(args):
+    sys.path.insert(0, str(REPO_ROOT))
+    sys.argv = ["benchmarks.run", *args.args]
+    from benchmarks.run import main
+    main()
+
+
+_IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+def report_importtime(argv, top=15):
+    """
+    Re-run ``argv`` under ``python -X importtime`` and summarize the slowest imports
+
+    The run's own stderr is printed after it finishes.
+
+    Returns:
+        exit code of the run
+    """
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", str(Path(__file__).resolve()), *argv],
+                          stderr=subprocess.PIPE, text=True)
+    wall = time.perf_counter() - start
+
+    top_level = []
+    other = []
+    for line in proc.stderr.splitlines():
+        m = _IMPORT_LINE.match(line)
+        if m is None:
+            if not line.startswith("import time:"):
+                other.append(line)
+            continue
+        if not m.group(3):  # not nested inside another import
+            top_level.append((int(m.group(2)), m.group(4)))
+    if other:
+        print("\n".join(other), file=sys.stderr)
+
+    total_ms = sum(us for us, _ in top_level) / 1000
+    print(f"\n{'module':<40} {'cumulative':>12}")
+    for us, name in sorted(top_level, reverse=True)[:top]:
+        print(f"{name:<40} {us / 1000:10.1f}ms")
+    print(f"{'all imports':<40} {total_ms:10.1f}ms")
+    print(f"{'wall time':<40} {wall * 1000:10.1f}ms")
+    return proc.returncode
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="ivf.py", description="IVF embryo pipeline")
+    parser.add_argument("--importtime", action="store_true",
+                        help="Report the slowest module imports of this run (python -X importtime)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("index", help="Build index.csv of frame windows")
+    p.add_argument("--v1", action="store_true", help="Use the root build_index.py (cv2 pipeline)")
+    p.add_argument("--root", type=str, default=None, help="Dataset root (one directory per embryo)")
+    p.add_argument("--out", type=str, default="index.csv")
+    p.add_argument("--variable", action="store_true",
+                   help="Variable-length windows: keep embryos shorter than 16 subsampled frames")
+    p.add_argument("--min_len", type=int, default=4, help="Shortest window kept with --variable")
+    p.add_argument("--val_fraction", type=float, default=None,
+                   help="Fraction of embryos in the validation split (default 0.1, 0 = no split)")
+    p.add_argument("--time_dir", type=str, default=None,
+                   help="Directory of <cell_id>_timeElapsed.csv files (default: search next to the data)")
+    p.add_argument("--exif", action="store_true",
+                   help="Read acquisition times from EXIF/TIFF tags when file names have none (cached)")
+    p.add_argument("--quality", action="store_true",
+                   help="Drop unreadable, blank, out-of-focus and duplicate frames (signatures cached)")
+    p.add_argument("--quality_workers", type=int, default=None,
+                   help="Processes for the frame signatures (default: all cores)")
+    p.add_argument("--time_step", type=float, default=None,
+                   help="Resample every embryo onto a uniform time grid (hours) instead of every 3rd file")
+    p.add_argument("--time_method", type=str, default="nearest", choices=["nearest", "interp"],
+                   help="Frame selection on the time grid")
+    p.add_argument("--max_gap", type=float, default=None,
+                   help="Split recordings at gaps larger than this many hours (default --time_step)")
+    p.add_argument("--labels", type=str, default=None,
+                   help="CSV of cell_id,label joined into a label column for the classifier head")
+    p.set_defaults(func=cmd_index)
+
+    # pack, train, head, probe, score, compare and bench pass all other options (and -h) on to the script
+    p = sub.add_parser("pack", add_help=False,
+                       help="Pack exported latents into the similarity index (latent_index.py build)")
+    p.set_defaults(func=cmd_pack, forward=True)
+
+    p = sub.add_parser("train", add_help=False,
+                       help="Train the ver02 model (train.py) or, with --v1, train_ae.py")
+    p.add_argument("--v1", action="store_true")
+    p.set_defaults(func=cmd_train, forward=True)
+
+    p = sub.add_parser("head", add_help=False,
+                       help="Train the classifier head on cached z_last features (train_head.py)")
+    p.set_defaults(func=cmd_head, forward=True)
+
+    p = sub.add_parser("probe", add_help=False,
+                       help="Linear / MLP / scikit-learn probes on the feature store (probe.py)")
+    p.set_defaults(func=cmd_probe, forward=True)
+
+    p = sub.add_parser("score", add_help=False,
+                       help="Rank embryos by reconstruction error (score_reconstruction.py)")
+    p.set_defaults(func=cmd_score, forward=True)
+
+    p = sub.add_parser("compare", add_help=False,
+                       help="Evaluate many checkpoints in one data pass (compare_checkpoints.py)")
+    p.set_defaults(func=cmd_compare, forward=True)
+
+    p = sub.add_parser("export", help="Export latents and trajectory plots (export_latents_unique.py)")
+    p.add_argument("--checkpoint", type=str, default="ae_epoch17.pt")
+    p.add_argument("--n_cells", type=int, default=50)
+    p.add_argument("--whole_embryo", action="store_true")
+    p.add_argument("--chunk", type=int, default=16)
+    p.add_argument("--batch_size", type=int, default=16, help="Windows per batch of the inference engine")
+    p.add_argument("--cpu_int8", action="store_true",
+                   help="On CPU: int8 per-frame CNN calibrated on the dataset (cpu_inference.py)")
+    p.add_argument("--shards", type=int, default=1, help="On CPU: worker processes, each pinned to a share of the cores")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("analyze", help="Feature table, outliers and plots (analyze_all_embryos.py)")
+    p.set_defaults(func=cmd_analyze)
+
+    p = sub.add_parser("tphate", help="PCA / t-SNE / T-PHATE trajectories (tphate_from_existing_latents.py)")
+    p.set_defaults(func=cmd_tphate)
+
+    p = sub.add_parser("bench", add_help=False, help="Benchmark suite (benchmarks/run.py)")
+    p.set_defaults(func=cmd_bench, forward=True)
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if extra and not getattr(args, "forward", False):
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    args.args = extra
+    if args.importtime:
+        rest = [a for a in argv if a != "--importtime"]
+        sys.exit(report_importtime(rest))
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
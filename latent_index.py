@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+Approximate nearest-neighbour search over exported embryo latents
+
+Two IVF-PQ indexes (inverted file + product quantization, pure NumPy) are
+kept side by side:
+  - frame level:  one vector per timestep, key "<cell_id>:<t>"
+  - embryo level: one mean-pooled vector per embryo, key "<cell_id>"
+
+Latents are read from latents_unique/*_z.npy. New embryos can be added
+without rebuilding, and the coarse quantizer and codebooks are retrained
+automatically once the index has grown well past its training set.
+
+Usage:
+    python3 latent_index.py build --latent_dir latents_unique
+    python3 latent_index.py add --latent_dir latents_unique
+    python3 latent_index.py query AB028-6 -k 10
+    python3 latent_index.py query AB028-6 -k 5 --level frame
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+INDEX_DIR = "latent_index"
+
+
+def _sq_dists(x, c):
+    """Squared L2 distances between rows of x [n,d] and c [k,d]"""
+    d = (x * x).sum(1)[:, None] - 2.0 * (x @ c.T) + (c * c).sum(1)[None, :]
+    return np.maximum(d, 0.0)
+
+
+def _kmeans(x, k, n_iter=20, seed=0):
+    """Lloyd's k-means with k-means++ seeding; returns centroids [k,d]"""
+    rng = np.random.default_rng(seed)
+    n = len(x)
+    k = min(k, n)
+    centroids = np.empty((k, x.shape[1]), dtype=np.float32)
+    centroids[0] = x[rng.integers(n)]
+    closest = _sq_dists(x, centroids[:1])[:, 0]
+    for i in range(1, k):
+        total = closest.sum()
+        idx = rng.choice(n, p=closest / total) if total > 0 else rng.integers(n)
+        centroids[i] = x[idx]
+        closest = np.minimum(closest, _sq_dists(x, centroids[i:i + 1])[:, 0])
+    for _ in range(n_iter):
+        assign = _sq_dists(x, centroids).argmin(1)
+        counts = np.bincount(assign, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+    return centroids
+
+
+class IVFPQIndex:
+    """
+    IVF-PQ index with optional exact re-ranking
+
+    Args:
+        nlist: number of coarse clusters (capped at sqrt of the training size)
+        m: number of PQ sub-quantizers
+        nbits: bits per sub-quantizer code (<= 8)
+        nprobe: clusters visited per query
+        store_vectors: keep float16 copies of the vectors for exact re-ranking
+            and automatic retraining
+        retrain_factor: retrain once the index holds this many times the
+            number of vectors it was trained on
+    """
+
+    def __init__(self, nlist=64, m=16, nbits=8, nprobe=8, store_vectors=True,
+                 retrain_factor=4.0, seed=0):
+        self.nlist = nlist
+        self.m = m
+        self.nbits = nbits
+        self.nprobe = nprobe
+        self.store_vectors = store_vectors
+        self.retrain_factor = retrain_factor
+        self.seed = seed
+
+        self.dim = None
+        self.dsub = None
+        self.centroids = None   # [nlist, d_pad]
+        self.codebooks = None   # [m, ksub, dsub]
+        self.n_trained = 0
+        self.keys = np.empty(0, dtype=str)
+        self.list_ids = np.empty(0, dtype=np.int32)
+        self.codes = np.empty((0, m), dtype=np.uint8)
+        self.vectors = None
+        self._order = None      # rows sorted by list id (rebuilt lazily)
+        self._bounds = None
+        self._rows = None       # key -> row (rebuilt lazily)
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _pad(self, x):
+        x = np.asarray(x, dtype=np.float32).reshape(len(x), -1)
+        d_pad = self.m * self.dsub
+        if x.shape[1] < d_pad:
+            x = np.pad(x, ((0, 0), (0, d_pad - x.shape[1])))
+        return x
+
+    def train(self, x):
+        """Fit the coarse quantizer and PQ codebooks on x [n, dim]"""
+        x = np.asarray(x, dtype=np.float32).reshape(len(x), -1)
+        self.dim = x.shape[1]
+        self.dsub = -(-self.dim // self.m)
+        x = self._pad(x)
+
+        nlist = max(1, min(self.nlist, int(np.sqrt(len(x)))))
+        self.centroids = _kmeans(x, nlist, seed=self.seed)
+        residuals = x - self.centroids[_sq_dists(x, self.centroids).argmin(1)]
+
+        ksub = min(2 ** self.nbits, len(x))
+        sub = residuals.reshape(len(x), self.m, self.dsub)
+        self.codebooks = np.stack([
+            _kmeans(sub[:, j], ksub, seed=self.seed + j) for j in range(self.m)
+        ])
+        self.n_trained = len(x)
+
+    def _encode(self, x):
+        """Coarse assignment and PQ codes for padded vectors"""
+        list_ids = _sq_dists(x, self.centroids).argmin(1).astype(np.int32)
+        sub = (x - self.centroids[list_ids]).reshape(len(x), self.m, self.dsub)
+        codes = np.empty((len(x), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = _sq_dists(sub[:, j], self.codebooks[j]).argmin(1)
+        return list_ids, codes
+
+    def add(self, x, keys):
+        """Insert vectors x [n, dim] under the given keys"""
+        x = np.asarray(x, dtype=np.float32).reshape(len(x), -1)
+        if not self.trained:
+            self.train(x)
+        xp = self._pad(x)
+        list_ids, codes = self._encode(xp)
+        self.keys = np.concatenate([self.keys, np.asarray(keys, dtype=str)])
+        self.list_ids = np.concatenate([self.list_ids, list_ids])
+        self.codes = np.concatenate([self.codes, codes])
+        if self.store_vectors:
+            vec = x.astype(np.float16)
+            self.vectors = vec if self.vectors is None else np.concatenate([self.vectors, vec])
+        self._order = None
+        self._rows = None
+
+        if self.store_vectors and len(self) >= self.retrain_factor * self.n_trained:
+            self.retrain()
+
+    def retrain(self):
+        """Retrain on all stored vectors and re-encode them"""
+        x = self.vectors.astype(np.float32)
+        self.train(x)
+        self.list_ids, self.codes = self._encode(self._pad(x))
+        self._order = None
+
+    def _lists(self):
+        if self._order is None:
+            self._order = np.argsort(self.list_ids, kind="stable")
+            self._bounds = np.searchsorted(self.list_ids[self._order],
+                                           np.arange(len(self.centroids) + 1))
+        return self._order, self._bounds
+
+    def search(self, q, k=10, nprobe=None, rerank=True):
+        """
+        Args:
+            q: (nq, dim) or (dim,) query vectors
+            k: neighbours per query
+            nprobe: clusters visited per query (default: self.nprobe)
+            rerank: re-rank PQ candidates with exact distances
+
+        Returns:
+            keys: (nq, k) neighbour keys ("" where fewer than k were found)
+            dists: (nq, k) Euclidean distances (inf where missing)
+        """
+        q = np.asarray(q, dtype=np.float32).reshape(-1, self.dim)
+        qp = self._pad(q)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        order, bounds = self._lists()
+        probe = np.argsort(_sq_dists(qp, self.centroids), axis=1)[:, :nprobe]
+        n_cand = k * 4 if (rerank and self.vectors is not None) else k
+        m_idx = np.arange(self.m)[None, :]
+
+        out_keys = np.full((len(q), k), "", dtype=self.keys.dtype if len(self) else "<U1")
+        out_dists = np.full((len(q), k), np.inf, dtype=np.float32)
+        for i in range(len(q)):
+            rows, adc = [], []
+            for l in probe[i]:
+                r = order[bounds[l]:bounds[l + 1]]
+                if len(r) == 0:
+                    continue
+                # Asymmetric distance table for this list's residual: [m, ksub]
+                res = (qp[i] - self.centroids[l]).reshape(self.m, 1, self.dsub)
+                table = ((self.codebooks - res) ** 2).sum(-1)
+                rows.append(r)
+                adc.append(table[m_idx, self.codes[r]].sum(1))
+            if not rows:
+                continue
+            rows = np.concatenate(rows)
+            adc = np.concatenate(adc)
+            if len(rows) > n_cand:
+                top = np.argpartition(adc, n_cand)[:n_cand]
+                rows, adc = rows[top], adc[top]
+            if rerank and self.vectors is not None:
+                diff = self.vectors[rows].astype(np.float32) - q[i]
+                adc = (diff * diff).sum(1)
+            top = np.argsort(adc)[:k]
+            out_keys[i, :len(top)] = self.keys[rows[top]]
+            out_dists[i, :len(top)] = np.sqrt(np.maximum(adc[top], 0.0))
+        return out_keys, out_dists
+
+    def get_vectors(self, keys):
+        """Stored (float16-rounded) vectors for the given keys"""
+        if self._rows is None:
+            self._rows = {key: i for i, key in enumerate(self.keys)}
+        return self.vectors[[self._rows[key] for key in keys]].astype(np.float32)
+
+    def save(self, path):
+        config = {k: getattr(self, k) for k in (
+            "nlist", "m", "nbits", "nprobe", "store_vectors", "retrain_factor",
+            "seed", "dim", "n_trained")}
+        if self.trained:
+            centroids, codebooks = self.centroids, self.codebooks
+        else:
+            # Empty index: (0, d) arrays, since None would need allow_pickle to load
+            d_pad = self.m * self.dsub if self.dim else 0
+            centroids = np.empty((0, d_pad), dtype=np.float32)
+            codebooks = np.empty((self.m, 0, self.dsub or 0), dtype=np.float32)
+        arrays = {
+            "centroids": centroids, "codebooks": codebooks,
+            "keys": self.keys, "list_ids": self.list_ids, "codes": self.codes,
+            "config": np.array(json.dumps(config)),
+        }
+        if self.vectors is not None:
+            arrays["vectors"] = self.vectors
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=False)
+        config = json.loads(str(data["config"]))
+        dim, n_trained = config.pop("dim"), config.pop("n_trained")
+        index = cls(**config)
+        index.dim = dim
+        index.dsub = -(-dim // index.m) if dim else None
+        index.n_trained = n_trained
+        if len(data["centroids"]):
+            index.centroids = data["centroids"]
+            index.codebooks = data["codebooks"]
+        index.keys = data["keys"]
+        index.list_ids = data["list_ids"]
+        index.codes = data["codes"]
+        index.vectors = data["vectors"] if "vectors" in data else None
+        return index
+
+
+def frame_vectors(z):
+    """Per-frame vectors from a latent trajectory: [T, D] or [T, C, H, W] -> [T, D]"""
+    z = np.asarray(z, dtype=np.float32)
+    if z.ndim == 4:
+        z = z.mean(axis=(2, 3))  # spatial average pooling (ver02 z_seq)
+    return z.reshape(len(z), -1)
+
+
+class EmbryoLatentIndex:
+    """Frame-level and embryo-level IVF-PQ indexes over exported latents"""
+
+    def __init__(self, index_dir=INDEX_DIR, **index_kwargs):
+        self.index_dir = Path(index_dir)
+        self.frames = IVFPQIndex(**index_kwargs)
+        self.embryos = IVFPQIndex(**index_kwargs)
+
+    @classmethod
+    def load(cls, index_dir=INDEX_DIR):
+        index = cls(index_dir)
+        index.frames = IVFPQIndex.load(index.index_dir / "frames.npz")
+        index.embryos = IVFPQIndex.load(index.index_dir / "embryos.npz")
+        return index
+
+    def save(self):
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.frames.save(self.index_dir / "frames.npz")
+        self.embryos.save(self.index_dir / "embryos.npz")
+
+    @property
+    def cell_ids(self):
+        return set(self.embryos.keys.tolist())
+
+    def add_latents(self, latents):
+        """Insert a {cell_id: z} dict; embryos already indexed are skipped"""
+        known = self.cell_ids
+        latents = {c: z for c, z in latents.items() if c not in known}
+        if not latents:
+            return 0
+        frames, frame_keys, pooled = [], [], []
+        for cell_id, z in latents.items():
+            f = frame_vectors(z)
+            frames.append(f)
+            frame_keys += [f"{cell_id}:{t}" for t in range(len(f))]
+            pooled.append(f.mean(0))
+        self.frames.add(np.concatenate(frames), frame_keys)
+        self.embryos.add(np.stack(pooled), list(latents))
+        return len(latents)
+
+    def add_from_dir(self, latent_dir="latents_unique"):
+        """Insert every *_z.npy in latent_dir that is not indexed yet"""
+        known = self.cell_ids
+        latents = {}
+        for z_file in sorted(Path(latent_dir).glob("*_z.npy")):
+            cell_id = z_file.stem[:-len("_z")]
+            if cell_id not in known:
+                latents[cell_id] = np.load(z_file)
+        return self.add_latents(latents)
+
+    def query(self, target, k=10, level="embryo", nprobe=None):
+        """
+        Find the embryos (or frames) closest to a cell_id or a latent vector
+
+        Args:
+            target: an indexed cell_id, or a vector ([D] pooled, or [T, D] frames)
+            k: number of neighbours
+            level: "embryo" (pooled latents) or "frame" (per-timestep latents)
+
+        Returns:
+            keys, dists: (nq, k) arrays; a cell_id query excludes the embryo itself
+        """
+        index = self.embryos if level == "embryo" else self.frames
+        exclude = None
+        if isinstance(target, str):
+            exclude = target
+            if level == "embryo":
+                q = self.embryos.get_vectors([target])
+            else:
+                frame_keys = [key for key in self.frames.keys if key.rsplit(":", 1)[0] == target]
+                frame_keys.sort(key=lambda key: int(key.rsplit(":", 1)[1]))
+                q = self.frames.get_vectors(frame_keys)
+        else:
+            q = frame_vectors(np.atleast_2d(target))
+            if level == "embryo":
+                q = q.mean(0, keepdims=True)
+
+        # Over-fetch so the query embryo's own entries can be dropped
+        extra = 0 if exclude is None else (1 if level == "embryo" else len(q))
+        keys, dists = index.search(q, k=k + extra, nprobe=nprobe)
+        if exclude is None:
+            return keys[:, :k], dists[:, :k]
+        cells = np.char.partition(keys.astype(str), ":")[..., 0]
+        keep = cells != exclude
+        out_keys = np.full((len(q), k), "", dtype=keys.dtype)
+        out_dists = np.full((len(q), k), np.inf, dtype=np.float32)
+        for i in range(len(q)):
+            sel_k, sel_d = keys[i][keep[i]][:k], dists[i][keep[i]][:k]
+            out_keys[i, :len(sel_k)] = sel_k
+            out_dists[i, :len(sel_d)] = sel_d
+        return out_keys, out_dists
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ANN index over embryo latents")
+    parser.add_argument("--index_dir", type=str, default=INDEX_DIR,
+                        help="Directory holding the index files")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_build = sub.add_parser("build", help="Build a new index from exported latents")
+    p_build.add_argument("--latent_dir", type=str, default="latents_unique")
+    p_build.add_argument("--nlist", type=int, default=64)
+    p_build.add_argument("--m", type=int, default=16)
+    p_build.add_argument("--nprobe", type=int, default=8)
+
+    p_add = sub.add_parser("add", help="Insert newly exported embryos")
+    p_add.add_argument("--latent_dir", type=str, default="latents_unique")
+
+    p_query = sub.add_parser("query", help="Nearest neighbours of an embryo or vector")
+    p_query.add_argument("target", type=str, help="cell_id, or path to a .npy vector")
+    p_query.add_argument("-k", type=int, default=10)
+    p_query.add_argument("--level", choices=["embryo", "frame"], default="embryo")
+    p_query.add_argument("--nprobe", type=int, default=None)
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        index = EmbryoLatentIndex(args.index_dir, nlist=args.nlist, m=args.m, nprobe=args.nprobe)
+        n = index.add_from_dir(args.latent_dir)
+        index.save()
+        print(f"✓ Indexed {n} embryos ({len(index.frames)} frames) -> {args.index_dir}")
+    elif args.command == "add":
+        index = EmbryoLatentIndex.load(args.index_dir)
+        n = index.add_from_dir(args.latent_dir)
+        index.save()
+        print(f"✓ Added {n} embryos, index now holds {len(index.embryos)} embryos")
+    else:
+        index = EmbryoLatentIndex.load(args.index_dir)
+        target = args.target
+        if target.endswith(".npy") and Path(target).exists():
+            target = np.load(target)
+        start = time.perf_counter()
+        keys, dists = index.query(target, k=args.k, level=args.level, nprobe=args.nprobe)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        for qi in range(len(keys)):
+            if len(keys) > 1:
+                print(f"frame t{qi}:")
+            for rank, (key, dist) in enumerate(zip(keys[qi], dists[qi]), 1):
+                if key:
+                    print(f"  {rank:2d}. {key}  dist={dist:.4f}")
+        print(f"query time: {elapsed_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
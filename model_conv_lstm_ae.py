@@ -1,5 +1,6 @@
 # model_conv_lstm_ae.py
 import torch, torch.nn as nn
+import torch.nn.functional as F
 
 class FrameEncoder(nn.Module):
     def __init__(self, out_dim=128):
@@ -11,7 +12,7 @@ class FrameEncoder(nn.Module):
             nn.AdaptiveAvgPool2d(1),  # -> [B,128,1,1]
         )
         self.proj = nn.Linear(128, out_dim)
-    def forward(self, x):             # x: [B,1,128,128]
+    def forward(self, x):             # x: [B,1,H,W]（任意大小，最後是全域平均池化）
         h = self.net(x).squeeze(-1).squeeze(-1)  # [B,128]
         return self.proj(h)           # [B,out_dim]
 
@@ -25,9 +26,12 @@ class FrameDecoder(nn.Module):
             nn.ConvTranspose2d(32,16,4,2,1), nn.ReLU(),   # 64x64
             nn.ConvTranspose2d(16,1,4,2,1), nn.Sigmoid()  # 128x128
         )
-    def forward(self, z):             # z: [B,128]
+    def forward(self, z, size=(128,128)):  # z: [B,128]；size 需為 16 的倍數
         x = self.fc(z).view(-1,128,8,8)
-        return self.deconv(x)         # [B,1,128,128]
+        if tuple(size) != (128,128):
+            # 其他解析度：把 8x8 種子網格插值成 (H/16, W/16)，反卷積權重不變
+            x = F.interpolate(x, size=(size[0]//16, size[1]//16), mode="bilinear", align_corners=False)
+        return self.deconv(x)         # [B,1,H,W]
 
 class ConvLSTMAE(nn.Module):
     def __init__(self, emb=128, lstm_hid=128):
@@ -37,16 +41,25 @@ class ConvLSTMAE(nn.Module):
         self.lstm_dec = nn.LSTM(input_size=lstm_hid, hidden_size=lstm_hid, batch_first=True)
         self.dec = FrameDecoder(in_dim=lstm_hid)
 
-    def forward(self, vol):           # vol: [B,T,1,128,128]
-        B,T,_,_,_ = vol.shape
-        f = self.enc(vol.view(B*T,1,128,128))     # [B*T,emb]
+    def encode(self, vol, state=None, return_state=False):
+        # 只編碼；state=(h,c) 各為 [1,B,lstm_hid]，可把上一段的狀態接下去
+        # 長序列分段編碼時每一幀只算一次
+        B,T,_,H,W = vol.shape
+        f = self.enc(vol.reshape(B*T,1,H,W))      # [B*T,emb]
         f = f.view(B,T,-1)                        # [B,T,emb]
-        z_seq, _ = self.lstm_enc(f)               # [B,T,lstm_hid]
+        z_seq, state = self.lstm_enc(f, state)    # [B,T,lstm_hid]
+        if return_state:
+            return z_seq, state
+        return z_seq
+
+    def forward(self, vol):           # vol: [B,T,1,H,W]
+        B,T,_,H,W = vol.shape
+        z_seq = self.encode(vol)                  # [B,T,lstm_hid]
         # 解碼：逐幀
         h_dec, _ = self.lstm_dec(z_seq)           # [B,T,lstm_hid]
         recon = []
         for t in range(T):
-            recon.append(self.dec(h_dec[:,t,:]))  # [B,1,128,128]
-        recon = torch.stack(recon, dim=1)         # [B,T,1,128,128]
+            recon.append(self.dec(h_dec[:,t,:], (H,W)))  # [B,1,H,W]
+        recon = torch.stack(recon, dim=1)         # [B,T,1,H,W]
         return recon, z_seq                       # recon, latent per frame
 
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Streaming anomaly scoring for embryos while frames are still arriving
+
+Each well keeps its own recurrent encoder state: the (h, c) of the v1
+nn.LSTM, or the per-layer (h, c) of the ver02 ConvLSTM. Only the new frame
+is encoded, so the cost of a new frame does not depend on how long the
+embryo has been imaged. Speed and trajectory statistics are updated
+incrementally per embryo. Each embryo is then scored against running
+population statistics:
+  - Welford mean/std of mean speed and trajectory length over all embryos
+    that have reached the same number of steps (the streaming equivalent
+    of the batch ±2σ rule in analyze_all_embryos.py, which compares
+    equal-length windows)
+  - a P² estimate of the upper quantile of single-step speeds, to flag
+    sudden jumps
+
+Note: frames are normalized one at a time (1st-99th percentile). Training
+normalizes per sequence, but a streaming scorer cannot see the whole
+sequence.
+
+Usage (replays a dataset directory as if frames arrived in real time):
+    python3 streaming_scorer.py --checkpoint ae_epoch17.pt --frames_root data
+"""
+
+import argparse
+import math
+import sys
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+VER02_DIR = Path(__file__).parent / "Autoencoder_Decoder_ver02"
+
+
+class RunningStats:
+    """Welford running mean/variance"""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else 0.0
+
+    def zscore(self, x):
+        std = self.std
+        return (x - self.mean) / std if std > 0 else 0.0
+
+
+class P2Quantile:
+    """P² streaming quantile estimator (Jain & Chlamtac, 1985)"""
+
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        self.q = []                                   # marker heights
+        self.n = [0, 1, 2, 3, 4]                      # marker positions
+        self.np = [0, 2 * p, 4 * p, 2 + 2 * p, 4]     # desired positions
+        self.dn = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        self.count += 1
+        if len(self.q) < 5:
+            self.q.append(x)
+            self.q.sort()
+            return
+        q, n = self.q, self.n
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.np[i] += self.dn[i]
+        for i in range(1, 4):
+            d = self.np[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                # Piecewise-parabolic prediction, linear if it leaves the bracket
+                qp = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = qp
+                n[i] += d
+
+    @property
+    def value(self):
+        if not self.q:
+            return float("nan")
+        if len(self.q) < 5:
+            return float(np.quantile(self.q, self.p))
+        return self.q[2]
+
+
+class V1StepEncoder:
+    """One-frame-at-a-time encoder for the v1 ConvLSTMAE (FrameEncoder + nn.LSTM)"""
+
+    def __init__(self, model):
+        self.model = model
+
+    def step(self, frames, states):
+        """
+        Args:
+            frames: (B, 1, H, W) newest frame of each embryo
+            states: list of B (h, c) tuples, each (1, 1, hid), or None for a new embryo
+
+        Returns:
+            z: (B, hid) latent of the new frame, new_states: list of B (h, c)
+        """
+        hid = self.model.lstm_enc.hidden_size
+        zeros = torch.zeros(1, 1, hid, device=frames.device)
+        states = [s if s is not None else (zeros, zeros) for s in states]
+        h = torch.cat([s[0] for s in states], dim=1)
+        c = torch.cat([s[1] for s in states], dim=1)
+        z_seq, (h, c) = self.model.encode(frames[:, None], (h, c), return_state=True)
+        new_states = [(h[:, b:b + 1], c[:, b:b + 1]) for b in range(len(states))]
+        return z_seq[:, 0], new_states
+
+
+class V2StepEncoder:
+    """One-frame-at-a-time encoder for the ver02 ConvLSTMAutoencoder"""
+
+    def __init__(self, model):
+        self.model = model
+
+    def step(self, frames, states):
+        """
+        Args:
+            frames: (B, 1, H, W) newest frame of each embryo
+            states: list of B per-layer [(h, c), ...] lists, or None for a new embryo
+
+        Returns:
+            z: (B, C*H'*W') flattened latent of the new frame, new_states
+        """
+        encoder = self.model.encoder
+        states = [s if s is not None else encoder.init_state(1, frames.shape[-2:])
+                  for s in states]
+        n_layers = len(states[0])
+        hidden_state = [(torch.cat([s[l][0] for s in states]), torch.cat([s[l][1] for s in states]))
+                        for l in range(n_layers)]
+        _, z_last, layer_states = self.model.encode(frames[:, None], hidden_state, return_state=True)
+        new_states = [[(h[b:b + 1], c[b:b + 1]) for h, c in layer_states]
+                      for b in range(len(states))]
+        return z_last.flatten(1), new_states
+
+
+class EmbryoStream:
+    """Incremental per-embryo trajectory statistics"""
+
+    def __init__(self):
+        self.state = None
+        self.n_frames = 0
+        self.z_first = None
+        self.z_prev = None
+        self.speed = RunningStats()
+        self.max_speed = 0.0
+        self.traj_length = 0.0
+
+    def update(self, z):
+        """Add the latent of a new frame; returns the step speed (None for the first frame)"""
+        self.n_frames += 1
+        if self.z_prev is None:
+            self.z_first = z
+            self.z_prev = z
+            return None
+        d = float(np.linalg.norm(z - self.z_prev))
+        self.z_prev = z
+        self.speed.add(d)
+        self.max_speed = max(self.max_speed, d)
+        self.traj_length += d
+        return d
+
+    @property
+    def start_end_dist(self):
+        return float(np.linalg.norm(self.z_prev - self.z_first)) if self.z_first is not None else 0.0
+
+
+class StreamingAnomalyScorer:
+    """
+    Per-well streaming encoder plus population-relative anomaly scores
+
+    Args:
+        model: trained v1 ConvLSTMAE or ver02 ConvLSTMAutoencoder
+        z_threshold: |z| above which an embryo is flagged (2.0 = the batch ±2σ rule)
+        step_quantile: quantile of single-step speeds above which a step is flagged
+        min_population: embryos needed before population scores are reported
+    """
+
+    def __init__(self, model, device=DEVICE, z_threshold=2.0, step_quantile=0.975,
+                 min_population=10):
+        self.model = model.to(device).eval()
+        self.device = device
+        self.encoder = V2StepEncoder(model) if hasattr(model, "encoder") else V1StepEncoder(model)
+        self.z_threshold = z_threshold
+        self.min_population = min_population
+        self.embryos = {}
+        # Population statistics per step count: trajectory length grows with
+        # time, so embryos are only compared at the same number of steps
+        self.pop_by_step = {}
+        self.step_speed_q = P2Quantile(step_quantile)
+
+    def update(self, cell_id, frame):
+        """Encode one new frame (1, H, W) of one embryo and score it"""
+        return self.update_batch([cell_id], frame[None])[0]
+
+    def update_batch(self, cell_ids, frames):
+        """
+        Encode the newest frame of several embryos in one forward pass
+
+        Args:
+            cell_ids: list of B distinct cell ids
+            frames: (B, 1, H, W) tensor, one frame per embryo
+
+        Returns:
+            list of B score dicts
+        """
+        streams = [self.embryos.setdefault(c, EmbryoStream()) for c in cell_ids]
+        with torch.inference_mode():
+            z, new_states = self.encoder.step(frames.to(self.device),
+                                              [s.state for s in streams])
+        z = z.float().cpu().numpy()
+
+        results = []
+        for b, (cell_id, stream) in enumerate(zip(cell_ids, streams)):
+            stream.state = new_states[b]
+            d = stream.update(z[b])
+            step_flag = False
+            if d is not None:
+                step_flag = self.step_speed_q.count >= 20 and d > self.step_speed_q.value
+                self.step_speed_q.add(d)
+                mean_speed, traj_length = self.pop_by_step.setdefault(
+                    stream.speed.n, (RunningStats(), RunningStats()))
+                mean_speed.add(stream.speed.mean)
+                traj_length.add(stream.traj_length)
+            results.append(self.score(cell_id, step_speed=d, step_flag=step_flag))
+        return results
+
+    def score(self, cell_id, step_speed=None, step_flag=False):
+        """Current score of one embryo against the population"""
+        s = self.embryos[cell_id]
+        out = {
+            "cell_id": cell_id,
+            "n_frames": s.n_frames,
+            "step_speed": step_speed,
+            "mean_speed": s.speed.mean,
+            "std_speed": s.speed.std,
+            "max_speed": s.max_speed,
+            "traj_length": s.traj_length,
+            "start_end_dist": s.start_end_dist,
+            "mean_speed_z": 0.0,
+            "traj_length_z": 0.0,
+            "step_flag": bool(step_flag),
+            "anomalous": False,
+        }
+        pop = self.pop_by_step.get(s.speed.n)
+        if pop is not None and pop[0].n >= self.min_population:
+            out["mean_speed_z"] = pop[0].zscore(s.speed.mean)
+            out["traj_length_z"] = pop[1].zscore(s.traj_length)
+            out["anomalous"] = (abs(out["mean_speed_z"]) > self.z_threshold
+                                or out["traj_length_z"] > self.z_threshold)
+        return out
+
+    def scores(self):
+        return [self.score(c) for c in self.embryos]
+
+
+def load_frame(path, resize=128):
+    """Read one grayscale frame and normalize it on its own -> (1, H, W) float tensor"""
+    img = Image.open(path).convert("L").resize((resize, resize), Image.BILINEAR)
+    arr = np.asarray(img, dtype=np.float32)
+    lo, hi = np.percentile(arr, 1), np.percentile(arr, 99)
+    arr = np.clip((arr - lo) / (hi - lo + 1e-6), 0, 1)
+    return torch.from_numpy(arr)[None]
+
+
+def load_model(checkpoint):
+    """Load a v1 state_dict, a ver02 training checkpoint or an fp16 inference artifact"""
+    ckpt = torch.load(checkpoint, map_location="cpu")
+    if isinstance(ckpt, dict) and ckpt.get("model_class") == "ConvLSTMAE":
+        ckpt = ckpt["model_state_dict"]
+    if isinstance(ckpt, dict) and "model_state_dict" in ckpt:
+        sys.path.append(str(VER02_DIR))
+        from model import ConvLSTMAutoencoder
+        state = ckpt["model_state_dict"]
+        config = ckpt.get("model_config") or {
+            "seq_len": ckpt.get("config", {}).get("seq_len", 20),
+            "use_classifier": any(k.startswith("classifier.") for k in state),
+        }
+        model = ConvLSTMAutoencoder(**config)
+        model.load_state_dict(state)
+    else:
+        from model_conv_lstm_ae import ConvLSTMAE
+        model = ConvLSTMAE()
+        model.load_state_dict(ckpt)
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay timelapse folders through the streaming scorer")
+    parser.add_argument("--checkpoint", type=str, default="ae_epoch17.pt")
+    parser.add_argument("--frames_root", type=str, default="data",
+                        help="Directory with one sub-directory of frames per embryo")
+    parser.add_argument("--subsample", type=int, default=3, help="Use every n-th frame")
+    parser.add_argument("--resize", type=int, default=128)
+    parser.add_argument("--out_csv", type=str, default="streaming_scores.csv")
+    args = parser.parse_args()
+
+    from build_index import list_frames
+    import pandas as pd
+
+    scorer = StreamingAnomalyScorer(load_model(args.checkpoint))
+    cells = {p.name: list_frames(p)[::args.subsample]
+             for p in sorted(Path(args.frames_root).iterdir()) if p.is_dir()}
+    n_steps = max((len(f) for f in cells.values()), default=0)
+    print(f"Replaying {len(cells)} embryos, up to {n_steps} frames each")
+
+    # Frames of all wells arrive interleaved: step t delivers frame t of each embryo
+    flagged = set()
+    for t in range(n_steps):
+        ids = [c for c, frames in cells.items() if t < len(frames)]
+        frames = torch.stack([load_frame(cells[c][t], args.resize) for c in ids])
+        for r in scorer.update_batch(ids, frames):
+            if r["anomalous"] and r["cell_id"] not in flagged:
+                flagged.add(r["cell_id"])
+                print(f"⚠️  t={t}: {r['cell_id']} mean_speed_z={r['mean_speed_z']:.2f} "
+                      f"traj_length_z={r['traj_length_z']:.2f}")
+
+    pd.DataFrame(scorer.scores()).to_csv(args.out_csv, index=False)
+    print(f"✓ Wrote {args.out_csv} ({len(flagged)} embryos flagged during replay)")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,12 @@ Apply T-PHATE to existing latent vectors (extracted with correct sampling)
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
 from pathlib import Path
 import os
 from glob import glob
+from analysis_cache import StageCache, hash_array
+
+CACHE_DIR = ".analysis_cache"
 
 def apply_pca(data, n_components=2):
     """Apply PCA for dimensionality reduction"""
@@ -93,16 +95,17 @@ def apply_diffusion(kernel_matrix, t=1):
     print(f"Diffusion applied: t={t}")
     return diffused_matrix
 
-def apply_phate_embedding(diffused_matrix, n_components=2):
-    """Apply PHATE embedding using MDS"""
-    print("Applying PHATE embedding...")
-    
+def compute_potential(diffused_matrix):
+    """Diffusion potential: symmetrized -log of the diffused operator"""
     epsilon = 1e-6
     potential_matrix = -np.log(diffused_matrix + epsilon)
     
     # Ensure matrix is symmetric
     potential_matrix = (potential_matrix + potential_matrix.T) / 2
-    
+    return potential_matrix
+
+def embed_potential(potential_matrix, n_components=2):
+    """Metric MDS on the diffusion potential"""
     from sklearn.manifold import MDS
     mds = MDS(n_components=n_components, dissimilarity='precomputed', random_state=42)
     embedding = mds.fit_transform(potential_matrix)
@@ -110,24 +113,57 @@ def apply_phate_embedding(diffused_matrix, n_components=2):
     print(f"PHATE embedding shape: {embedding.shape}")
     return embedding
 
-def apply_tphate(data, n_components=2, k=5, decay=40, t=1, n_pca=None):
-    """Apply the complete T-PHATE algorithm"""
+def apply_phate_embedding(diffused_matrix, n_components=2):
+    """Apply PHATE embedding using MDS"""
+    print("Applying PHATE embedding...")
+    return embed_potential(compute_potential(diffused_matrix), n_components=n_components)
+
+def apply_tphate(data, n_components=2, k=5, decay=40, t=1, n_pca=None, cache=None):
+    """
+    Apply the complete T-PHATE algorithm
+
+    With a StageCache, the graph, diffusion, potential and embedding stages
+    are memoized separately. Keys are chained, so changing e.g. ``t`` only
+    recomputes diffusion and the stages after it.
+    """
     print("Applying T-PHATE algorithm...")
     
+    if cache is None:
+        cache = StageCache(enabled=False)
+    
+    # Keys depend only on parameters and upstream keys, so they can all be
+    # computed up front; upstream results are only loaded when needed
+    graph_key = cache.key("knn_graph", {"k": k, "decay": decay, "n_pca": n_pca},
+                          input_hash=hash_array(data))
+    diffusion_key = cache.key("diffusion", {"t": t}, input_hash=graph_key)
+    potential_key = cache.key("potential", input_hash=diffusion_key)
+    embedding_key = cache.key("tphate_embedding", {"n_components": n_components},
+                              input_hash=potential_key)
+    
     # Step 1: Build adaptive graph
-    kernel_matrix = build_adaptive_graph(data, k=k, decay=decay, n_pca=n_pca)
+    def kernel_matrix():
+        return cache.get_or_compute(
+            graph_key, lambda: build_adaptive_graph(data, k=k, decay=decay, n_pca=n_pca))
     
     # Step 2: Apply diffusion
-    diffused_matrix = apply_diffusion(kernel_matrix, t=t)
+    def diffused_matrix():
+        return cache.get_or_compute(
+            diffusion_key, lambda: apply_diffusion(kernel_matrix(), t=t))
     
     # Step 3: Apply PHATE embedding
-    embedding = apply_phate_embedding(diffused_matrix, n_components=n_components)
+    def potential_matrix():
+        return cache.get_or_compute(
+            potential_key, lambda: compute_potential(diffused_matrix()))
+    
+    embedding = cache.get_or_compute(
+        embedding_key, lambda: embed_potential(potential_matrix(), n_components=n_components))
     
     print("T-PHATE completed successfully!")
     return embedding
 
 def plot_trajectory(z_embedding, cell_id, method="PCA", save_path=None):
     """Plot trajectory with clear visualization"""
+    import matplotlib.pyplot as plt
     print(f"Creating {method} trajectory plot...")
     
     plt.figure(figsize=(12, 10))
@@ -195,6 +231,8 @@ def main():
     
     print(f"Found {len(latent_files)} latent vector files")
     
+    cache = StageCache(CACHE_DIR)
+    
     # Process first 5 embryos
     for i, latent_file in enumerate(latent_files[:5]):
         cell_id = Path(latent_file).stem.replace('_z', '')
@@ -205,14 +243,20 @@ def main():
             z_latent = np.load(latent_file)
             print(f"Loaded latent vectors shape: {z_latent.shape}")
             
+            z_hash = hash_array(z_latent)
+            
             # Apply PCA
-            z_pca = apply_pca(z_latent, n_components=2)
+            z_pca = cache.get_or_compute(
+                cache.key("pca", {"n_components": 2}, input_hash=z_hash),
+                lambda: apply_pca(z_latent, n_components=2))
             
             # Apply t-SNE
-            z_tsne = apply_tsne(z_latent, n_components=2)
+            z_tsne = cache.get_or_compute(
+                cache.key("tsne", {"n_components": 2, "random_state": 42}, input_hash=z_hash),
+                lambda: apply_tsne(z_latent, n_components=2))
             
             # Apply T-PHATE
-            z_tphate = apply_tphate(z_latent, n_components=2, k=5, t=1)
+            z_tphate = apply_tphate(z_latent, n_components=2, k=5, t=1, cache=cache)
             
             # Plot trajectories
             plot_trajectory(z_pca, cell_id, "PCA", 
@@ -230,6 +274,7 @@ def main():
     
     print(f"\n=== Analysis Complete ===")
     print(f"Generated plots saved in: {output_dir}")
+    print(cache.summary())
     print(f"Total plots generated: {len(list(output_dir.glob('*.png')))}")
 
 if __name__ == "__main__":
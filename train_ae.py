@@ -1,35 +1,116 @@
 # train_ae.py
+import argparse, json, sys
+from pathlib import Path
 import torch, torch.nn as nn
 from torch.utils.data import DataLoader
 from dataset_ivf import IVFSequenceDataset
 from model_conv_lstm_ae import ConvLSTMAE
 from tqdm import tqdm
 
+# step_profiler 在 ver02 目录中
+sys.path.append(str(Path(__file__).parent / "Autoencoder_Decoder_ver02"))
+from step_profiler import StepProfiler
+from autotune import autotune
+from checkpointing import (CheckpointManager, ResumableSampler, capture_rng_state,
+                           restore_rng_state, inference_state)
+
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 
-def train():
+RESUME_FILE = "ae_resume.pt"
+
+def train(profile=False, trace_dir=None, use_autotune=False, resume=False, keep_last=5, ckpt_every=0):
     ds = IVFSequenceDataset("index.csv", resize=128, norm="minmax01")
-    loader = DataLoader(ds, batch_size=8, shuffle=True, num_workers=4, pin_memory=True)
     model = ConvLSTMAE(emb=128, lstm_hid=128).to(DEVICE)
-    opt = torch.optim.Adam(model.parameters(), lr=3e-4, weight_decay=1e-5)
     l1 = nn.L1Loss()
 
-    for epoch in range(20):
+    batch_size, lr = 8, 3e-4
+    loader_kw = dict(num_workers=4, pin_memory=True)
+    if use_autotune:
+        # 按当前节点探测 batch size / DataLoader 设置，学习率按 sqrt 规则缩放
+        def step(model, vol):
+            recon, z_seq = model(vol)
+            (l1(recon, vol) + 0.1 * ((z_seq[:,1:]-z_seq[:,:-1])**2).mean()).backward()
+        cfg = autotune(model, ds, step, DEVICE, base_batch_size=batch_size, base_lr=lr,
+                       workload={"model": "v1", "emb": 128, "lstm_hid": 128})
+        batch_size, lr = cfg["batch_size"], cfg["learning_rate"]
+        loader_kw = dict(num_workers=cfg["num_workers"], pin_memory=cfg["pin_memory"])
+        if cfg["num_workers"] > 0:
+            loader_kw["prefetch_factor"] = cfg["prefetch_factor"]
+    sampler = ResumableSampler(ds, seed=0)            # 可从 epoch 中途恢复的打乱顺序
+    loader = DataLoader(ds, batch_size=batch_size, sampler=sampler, **loader_kw)
+    opt = torch.optim.Adam(model.parameters(), lr=lr, weight_decay=1e-5)
+
+    # 后台线程写 checkpoint（原子重命名，只保留最近 keep_last 个 ae_epoch*.pt）
+    manager = CheckpointManager(".")
+    start_epoch, step, seen, total = 0, 0, 0, 0.0
+    if resume and Path(RESUME_FILE).exists():
+        ck = torch.load(RESUME_FILE, map_location="cpu")  # RNG 状态必须留在 CPU
+        model.load_state_dict(ck["model"]); opt.load_state_dict(ck["opt"])
+        restore_rng_state(ck["rng"])
+        start_epoch, step, seen, total = ck["epoch"], ck["step"], ck["seen"], ck["total"]
+        print(f"从 {RESUME_FILE} 恢复: epoch {start_epoch}, 已完成 {seen} 个样本")
+
+    def state(epoch, seen, total):
+        return {"model": model.state_dict(), "opt": opt.state_dict(), "rng": capture_rng_state(),
+                "epoch": epoch, "step": step, "seen": seen, "total": total}
+
+    # 关闭时所有计时调用都是空操作
+    profiler = StepProfiler(enabled=profile, device=DEVICE, trace_dir=trace_dir)
+    profiler.watch(model, ["enc", "lstm_enc", "lstm_dec", "dec"])
+    training_log = []
+
+    for epoch in range(start_epoch, 20):
         model.train()
+        sampler.set_epoch(epoch)
+        if epoch == start_epoch and seen:
+            sampler.set_start(seen)                   # 跳过中断前已训练的样本
+        else:
+            seen, total = 0, 0.0
         pbar = tqdm(loader, desc=f"epoch {epoch}")
-        total = 0.0
-        for vol, _ in pbar:
-            vol = vol.to(DEVICE)                         # [B,T,1,128,128]
-            recon, z_seq = model(vol)
-            rec_loss = l1(recon, vol)
-            smooth = ((z_seq[:,1:]-z_seq[:,:-1])**2).mean()  # temporal smooth
-            loss = rec_loss + 0.1 * smooth
-            opt.zero_grad(); loss.backward(); opt.step()
+        for vol, _ in profiler.wrap(pbar):
+            with profiler.region("h2d"):
+                vol = vol.to(DEVICE)                     # [B,T,1,128,128]
+            with profiler.region("forward"):
+                recon, z_seq = model(vol)
+            with profiler.region("loss"):
+                rec_loss = l1(recon, vol)
+                smooth = ((z_seq[:,1:]-z_seq[:,:-1])**2).mean()  # temporal smooth
+                loss = rec_loss + 0.1 * smooth
+            with profiler.region("backward"):
+                opt.zero_grad(); loss.backward()
+            with profiler.region("optimizer"):
+                opt.step()
             total += loss.item()
             pbar.set_postfix(loss=f"{loss.item():.4f}", rec=f"{rec_loss.item():.4f}", sm=f"{smooth.item():.4f}")
-        print(f"epoch {epoch} avg loss={total/len(loader):.4f}")
-        torch.save(model.state_dict(), f"ae_epoch{epoch}.pt")
+            step += 1; seen += vol.shape[0]
+            if ckpt_every and step % ckpt_every == 0:
+                manager.save(state(epoch, seen, total), RESUME_FILE)
+            profiler.step()
+        n_batches = -(-len(ds) // batch_size)
+        print(f"epoch {epoch} avg loss={total/n_batches:.4f}")
+        manager.save(model.state_dict(), f"ae_epoch{epoch}.pt", rotate="ae_epoch*.pt", keep_last=keep_last)
+        manager.save(inference_state(model, {"emb": 128, "lstm_hid": 128}, epoch=epoch), "ae_inference_fp16.pt")
+        manager.save(state(epoch + 1, 0, 0.0), RESUME_FILE)
 
-if __name__ == "__main__":
-    train()
+        if profiler.enabled:
+            profiler.sample_memory()
+            print(profiler.format_summary())
+            print(profiler.format_memory())
+            training_log.append({"epoch": epoch, "loss": total/n_batches, "profile": profiler.summary(),
+                                 "memory": profiler.memory_summary()})
+            with open("training_log.json", "w") as f:
+                json.dump(training_log, f, indent=2)
+    profiler.close()
+    manager.close()
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", action="store_true", help="记录每一步各阶段耗时到 training_log.json")
+    parser.add_argument("--trace_dir", type=str, default=None, help="保存 torch.profiler trace 的目录")
+    parser.add_argument("--autotune", action="store_true", help="自动选择 batch size 和 DataLoader 参数")
+    parser.add_argument("--resume", action="store_true", help=f"从 {RESUME_FILE} 继续训练（可在 epoch 中途）")
+    parser.add_argument("--keep_last", type=int, default=5, help="保留最近几个 ae_epoch*.pt（0 = 全部保留）")
+    parser.add_argument("--ckpt_every", type=int, default=0, help=f"每 N 步写一次 {RESUME_FILE}（0 = 只在 epoch 结束）")
+    args = parser.parse_args()
+    train(profile=args.profile, trace_dir=args.trace_dir, use_autotune=args.autotune,
+          resume=args.resume, keep_last=args.keep_last or None, ckpt_every=args.ckpt_every)
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Dynamic time warping between embryo latent trajectories
+
+Scalar summaries such as mean speed depend on how fast an embryo develops
+and on where its first window starts. DTW aligns two trajectories in time
+before comparing them, so these summaries become comparable.
+
+- dtw_batch: exact DTW for many pairs at once (anti-diagonal sweep,
+  vectorized over pairs and cells), Sakoe-Chiba band
+- lb_keogh: lower bounds used to skip pairs in k-NN queries
+- pairwise_dtw: full distance matrix, optionally over a process pool
+- dtw_knn: query-vs-population k-NN with LB_Keogh pruning
+- dtw_matrix_cached: distance matrix memoized in the analysis cache,
+  for reuse by the clustering and outlier steps
+
+The local cost is the squared Euclidean distance between frames. The
+returned distance is the square root of the cheapest accumulated cost.
+
+Usage:
+    python3 trajectory_dtw.py matrix --window 3 --n_jobs 4
+    python3 trajectory_dtw.py query AB028-6 -k 5
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from analysis_cache import StageCache, hash_latents
+from latent_index import frame_vectors
+
+CACHE_DIR = ".analysis_cache"
+DTW_MATRIX_FILE = "dtw_distances.npz"
+
+
+def _stack(seqs):
+    """Pad a list of [T_i, D] trajectories into [N, T_max, D] plus lengths"""
+    lengths = np.array([len(s) for s in seqs])
+    out = np.zeros((len(seqs), lengths.max(), seqs[0].shape[1]), dtype=np.float32)
+    for i, s in enumerate(seqs):
+        out[i, :len(s)] = s
+    return out, lengths
+
+
+def dtw_batch(A, B, window=None, len_a=None, len_b=None):
+    """
+    DTW distance for each pair (A[p], B[p])
+
+    Args:
+        A: (P, Ta, D) trajectories (zero-padded past len_a)
+        B: (P, Tb, D) trajectories (zero-padded past len_b)
+        window: Sakoe-Chiba band half-width (None = unconstrained); widened per
+            pair to |len_a - len_b| so that the end cell stays reachable
+        len_a, len_b: (P,) true lengths (default: full length)
+
+    Returns:
+        (P,) DTW distances
+    """
+    A = np.asarray(A, dtype=np.float32)
+    B = np.asarray(B, dtype=np.float32)
+    P, Ta, _ = A.shape
+    Tb = B.shape[1]
+    len_a = np.full(P, Ta) if len_a is None else np.asarray(len_a)
+    len_b = np.full(P, Tb) if len_b is None else np.asarray(len_b)
+
+    # Local cost (P, Ta, Tb)
+    cost = ((A * A).sum(-1)[:, :, None] + (B * B).sum(-1)[:, None, :]
+            - 2.0 * np.einsum("pid,pjd->pij", A, B))
+    cost = np.maximum(cost, 0.0)
+    if window is not None:
+        w = np.maximum(window, np.abs(len_a - len_b))[:, None, None]
+        ii = np.arange(Ta)[None, :, None]
+        jj = np.arange(Tb)[None, None, :]
+        cost = np.where(np.abs(ii - jj) <= w, cost, np.inf)
+
+    # Accumulated cost, swept along anti-diagonals so that every cell of a
+    # diagonal (and every pair) is updated in one vectorized step
+    acc = np.full((P, Ta + 1, Tb + 1), np.inf, dtype=np.float32)
+    acc[:, 0, 0] = 0.0
+    for s in range(2, Ta + Tb + 1):
+        i = np.arange(max(1, s - Tb), min(Ta, s - 1) + 1)
+        j = s - i
+        best = np.minimum(np.minimum(acc[:, i - 1, j], acc[:, i, j - 1]), acc[:, i - 1, j - 1])
+        acc[:, i, j] = cost[:, i - 1, j - 1] + best
+    return np.sqrt(acc[np.arange(P), len_a, len_b])
+
+
+def envelope(X, window):
+    """
+    Upper/lower envelopes for LB_Keogh
+
+    Args:
+        X: (N, T, D) trajectories
+        window: band half-width
+
+    Returns:
+        U, L: (N, T, D) running max / min over [t - window, t + window]
+    """
+    pad = ((0, 0), (window, window), (0, 0))
+    hi = np.lib.stride_tricks.sliding_window_view(
+        np.pad(X, pad, constant_values=-np.inf), 2 * window + 1, axis=1)
+    lo = np.lib.stride_tricks.sliding_window_view(
+        np.pad(X, pad, constant_values=np.inf), 2 * window + 1, axis=1)
+    return hi.max(-1), lo.min(-1)
+
+
+def lb_keogh(q, U, L):
+    """
+    LB_Keogh lower bound of DTW(q, c) for every candidate c
+
+    Args:
+        q: (T, D) query
+        U, L: (N, T, D) candidate envelopes (same length as q)
+
+    Returns:
+        (N,) lower bounds
+    """
+    above = np.maximum(q[None] - U, 0.0)
+    below = np.maximum(L - q[None], 0.0)
+    return np.sqrt((above ** 2 + below ** 2).sum(axis=(1, 2)))
+
+
+def _pair_chunk(args):
+    X, lengths, pairs, window = args
+    i, j = pairs[:, 0], pairs[:, 1]
+    return dtw_batch(X[i], X[j], window, lengths[i], lengths[j])
+
+
+def pairwise_dtw(seqs, window=None, batch_size=512, n_jobs=1):
+    """
+    Symmetric all-pairs DTW distance matrix
+
+    Args:
+        seqs: list of (T_i, D) trajectories
+        window: Sakoe-Chiba band half-width
+        batch_size: pairs per vectorized DTW call
+        n_jobs: worker processes (1 = run in this process)
+
+    Returns:
+        (N, N) distance matrix
+    """
+    X, lengths = _stack(seqs)
+    n = len(seqs)
+    iu = np.stack(np.triu_indices(n, k=1), axis=1)
+    chunks = [(X, lengths, iu[s:s + batch_size], window) for s in range(0, len(iu), batch_size)]
+    if n_jobs > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            parts = list(pool.map(_pair_chunk, chunks))
+    else:
+        parts = [_pair_chunk(c) for c in chunks]
+    D = np.zeros((n, n), dtype=np.float32)
+    if parts:
+        vals = np.concatenate(parts)
+        D[iu[:, 0], iu[:, 1]] = vals
+        D[iu[:, 1], iu[:, 0]] = vals
+    return D
+
+
+def dtw_knn(query, seqs, k=5, window=3, batch_size=64, exclude=None):
+    """
+    k nearest trajectories to ``query`` under DTW, pruned with LB_Keogh
+
+    Candidates are visited in order of increasing lower bound, one
+    vectorized batch at a time. The search stops once the next lower bound
+    cannot beat the current k-th best distance. Candidates whose length
+    differs from the query get a lower bound of 0, so they are always
+    evaluated exactly.
+
+    Args:
+        query: (T, D) trajectory
+        seqs: list of (T_i, D) trajectories
+        k: number of neighbours
+        window: Sakoe-Chiba band half-width
+        exclude: index into seqs to skip (e.g. the query itself)
+
+    Returns:
+        idx: (k,) indices into seqs, dists: (k,) DTW distances, n_exact: pairs evaluated
+    """
+    query = np.asarray(query, dtype=np.float32)
+    X, lengths = _stack(seqs)
+    lb = np.zeros(len(seqs), dtype=np.float32)
+    same = lengths == len(query)
+    if same.any():
+        U, L = envelope(X[same][:, :len(query)], window)
+        lb[same] = lb_keogh(query, U, L)
+    if exclude is not None:
+        lb[exclude] = np.inf
+
+    order = np.argsort(lb)
+    order = order[np.isfinite(lb[order])]
+    best_idx = np.empty(0, dtype=int)
+    best_d = np.empty(0, dtype=np.float32)
+    n_exact = 0
+    for s in range(0, len(order), batch_size):
+        cand = order[s:s + batch_size]
+        if len(best_d) == k:
+            cand = cand[lb[cand] < best_d[-1]]
+            if len(cand) == 0:
+                break
+        Q = np.broadcast_to(query, (len(cand),) + query.shape)
+        d = dtw_batch(Q, X[cand], window, np.full(len(cand), len(query)), lengths[cand])
+        n_exact += len(cand)
+        best_idx = np.concatenate([best_idx, cand])
+        best_d = np.concatenate([best_d, d])
+        keep = np.argsort(best_d)[:k]
+        best_idx, best_d = best_idx[keep], best_d[keep]
+    return best_idx, best_d, n_exact
+
+
+def knn_outlier_scores(D, k=5):
+    """Mean DTW distance to the k nearest other embryos (higher = more unusual)"""
+    D = D.astype(np.float64, copy=True)
+    np.fill_diagonal(D, np.inf)
+    k = min(k, len(D) - 1)
+    if k < 1:
+        return np.zeros(len(D))
+    return np.sort(D, axis=1)[:, :k].mean(1)
+
+
+def dtw_matrix_cached(latents, window=3, n_jobs=1, cache=None):
+    """
+    All-pairs DTW matrix for a {cell_id: z} dict, memoized in the analysis cache
+
+    Returns:
+        ids: list of cell_ids (row order), D: (N, N) distance matrix
+    """
+    if cache is None:
+        cache = StageCache(CACHE_DIR)
+    ids = list(latents)
+    key = cache.key("dtw_matrix", {"window": window}, input_hash=hash_latents(latents))
+    D = cache.get_or_compute(
+        key, lambda: pairwise_dtw([frame_vectors(latents[c]) for c in ids], window, n_jobs=n_jobs))
+    return ids, D
+
+
+def save_dtw_matrix(ids, D, path=DTW_MATRIX_FILE):
+    np.savez(path, ids=np.asarray(ids, dtype=str), D=D)
+
+
+def load_dtw_matrix(path=DTW_MATRIX_FILE):
+    data = np.load(path, allow_pickle=False)
+    return data["ids"].tolist(), data["D"]
+
+
+def _load_latents(latent_dir):
+    return {f.stem[:-len("_z")]: np.load(f) for f in sorted(Path(latent_dir).glob("*_z.npy"))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DTW alignment of embryo latent trajectories")
+    parser.add_argument("--latent_dir", type=str, default="latents_unique")
+    parser.add_argument("--window", type=int, default=3, help="Sakoe-Chiba band half-width")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_matrix = sub.add_parser("matrix", help="All-pairs distance matrix")
+    p_matrix.add_argument("--n_jobs", type=int, default=1)
+    p_matrix.add_argument("--out", type=str, default=DTW_MATRIX_FILE)
+
+    p_query = sub.add_parser("query", help="k nearest embryos to one embryo")
+    p_query.add_argument("cell_id", type=str)
+    p_query.add_argument("-k", type=int, default=5)
+
+    args = parser.parse_args()
+    latents = _load_latents(args.latent_dir)
+    print(f"Loaded {len(latents)} trajectories from {args.latent_dir}")
+
+    if args.command == "matrix":
+        cache = StageCache(CACHE_DIR)
+        ids, D = dtw_matrix_cached(latents, window=args.window, n_jobs=args.n_jobs, cache=cache)
+        save_dtw_matrix(ids, D, args.out)
+        print(f"✓ Saved {D.shape[0]}x{D.shape[1]} DTW matrix to {args.out} ({cache.summary()})")
+    else:
+        ids = list(latents)
+        seqs = [frame_vectors(latents[c]) for c in ids]
+        q = ids.index(args.cell_id)
+        idx, dists, n_exact = dtw_knn(seqs[q], seqs, k=args.k, window=args.window, exclude=q)
+        for rank, (i, d) in enumerate(zip(idx, dists), 1):
+            print(f"  {rank:2d}. {ids[i]}  dtw={d:.4f}")
+        print(f"exact DTW evaluated for {n_exact}/{len(ids) - 1} embryos")
+
+
+if __name__ == "__main__":
+    main()
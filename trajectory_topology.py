@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Persistent homology of embryo latent trajectories
+
+Each embryo's latent trajectory is a point cloud (one point per frame).
+Its Vietoris-Rips persistence diagrams (H0: clusters, H1: loops) describe
+the shape of the developmental path independently of where it lies in
+latent space.
+
+- greedy_permutation: farthest-point subsampling, bounds the cost of long
+  (whole-embryo) trajectories to ``n_perm`` points
+- rips_diagrams: H0/H1 diagrams with ripser when it is installed (its
+  ``n_perm`` option), otherwise with the built-in reduction below
+- diagrams_cached: diagrams of many embryos over a process pool, cached per
+  embryo in the analysis cache (the key is the latent's hash, so it changes
+  with the checkpoint)
+- persistence_images / persistence_landscapes: fixed-length vectors on a
+  grid shared by the whole population
+- topology_features: one row per embryo (summaries + vectors), joined into
+  embryo_features_summary.csv by analyze_all_embryos.py
+
+ripser and persim are optional. Without ripser, diagrams up to H1 are
+computed by a column reduction of the Rips boundary matrix on the
+subsampled points (exact, the same diagrams ripser returns).
+
+Usage:
+    python3 trajectory_topology.py --n_perm 64 --n_jobs 8 --method image
+"""
+
+import argparse
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from analysis_cache import StageCache, hash_array
+from latent_index import frame_vectors
+
+CACHE_DIR = ".analysis_cache"
+DIAGRAMS_FILE = "persistence_diagrams.npz"
+N_PERM = 64        # points kept per trajectory (greedy subsampling)
+MAXDIM = 1
+PIXELS = 8         # persistence image resolution (H0: 8 bins, H1: 8x8)
+LEVELS = 3         # landscape levels
+SAMPLES = 16       # landscape samples per level
+
+
+def greedy_permutation(X, n_perm):
+    """
+    Indices of ``n_perm`` points picked by farthest-point sampling
+
+    Starts at the first point; every next point is the one farthest from
+    the points picked so far (the greedy permutation ripser uses for n_perm).
+    """
+    n = len(X)
+    if n <= n_perm:
+        return np.arange(n)
+    idx = np.empty(n_perm, dtype=np.int64)
+    idx[0] = 0
+    dist = np.linalg.norm(X - X[0], axis=1)
+    for i in range(1, n_perm):
+        idx[i] = int(dist.argmax())
+        dist = np.minimum(dist, np.linalg.norm(X - X[idx[i]], axis=1))
+    return idx
+
+
+def _rips_reduction(X):
+    """
+    H0 and H1 Rips diagrams of a small point cloud
+
+    Edges are sorted by length. A union-find pass pairs H0 deaths with the
+    edges that merge components; the other edges create loops. Triangle
+    boundary columns (as integer bitsets over edge ranks, in order of their
+    longest edge) are then reduced until every loop is paired.
+    """
+    n = len(X)
+    D = np.sqrt(np.maximum(((X[:, None, :] - X[None, :, :]) ** 2).sum(-1), 0.0))
+    iu, ju = np.triu_indices(n, k=1)
+    order = np.argsort(D[iu, ju], kind="stable")
+    iu, ju = iu[order], ju[order]
+    lengths = D[iu, ju]
+    rank = np.zeros((n, n), dtype=np.int64)
+    rank[iu, ju] = np.arange(len(iu))
+    rank[ju, iu] = rank[iu, ju]
+
+    parent = list(range(n))
+
+    def find(a):
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+
+    h0 = []
+    for e, (a, b) in enumerate(zip(iu.tolist(), ju.tolist())):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[ra] = rb
+            h0.append((0.0, lengths[e]))
+    h0.append((0.0, np.inf))
+    n_loops = len(iu) - (n - 1)
+
+    h1 = []
+    if n_loops > 0 and n >= 3:
+        tri = np.array(list(combinations(range(n), 3)), dtype=np.int64)
+        e = np.sort(np.stack([rank[tri[:, 0], tri[:, 1]], rank[tri[:, 0], tri[:, 2]],
+                              rank[tri[:, 1], tri[:, 2]]], axis=1), axis=1)
+        e = e[np.lexsort((e[:, 1], e[:, 0], e[:, 2]))]
+        pivots = {}
+        paired = 0
+        for e0, e1, e2 in e.tolist():
+            col = (1 << e0) | (1 << e1) | (1 << e2)
+            low = e2
+            while col and low in pivots:
+                col ^= pivots[low]
+                low = col.bit_length() - 1
+            if not col:
+                continue
+            pivots[low] = col
+            paired += 1
+            if lengths[e2] > lengths[low]:
+                h1.append((lengths[low], lengths[e2]))
+            if paired == n_loops:
+                break
+    return [np.array(h0, dtype=np.float64).reshape(-1, 2), np.array(h1, dtype=np.float64).reshape(-1, 2)]
+
+
+def rips_diagrams(z, n_perm=N_PERM, maxdim=MAXDIM):
+    """
+    Vietoris-Rips persistence diagrams of one latent trajectory
+
+    Args:
+        z: (T, D) or (T, C, H, W) latent trajectory
+        n_perm: subsample to this many points (greedy permutation)
+        maxdim: highest homology dimension (1 without ripser)
+
+    Returns:
+        list of (n_k, 2) arrays of (birth, death), one per dimension 0..maxdim
+    """
+    X = frame_vectors(z).astype(np.float64)
+    try:
+        from ripser import ripser
+    except ImportError:
+        if maxdim > 1:
+            raise ValueError("maxdim > 1 needs ripser (pip install ripser)")
+        return _rips_reduction(X[greedy_permutation(X, n_perm)])[:maxdim + 1]
+    kwargs = {"n_perm": n_perm} if len(X) > n_perm else {}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)  # fewer frames than latent dimensions is expected
+        dgms = ripser(X, maxdim=maxdim, **kwargs)["dgms"]
+    return [np.asarray(d, dtype=np.float64) for d in dgms]
+
+
+def _diagram_job(args):
+    z, n_perm, maxdim = args
+    return rips_diagrams(z, n_perm, maxdim)
+
+
+def diagrams_cached(latents, n_perm=N_PERM, maxdim=MAXDIM, n_jobs=None, cache=None):
+    """
+    Persistence diagrams of every embryo, cached per embryo
+
+    Missing diagrams are computed in one process pool.
+
+    Returns:
+        {cell_id: list of diagrams}
+    """
+    if cache is None:
+        cache = StageCache(CACHE_DIR)
+    params = {"n_perm": n_perm, "maxdim": maxdim}
+    keys = {c: cache.key("persistence", params, input_hash=hash_array(z)) for c, z in latents.items()}
+    missing = object()
+    dgms = {c: cache.get(k, missing) for c, k in keys.items()}
+    todo = [c for c, d in dgms.items() if d is missing]
+    if todo:
+        jobs = [(latents[c], n_perm, maxdim) for c in todo]
+        n_jobs = os.cpu_count() if n_jobs is None else n_jobs
+        if n_jobs > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                results = list(pool.map(_diagram_job, jobs, chunksize=max(1, len(jobs) // (n_jobs * 4))))
+        else:
+            results = [_diagram_job(j) for j in jobs]
+        for c, d in zip(todo, results):
+            cache.put(keys[c], d)
+            dgms[c] = d
+    cache.hits += len(latents) - len(todo)
+    cache.misses += len(todo)
+    return dgms
+
+
+def _finite(dgm):
+    dgm = np.asarray(dgm, dtype=np.float64).reshape(-1, 2)
+    return dgm[np.isfinite(dgm[:, 1])]
+
+
+def diagram_summary(dgm):
+    """Count, total / max persistence and persistence entropy of one diagram"""
+    pers = np.diff(_finite(dgm), axis=1).ravel()
+    pers = pers[pers > 0]
+    if len(pers) == 0:
+        return {"count": 0, "total_persistence": 0.0, "max_persistence": 0.0, "entropy": 0.0}
+    p = pers / pers.sum()
+    return {
+        "count": len(pers),
+        "total_persistence": float(pers.sum()),
+        "max_persistence": float(pers.max()),
+        "entropy": float(-(p * np.log(p)).sum()),
+    }
+
+
+def persistence_images(dgms, pixels=PIXELS, sigma=None):
+    """
+    Persistence images of one homology dimension for a population
+
+    Points are mapped to (birth, persistence) and spread with a Gaussian,
+    weighted linearly by persistence, onto a grid that spans the whole
+    population, so vectors of different embryos are comparable. H0 births
+    are all 0, so H0 images are 1-D (persistence only).
+
+    Args:
+        dgms: list of (n_k, 2) diagrams, one per embryo
+        pixels: grid size per axis
+        sigma: Gaussian width (default: one pixel)
+
+    Returns:
+        (N, pixels) for H0-like diagrams or (N, pixels * pixels) array
+    """
+    pts = [_finite(d) for d in dgms]
+    pts = [np.column_stack([p[:, 0], p[:, 1] - p[:, 0]]) for p in pts]
+    allp = np.concatenate(pts) if pts else np.zeros((0, 2))
+    p_max = allp[:, 1].max() if len(allp) else 1.0
+    p_max = p_max if p_max > 0 else 1.0
+    one_d = len(allp) == 0 or np.ptp(allp[:, 0]) == 0
+    b_lo, b_hi = (allp[:, 0].min(), allp[:, 0].max()) if len(allp) else (0.0, 1.0)
+    pers_grid = (np.arange(pixels) + 0.5) / pixels * p_max
+    birth_grid = b_lo + (np.arange(pixels) + 0.5) / pixels * max(b_hi - b_lo, 1e-12)
+    sigma = sigma or p_max / pixels
+    out = np.zeros((len(pts), pixels if one_d else pixels * pixels))
+    for i, p in enumerate(pts):
+        if len(p) == 0:
+            continue
+        w = p[:, 1] / p_max
+        gp = np.exp(-(pers_grid[None, :] - p[:, 1:2]) ** 2 / (2 * sigma ** 2))  # (n, pixels)
+        if one_d:
+            out[i] = (w[:, None] * gp).sum(0)
+        else:
+            gb = np.exp(-(birth_grid[None, :] - p[:, 0:1]) ** 2 / (2 * sigma ** 2))
+            out[i] = np.einsum("n,nb,np->bp", w, gb, gp).ravel()
+    return out
+
+
+def persistence_landscapes(dgms, levels=LEVELS, samples=SAMPLES):
+    """
+    Persistence landscapes of one homology dimension for a population
+
+    lambda_k(t) is the k-th largest tent function max(0, min(t - b, d - t))
+    over the diagram's points, sampled on a grid spanning the population.
+
+    Returns:
+        (N, levels * samples) array
+    """
+    pts = [_finite(d) for d in dgms]
+    allp = np.concatenate(pts) if pts else np.zeros((0, 2))
+    lo, hi = (allp[:, 0].min(), allp[:, 1].max()) if len(allp) else (0.0, 1.0)
+    t = np.linspace(lo, hi, samples)
+    out = np.zeros((len(pts), levels, samples))
+    for i, p in enumerate(pts):
+        if len(p) == 0:
+            continue
+        tents = np.maximum(0.0, np.minimum(t[None, :] - p[:, 0:1], p[:, 1:2] - t[None, :]))
+        tents = -np.sort(-tents, axis=0)[:levels]
+        out[i, :len(tents)] = tents
+    return out.reshape(len(pts), -1)
+
+
+def topology_features(dgms, method="image", maxdim=MAXDIM):
+    """
+    Feature table from persistence diagrams
+
+    Args:
+        dgms: {cell_id: list of diagrams} (diagrams_cached)
+        method: "image" (persistence images), "landscape" or "none" (summaries only)
+
+    Returns:
+        DataFrame with embryo_id, h<k>_count / total_persistence /
+        max_persistence / entropy and h<k>_img_* or h<k>_land_* columns
+    """
+    ids = list(dgms)
+    columns = {"embryo_id": ids}
+    for k in range(maxdim + 1):
+        per_dim = [dgms[c][k] if k < len(dgms[c]) else np.zeros((0, 2)) for c in ids]
+        summaries = [diagram_summary(d) for d in per_dim]
+        for name in ("count", "total_persistence", "max_persistence", "entropy"):
+            columns[f"h{k}_{name}"] = [s[name] for s in summaries]
+        if method == "image":
+            vec, prefix = persistence_images(per_dim), f"h{k}_img"
+        elif method == "landscape":
+            vec, prefix = persistence_landscapes(per_dim), f"h{k}_land"
+        elif method == "none":
+            continue
+        else:
+            raise ValueError(f"Unknown vectorization {method!r}, use image, landscape or none")
+        for j in range(vec.shape[1]):
+            columns[f"{prefix}_{j:02d}"] = vec[:, j]
+    return pd.DataFrame(columns)
+
+
+def save_diagrams(dgms, path=DIAGRAMS_FILE):
+    """All diagrams in one .npz, keys "<cell_id>/H<k>" """
+    np.savez(path, **{f"{c}/H{k}": d for c, ds in dgms.items() for k, d in enumerate(ds)})
+
+
+def _load_latents(latent_dir):
+    return {f.stem[:-len("_z")]: np.load(f) for f in sorted(Path(latent_dir).glob("*_z.npy"))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent homology of embryo latent trajectories")
+    parser.add_argument("--latent_dir", type=str, default="latents_unique")
+    parser.add_argument("--n_perm", type=int, default=N_PERM, help="Points kept per trajectory (greedy subsampling)")
+    parser.add_argument("--maxdim", type=int, default=MAXDIM, help="Highest homology dimension (>1 needs ripser)")
+    parser.add_argument("--n_jobs", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--method", type=str, default="image", choices=["image", "landscape", "none"])
+    parser.add_argument("--out", type=str, default="topology_features.csv")
+    args = parser.parse_args()
+
+    latents = _load_latents(args.latent_dir)
+    print(f"Loaded {len(latents)} trajectories from {args.latent_dir}")
+    cache = StageCache(CACHE_DIR)
+    dgms = diagrams_cached(latents, args.n_perm, args.maxdim, args.n_jobs, cache)
+    save_diagrams(dgms)
+    df = topology_features(dgms, args.method, args.maxdim)
+    df.to_csv(args.out, index=False)
+    print(f"✓ Saved {len(df)}x{df.shape[1] - 1} topology features to {args.out} "
+          f"and diagrams to {DIAGRAMS_FILE} ({cache.summary()})")
+
+
+if __name__ == "__main__":
+    main()